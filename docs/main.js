@@ -31,6 +31,8 @@ var load_config = function() {
 
 var process_config = function(data) {
     json_config = data
+    // a paged config lists the first page in files: the other pages are loaded when needed
+    json_config.pages_loaded = (data.pages && data.pages.length) ? 1 : 0;
     div_status.html("initializing: " + detect_gpu());
     var files_info = data.files;
     chosen_prefix = files_info[0].prefix;
@@ -43,13 +45,66 @@ var process_config = function(data) {
     }
     var q = searchParams.get("q");
     main_url = url.split("?")[0];
-    for (var i=0; i<files_info.length; i++) {
-        var prefix = files_info[i].prefix;
-        if (q == prefix) {
-            chosen_prefix = prefix;
-            chosen_index = i;
+    if (!q) {
+        select_dataset();
+        return;
+    }
+    find_config_entry(function(entry) { return entry.prefix == q; }, 0, function(index) {
+        if (index >= 0) {
+            chosen_prefix = q;
+            chosen_index = index;
+        }
+        select_dataset();
+    });
+};
+
+var load_config_page = function(callback) {
+    // Append the entries of the next config page to json_config.files; callback(false) if there are no more pages.
+    var pages = json_config.pages || [];
+    var index = json_config.pages_loaded;
+    if (index >= pages.length) {
+        callback(false);
+        return;
+    }
+    var path = "./" + pages[index].file;
+    div_status.html("loading configuration page: " + path);
+    $.getJSON(path, function(page) {
+        json_config.files = json_config.files.concat(page.files);
+        json_config.pages_loaded = index + 1;
+        callback(true);
+    }).fail(on_load_failure(path));
+};
+
+var find_config_entry = function(test, start, callback) {
+    // callback(index) of the first config entry from start which passes test (-1 if none), loading pages as needed.
+    var files_info = json_config.files;
+    for (var i=start; i<files_info.length; i++) {
+        if (test(files_info[i])) {
+            callback(i);
+            return;
         }
     }
+    load_config_page(function(loaded) {
+        if (loaded) {
+            find_config_entry(test, files_info.length, callback);
+        } else {
+            callback(-1);
+        }
+    });
+};
+
+var series_range = function() {
+    // With ?scale=global, the range of the variable across all the outputs in the config.
+    var variables = json_config.variables;
+    if ((searchParams.get("scale") != "global") || (!variables) || (!variables[json_data.variable])) {
+        return null;
+    }
+    var range = variables[json_data.variable];
+    return [range.intensity_min, range.intensity_max];
+};
+
+var select_dataset = function() {
+    var files_info = json_config.files;
     // populate the dropdown selection
     var selection_span = $("#dataset_selection");
     var selection = $("<select/>").appendTo(selection_span);
@@ -72,7 +127,16 @@ var process_config = function(data) {
     };
     selection.change(select_change)
     //load_json("uniform");
-    load_json(chosen_prefix);
+    // ?series=prefix&frame=N shows one frame of a time series
+    var series = searchParams.get("series");
+    var mesh = searchParams.get("mesh");
+    if (series) {
+        load_series(series, +(searchParams.get("frame") || 0));
+    } else if (mesh) {
+        load_mesh(mesh, +(searchParams.get("level") || 0));
+    } else {
+        load_json(chosen_prefix);
+    }
 };
 
 var detect_gpu = function() {
@@ -96,33 +160,59 @@ var detect_gpu = function() {
 };
 
 var load_next = function(match_string, delayed) {
-    var data = json_config;
-    var files_info = data.files;
-    var next_index;
-    var next_prefix;
-    for (var index = chosen_index+1; index < files_info.length; index++) {
-        var prefix = files_info[index].prefix;
-        if ((!match_string) || (prefix.includes(match_string))) {
-            next_index = index;
-            next_prefix = prefix;
-            break;
+    // Returns a Promise of the next href, or of null if there is no next view.
+    var href = null;
+    var go = function(href) {
+        if (!delayed) {
+            document.location.href = href;
         }
+        return href;
+    };
+    var no_next = function() {
+        $("#load_next").html("NO NEXT");
+        return null;
+    };
+    if (searchParams.get("series") && json_data) {
+        // the next frame of the time series
+        var frame = json_data.frame_index + 1;
+        if (frame >= json_data.num_frames) {
+            return Promise.resolve(no_next());
+        }
+        href = main_url + "?series=" + searchParams.get("series") + "&frame=" + frame + "&camera=" + get_camera_json_string();
+        return Promise.resolve(go(href));
     }
-    if (!next_index) {
-        var load_button = $("#load_next");
-        load_button.html("NO NEXT")
-        return null;  // No next file
-    }
-    chosen_index = next_index;
-    chosen_prefix = next_prefix;
-    var camera_json = get_camera_json_string();
-    // invalidate the json data
-    json_data = null;
-    var href = main_url + "?q=" + chosen_prefix + "&camera=" + camera_json;
-    if (!delayed) {
-        document.location.href = href;
+    if (searchParams.get("mesh") && json_data) {
+        // the next level of the isosurface meshes
+        var level = json_data.level_index + 1;
+        if (level >= json_data.levels.length) {
+            return Promise.resolve(no_next());
+        }
+        href = main_url + "?mesh=" + searchParams.get("mesh") + "&level=" + level + "&camera=" + get_camera_json_string();
+        return Promise.resolve(go(href));
     }
-    return href;
+    var test = function(entry) {
+        return (!match_string) || (entry.prefix.includes(match_string));
+    };
+    // resolves after any later config pages needed have loaded
+    return new Promise(function(resolve) {
+        find_config_entry(test, chosen_index+1, function(next_index) {
+            if (next_index < 0) {
+                resolve(no_next());  // No next file
+                return;
+            }
+            chosen_index = next_index;
+            chosen_prefix = json_config.files[next_index].prefix;
+            var camera_json = get_camera_json_string();
+            // invalidate the json data
+            json_data = null;
+            href = main_url + "?q=" + chosen_prefix + "&camera=" + camera_json;
+            var scale = searchParams.get("scale");
+            if (scale) {
+                href = href + "&scale=" + scale;
+            }
+            resolve(go(href));
+        });
+    });
 };
 
 var load_json = function(prefix, next_action) {
@@ -143,6 +233,12 @@ var on_load_failure = function(path) {
 var get_values = function(data, next_action) {
     next_action = next_action || do_plot;
     json_data = data;
+    // ?blocks=range fetches only the blocks needed for the first surface
+    var directory = json_data.block_directory;
+    if ((searchParams.get("blocks") == "range") && directory && directory.offset) {
+        get_block_ranges(next_action);
+        return;
+    }
     var bin_file_name = json_data.binary_file;
     var bin_file_url = DATA_DIR + "/" + bin_file_name;
     div_status.html("Getting binary: " + bin_file_url);
@@ -156,14 +252,423 @@ var get_values = function(data, next_action) {
         //reader.readAsDataURL(request.response);
         reader.onload =  function(a){
             div_status.html("Converting binary data: " + bin_file_url);
-            values_array = new Float32Array(reader.result);
-            next_action();
+            decompress_binary(reader.result, function(buffer) {
+                unpack_binary(buffer);
+                next_action();
+            });
         };
     };
     request.onerror = on_load_failure(bin_file_url);
     request.send();
 };
 
+var select_blocks = function() {
+    // Blocks whose value range contains the threshold (default the middle of the value range)
+    // and which overlap the optional r_limits=low,high url parameter.
+    var directory = json_data.block_directory;
+    var threshold = searchParams.get("threshold");
+    if (threshold === null) {
+        threshold = 0.5 * (json_data.intensity_min + json_data.intensity_max);
+    }
+    threshold = +threshold;
+    var r_low = -Infinity, r_high = Infinity;
+    var r_limits = searchParams.get("r_limits");
+    if (r_limits) {
+        var split = r_limits.split(",");
+        r_low = +split[0];
+        r_high = +split[1];
+    }
+    var selected = [];
+    for (var block = 0; block < json_data.num_blocks; block++) {
+        if ((directory.value_min[block] <= threshold) && (threshold <= directory.value_max[block]) &&
+            (directory.r_max[block] >= r_low) && (directory.r_min[block] <= r_high)) {
+            selected.push(block);
+        }
+    }
+    if (selected.length == 0) {
+        // nothing crosses the threshold: load everything
+        for (var block = 0; block < json_data.num_blocks; block++) {
+            selected.push(block);
+        }
+    }
+    return selected;
+};
+
+var fetch_range = function(url, start, end) {
+    // bytes [start, end) of url, also when the server ignores the Range header
+    var headers = {Range: "bytes=" + start + "-" + (end - 1)};
+    return fetch(url, {headers: headers}).then(function(response) {
+        if (!response.ok) {
+            throw new Error(url + ": status " + response.status);
+        }
+        return response.arrayBuffer().then(function(buffer) {
+            if (response.status == 206) {
+                return buffer;
+            }
+            return buffer.slice(start, end);
+        });
+    });
+};
+
+var block_runs = function(selected) {
+    // runs [first, last] of consecutive selected blocks, which are contiguous in the file
+    var runs = [];
+    for (var i = 0; i < selected.length; i++) {
+        var block = selected[i];
+        var run = runs[runs.length - 1];
+        if (run && (run[1] + 1 == block)) {
+            run[1] = block;
+        } else {
+            runs.push([block, block]);
+        }
+    }
+    return runs;
+};
+
+var get_block_ranges = function(next_action) {
+    var bin_file_url = DATA_DIR + "/" + json_data.binary_file;
+    var directory = json_data.block_directory;
+    var selected = select_blocks();
+    var runs = block_runs(selected);
+    div_status.html("Getting " + selected.length + " of " + json_data.num_blocks + " blocks in " +
+        runs.length + " ranges: " + bin_file_url);
+    var requests = [fetch_range(bin_file_url, 0, json_data.values_offset)];
+    for (var i = 0; i < runs.length; i++) {
+        var first = runs[i][0], last = runs[i][1];
+        requests.push(fetch_range(bin_file_url, directory.offset[first], directory.offset[last] + directory.length[last]));
+    }
+    Promise.all(requests).then(function(buffers) {
+        div_status.html("Converting binary data: " + bin_file_url);
+        var buffer = compact_blocks(buffers[0], buffers.slice(1), selected);
+        unpack_binary(buffer);
+        next_action();
+    }).catch(on_load_failure(bin_file_url));
+};
+
+var compact_blocks = function(header, value_buffers, selected) {
+    // Build a binary in the dump_files layout holding only the selected blocks
+    // and adjust json_data to describe it.
+    var sizes = [json_data.r_size + 1, json_data.theta_size + 1, json_data.phi_size + 1];
+    var offsets = [json_data.r_values_offset, json_data.theta_values_offset, json_data.phi_values_offset];
+    var num_selected = selected.length;
+    var new_offsets = [];
+    var offset = 0;
+    for (var i = 0; i < 3; i++) {
+        new_offsets.push(offset);
+        offset += num_selected * sizes[i] * 4;
+    }
+    var values_bytes = 0;
+    for (var i = 0; i < value_buffers.length; i++) {
+        values_bytes += value_buffers[i].byteLength;
+    }
+    var result = new Uint8Array(offset + values_bytes);
+    for (var i = 0; i < 3; i++) {
+        var coordinates = new Float32Array(header, offsets[i], json_data.num_blocks * sizes[i]);
+        var new_coordinates = new Float32Array(result.buffer, new_offsets[i], num_selected * sizes[i]);
+        for (var j = 0; j < num_selected; j++) {
+            var block = selected[j];
+            new_coordinates.set(coordinates.subarray(block * sizes[i], (block + 1) * sizes[i]), j * sizes[i]);
+        }
+    }
+    var values_offset = offset;
+    for (var i = 0; i < value_buffers.length; i++) {
+        result.set(new Uint8Array(value_buffers[i]), offset);
+        offset += value_buffers[i].byteLength;
+    }
+    if (json_data.block_offsets) {
+        json_data.block_offsets = selected.map(function(block) { return json_data.block_offsets[block]; });
+        json_data.block_scales = selected.map(function(block) { return json_data.block_scales[block]; });
+    }
+    json_data.r_values_offset = new_offsets[0];
+    json_data.theta_values_offset = new_offsets[1];
+    json_data.phi_values_offset = new_offsets[2];
+    json_data.values_offset = values_offset;
+    json_data.num_blocks = num_selected;
+    json_data.loaded_blocks = selected;
+    return result.buffer;
+};
+
+var decompress_binary = function(buffer, callback) {
+    // .bin.gz files arrive still compressed unless the server sent Content-Encoding: gzip.
+    var bytes = new Uint8Array(buffer, 0, Math.min(2, buffer.byteLength));
+    if ((bytes.length < 2) || (bytes[0] != 0x1f) || (bytes[1] != 0x8b)) {
+        callback(buffer);
+        return;
+    }
+    var stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream("gzip"));
+    new Response(stream).arrayBuffer().then(callback);
+};
+
+var load_series = function(prefix, index, next_action) {
+    next_action = next_action || do_plot;
+    var path = DATA_DIR + "/" + prefix + ".series.json";
+    div_status.html("Getting time series json: " + path);
+    $.getJSON(path, function(series) {
+        get_series_frame(series, index, next_action);
+    }).fail(on_load_failure(path));
+};
+
+var inflate = function(buffer) {
+    // promise of the zlib decompressed bytes
+    var stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream("deflate"));
+    return new Response(stream).arrayBuffer();
+};
+
+var get_series_frame = function(series, index, next_action) {
+    // Decode frame index of a time series from its keyframe and the following delta records,
+    // fetching the geometry and the records with two range requests.
+    var frame = series.frames[index];
+    var first = series.frames[frame.keyframe];
+    var url = DATA_DIR + "/" + series.binary_file;
+    div_status.html("Getting frames " + frame.keyframe + " to " + index + ": " + url);
+    Promise.all([
+        fetch_range(url, 0, series.values_offset),
+        fetch_range(url, first.offset, frame.offset + frame.length),
+    ]).then(function(buffers) {
+        json_data = series;
+        json_data.frame_index = index;
+        json_data.time = frame.time;
+        json_data.intensity_min = frame.intensity_min;
+        json_data.intensity_max = frame.intensity_max;
+        var num_blocks = series.num_blocks;
+        var section = function(offset, count) {
+            return new Float32Array(buffers[0], offset, count);
+        };
+        json_data.r_values = section(series.r_values_offset, num_blocks * (series.r_size + 1));
+        json_data.theta_values = section(series.theta_values_offset, num_blocks * (series.theta_size + 1));
+        json_data.phi_values = section(series.phi_values_offset, num_blocks * (series.phi_size + 1));
+        var values = null;
+        var chain = Promise.resolve();
+        for (var i = frame.keyframe; i <= index; i++) {
+            (function(record) {
+                var start = record.offset - first.offset;
+                chain = chain.then(function() {
+                    return inflate(buffers[1].slice(start, start + record.length));
+                }).then(function(decompressed) {
+                    values = decode_series_record(series, decompressed, values);
+                });
+            })(series.frames[i]);
+        }
+        return chain.then(function() {
+            values_array = values;
+            next_action();
+        });
+    }).catch(function(error) {
+        alert(url + ": could not load time series frame: " + error);
+    });
+};
+
+var decode_series_record = function(series, record, previous) {
+    // Keyframes hold shuffled float32 values; delta records hold float32 block scales followed by
+    // shuffled quantized differences from the previous frame.
+    if (previous === null) {
+        return new Float32Array(unshuffle_bytes(new Uint8Array(record), 4).buffer);
+    }
+    var num_blocks = series.num_blocks;
+    var block_size = series.r_size * series.theta_size * series.phi_size;
+    var scales = new Float32Array(record, 0, num_blocks);
+    var item_size = (series.delta_encoding == "int8") ? 1 : 2;
+    var bytes = unshuffle_bytes(new Uint8Array(record, num_blocks * 4), item_size);
+    var quantized = (item_size == 1) ? new Int8Array(bytes.buffer) : new Int16Array(bytes.buffer);
+    var values = new Float32Array(previous.length);
+    for (var block = 0; block < num_blocks; block++) {
+        var scale = scales[block];
+        for (var i = block * block_size; i < (block + 1) * block_size; i++) {
+            values[i] = previous[i] + quantized[i] * scale;
+        }
+    }
+    return values;
+};
+
+var load_mesh = function(prefix, index) {
+    // ?mesh=prefix&level=N shows a precomputed isosurface mesh written by isosurface.py
+    var path = DATA_DIR + "/" + prefix + ".mesh.json";
+    div_status.html("Getting isosurface mesh json: " + path);
+    $.getJSON(path, function(mesh_json) {
+        get_mesh_level(mesh_json, index, show_mesh);
+    }).fail(on_load_failure(path));
+};
+
+var get_mesh_level = function(mesh_json, index, next_action) {
+    var level = mesh_json.levels[index];
+    var url = DATA_DIR + "/" + mesh_json.binary_file;
+    div_status.html("Getting isosurface level " + level.level + " from " + url);
+    Promise.all([
+        fetch_range(url, level.positions_offset, level.positions_offset + level.positions_bytes),
+        fetch_range(url, level.indices_offset, level.indices_offset + level.indices_bytes),
+    ]).then(function(buffers) {
+        // positions are quantized to the bounding box of the level
+        var quantized = new Uint16Array(buffers[0]);
+        var positions = new Float32Array(quantized.length);
+        var low = level.position_min, scale = level.position_scale;
+        for (var i = 0; i < quantized.length; i++) {
+            var axis = i % 3;
+            positions[i] = low[axis] + quantized[i] * scale[axis];
+        }
+        var indices = (level.index_type == "uint16") ? new Uint16Array(buffers[1]) : new Uint32Array(buffers[1]);
+        mesh_json.level_index = index;
+        json_data = mesh_json;
+        next_action(level, positions, indices);
+    }).catch(function(error) {
+        alert(url + ": could not load isosurface mesh: " + error);
+    });
+};
+
+var show_mesh = function(level, positions, indices) {
+    div_status.html("Isosurface at " + level.level + ": " + level.vertices + " vertices, " + level.triangles + " triangles.");
+    var container = document.getElementById( 'isosurface' );
+    var $container = $(container);
+    $container.empty();
+    var canvas = document.createElement( 'canvas' );
+    surface_canvas = canvas;
+    var context = canvas.getContext( 'webgl2', { alpha: false } );
+    surface_context = context;
+    var renderer = new THREE.WebGLRenderer( { canvas: canvas, context: context } );
+    surface_renderer = renderer;
+    renderer.setPixelRatio( window.devicePixelRatio );
+    renderer.setSize( $container.width(), $container.height() );
+    renderer.outputEncoding = THREE.sRGBEncoding;
+    container.appendChild( renderer.domElement );
+
+    var geometry = new THREE.BufferGeometry();
+    geometry.setAttribute("position", new THREE.BufferAttribute(positions, 3));
+    geometry.setIndex(new THREE.BufferAttribute(indices, 1));
+    geometry.computeVertexNormals();
+    geometry.computeBoundingSphere();
+    var material = new THREE.MeshNormalMaterial( {  } );
+    material.side = THREE.DoubleSide;
+    surface_mesh = new THREE.Mesh( geometry, material );
+    var scene = new THREE.Scene();
+    surface_scene = scene;
+    scene.add(surface_mesh);
+
+    var camera = new THREE.PerspectiveCamera( 45, $container.width()/$container.height(), 0.1, 10000 );
+    surface_camera = camera;
+    surfaceControls = new THREE.OrbitControls(camera, renderer.domElement);
+    surfaceControls.userZoom = false;
+    surfaceClock = new THREE.Clock();
+    var camera_json = searchParams.get("camera");
+    if (camera_json) {
+        var object = JSON.parse(camera_json);
+        camera.position.fromArray(object.d);
+        camera.quaternion.fromArray(object.q);
+        camera.scale.fromArray(object.s);
+    } else {
+        // look at the whole mesh (or the whole data if the level is empty)
+        var sphere = geometry.boundingSphere;
+        var radius = (level.vertices > 0) ? sphere.radius : json_data.r_max;
+        camera.position.set(0, 0, 2.5 * radius);
+        camera.lookAt(0, 0, 0);
+    }
+    var render = function() {
+        surfaceControls.update(surfaceClock.getDelta());
+        renderer.setRenderTarget(null);
+        renderer.render( scene, camera );
+        surface_drawn = true;
+        if (!stop_animation) {
+            requestAnimationFrame( render );
+        }
+    };
+    render();
+};
+
+var VALUE_BYTES = {float32: 4, float16: 2, uint16: 2, uint8: 1};
+
+var float16_table = null;
+
+var get_float16_table = function() {
+    // float32 value of every float16 bit pattern
+    if (!float16_table) {
+        float16_table = new Float32Array(65536);
+        for (var h = 0; h < 65536; h++) {
+            var sign = (h & 0x8000) ? -1 : 1;
+            var exponent = (h >> 10) & 0x1f;
+            var fraction = h & 0x3ff;
+            var value;
+            if (exponent == 0) {
+                value = sign * Math.pow(2, -14) * (fraction / 1024);
+            } else if (exponent == 31) {
+                value = fraction ? NaN : sign * Infinity;
+            } else {
+                value = sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+            }
+            float16_table[h] = value;
+        }
+    }
+    return float16_table;
+};
+
+var unshuffle_bytes = function(bytes, item_size) {
+    // inverse of the Python shuffle_bytes: bytes are grouped by byte position
+    var count = bytes.length / item_size;
+    var result = new Uint8Array(bytes.length);
+    for (var b = 0; b < item_size; b++) {
+        var start = b * count;
+        for (var i = 0; i < count; i++) {
+            result[i * item_size + b] = bytes[start + i];
+        }
+    }
+    return result;
+};
+
+var decode_values = function(buffer) {
+    // Decode the values section to a Float32Array following the encoding in the json.
+    var encoding = json_data.values_encoding || "float32";
+    var item_size = VALUE_BYTES[encoding];
+    var num_blocks = json_data.num_blocks;
+    var block_size = json_data.r_size * json_data.theta_size * json_data.phi_size;
+    var result = new Float32Array(num_blocks * block_size);
+    var table = (encoding == "float16") ? get_float16_table() : null;
+    for (var block = 0; block < num_blocks; block++) {
+        var offset = json_data.values_offset + block * block_size * item_size;
+        var bytes = new Uint8Array(buffer, offset, block_size * item_size);
+        if (json_data.shuffle) {
+            bytes = unshuffle_bytes(bytes, item_size);
+        } else {
+            bytes = bytes.slice();
+        }
+        var start = block * block_size;
+        if (encoding == "float32") {
+            result.set(new Float32Array(bytes.buffer), start);
+        } else if (encoding == "float16") {
+            var halves = new Uint16Array(bytes.buffer);
+            for (var i = 0; i < block_size; i++) {
+                result[start + i] = table[halves[i]];
+            }
+        } else {
+            var quantized = (encoding == "uint16") ? new Uint16Array(bytes.buffer) : bytes;
+            var m = json_data.block_offsets[block];
+            var scale = json_data.block_scales[block];
+            for (var i = 0; i < block_size; i++) {
+                result[start + i] = m + quantized[i] * scale;
+            }
+        }
+    }
+    return result;
+};
+
+var unpack_binary = function(buffer) {
+    // Binary files hold float32 r, theta and phi face values followed by the values
+    // at the byte offsets given in the json.  Older files keep the coordinates in the json.
+    if (json_data.values_offset === undefined) {
+        values_array = new Float32Array(buffer);
+        return;
+    }
+    var num_blocks = json_data.num_blocks;
+    var section = function(offset, count) {
+        return new Float32Array(buffer, offset, count);
+    };
+    json_data.r_values = section(json_data.r_values_offset, num_blocks * (json_data.r_size + 1));
+    json_data.theta_values = section(json_data.theta_values_offset, num_blocks * (json_data.theta_size + 1));
+    json_data.phi_values = section(json_data.phi_values_offset, num_blocks * (json_data.phi_size + 1));
+    if (((json_data.values_encoding || "float32") == "float32") && !json_data.shuffle) {
+        values_array = section(json_data.values_offset,
+            num_blocks * json_data.r_size * json_data.theta_size * json_data.phi_size);
+    } else {
+        values_array = decode_values(buffer);
+    }
+};
+
 var do_plot = function () {
     div_status.html("Initializing plot for " + json_data.binary_file)
     var layerScale = new Float32Array(json_data.r_values);
@@ -193,6 +698,12 @@ var do_plot = function () {
 
     var m = json_data.intensity_min;
     var M = json_data.intensity_max;
+    var range = series_range();
+    if (range) {
+        // consistent color scale across the series
+        m = range[0];
+        M = range[1];
+    }
     //M = 0.3 // XXXXX TESTING ONLY
     var mid = 0.5 * (m + M);
     threshold = mid;
@@ -367,7 +878,8 @@ var get_camera_json_string = function () {
     var d = new THREE.Vector3(),
         q = new THREE.Quaternion(),
         s = new THREE.Vector3();
-    voxel_camera.matrixWorld.decompose( d, q, s );
+    // the mesh view has only the isosurface camera
+    (voxel_camera || surface_camera).matrixWorld.decompose( d, q, s );
     var object = {
         d: d.toArray(),
         q: q.toArray(),
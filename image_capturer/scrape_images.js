@@ -83,6 +83,7 @@ var run = (async() => {
         
         count ++;
         console.log("scraper at " + count + " wrote " + path);
+        // load_next returns a Promise which resolves after any later config page has loaded
         var next_url = await page.evaluate("load_next('', true)")
         if (next_url) {
             console.log("scraper loading next url and sleeping: " + next_url);
@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for the preprocessing pipeline.
+
+- synthetic: generate .athdf files with configurable meshblocks, refinement levels and variables.
+- suite: timed benchmarks with JSON results and comparison against a baseline.
+"""
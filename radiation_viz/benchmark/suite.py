@@ -0,0 +1,198 @@
+"""
+Timed benchmarks of the preprocessing hot paths on a synthetic (or given) .athdf file.
+
+Each benchmark runs --repeats times and records the best and median wall clock seconds.
+Results are written as JSON; with --baseline they are compared to stored results and any
+benchmark slower than the baseline by more than --tolerance is reported as a regression
+(exit status 1).
+
+Example usage:
+
+$ python -m radiation_viz.benchmark.suite --blocks 256 --block_size 16,16,16 --levels 1 --output results.json
+$ python -m radiation_viz.benchmark.suite --blocks 256 --block_size 16,16,16 --levels 1 --baseline results.json
+"""
+
+import argparse
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import numpy as np
+from .. import dump_json_and_binary
+from . import synthetic
+
+BENCHMARKS = ("read", "truncate", "expand", "expand_parallel", "dump_files", "dump_files_uint16",
+    "interpolator", "locate", "lookup")
+
+RESULTS_VERSION = 1
+
+def timed(function, repeats):
+    "(wall clock seconds of each call, result of the last call)."
+    times = []
+    result = None
+    for i in range(repeats):
+        # drop the previous result first so it does not count against the memory of the next call
+        result = None
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return (times, result)
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+class Suite:
+
+    def __init__(self, source_path, scratch_directory, repeats=3, workers=2, points=100000, skip=4, seed=0, verbose=True):
+        (self.source_path, self.scratch_directory) = (source_path, scratch_directory)
+        (self.repeats, self.workers, self.points, self.skip, self.seed) = (repeats, workers, points, skip, seed)
+        self.verbose = verbose
+        self.results = {}
+
+    def record(self, name, times, items=None, unit=None):
+        result = {"best": min(times), "median": float(np.median(times)), "times": times}
+        if items is not None:
+            result["items"] = items
+            result["unit"] = unit
+            result["items_per_second"] = items / min(times) if min(times) > 0 else None
+        self.results[name] = result
+        if self.verbose:
+            print("    %-18s best %9.4f s  median %9.4f s" % (name, result["best"], result["median"]))
+
+    def run(self, names=BENCHMARKS):
+        "Run the named benchmarks in order (later ones reuse the data of earlier ones)."
+        for name in names:
+            assert name in BENCHMARKS, "unknown benchmark " + repr(name)
+        read = lambda: dump_json_and_binary.get_values_and_geometry(self.source_path, verbose=False)
+        (times, blocks) = timed(read, self.repeats)
+        if "read" in names:
+            self.record("read", times, blocks.bytes_read, "bytes")
+        if "truncate" in names:
+            (times, truncated) = timed(lambda: blocks.truncate_r_phi(self.skip, verbose=False), self.repeats)
+            self.record("truncate", times, blocks.values.size, "values")
+        (times, expanded) = timed(lambda: blocks.expand(verbose=False), self.repeats)
+        if "expand" in names:
+            self.record("expand", times, blocks.values.size, "values")
+        if "expand_parallel" in names and self.workers > 1:
+            (times, parallel) = timed(lambda: blocks.expand(verbose=False, workers=self.workers), self.repeats)
+            assert np.array_equal(np.asarray(parallel.values), np.asarray(expanded.values)), "parallel expansion differs"
+            self.record("expand_parallel", times, blocks.values.size, "values")
+        for (name, encoding) in (("dump_files", "float32"), ("dump_files_uint16", "uint16")):
+            if name in names:
+                dump = lambda: expanded.dump_files(self.scratch_directory, "benchmark_" + name, verbose=False, encoding=encoding)
+                (times, filenames) = timed(dump, self.repeats)
+                nbytes = sum(os.path.getsize(os.path.join(self.scratch_directory, fn)) for fn in filenames)
+                self.record(name, times, nbytes, "bytes")
+        (times, interpolator) = timed(blocks.interpolator, self.repeats)
+        if "interpolator" in names:
+            self.record("interpolator", times, len(interpolator.blocks), "blocks")
+        rng = np.random.RandomState(self.seed)
+        points = interpolator.mins + rng.uniform(size=(self.points, 3)) * (interpolator.maxes - interpolator.mins)
+        if "locate" in names:
+            (times, located) = timed(lambda: interpolator.locate_points(points), self.repeats)
+            self.record("locate", times, self.points, "points")
+        if "lookup" in names:
+            (times, values) = timed(lambda: interpolator.interpolate_points(points), self.repeats)
+            self.record("lookup", times, self.points, "points")
+        return self.results
+
+def compare(results, baseline, tolerance=0.25, verbose=True):
+    """
+    Compare the best times of results to a baseline (both as written by the suite).
+    Returns the names of benchmarks more than tolerance (a fraction) slower than the baseline.
+    """
+    regressions = []
+    current = results["benchmarks"]
+    previous = baseline["benchmarks"]
+    if verbose:
+        print("%-18s %12s %12s %8s" % ("benchmark", "baseline s", "current s", "ratio"))
+    for name in sorted(set(current) & set(previous)):
+        (old, new) = (previous[name]["best"], current[name]["best"])
+        ratio = new / old if old > 0 else float("inf")
+        status = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            status = "REGRESSION"
+        elif ratio < 1 / (1 + tolerance):
+            status = "faster"
+        if verbose:
+            print("%-18s %12.4f %12.4f %8.2f %s" % (name, old, new, ratio, status))
+    if verbose:
+        for name in sorted(set(previous) - set(current)):
+            print("%-18s not run" % name)
+        if results.get("source") != baseline.get("source"):
+            print("warning: the baseline was measured on a different source file", baseline.get("source"))
+    return regressions
+
+class Runner:
+
+    def __init__(self):
+        parser = self.parser = argparse.ArgumentParser()
+        a = parser.add_argument
+        a("--source", help="Existing .athdf file to benchmark (default: generate a synthetic file).", default="")
+        a("--blocks", help="Approximate number of root meshblocks of the synthetic file (default 64).", type=int, default=64)
+        a("--block_size", help="Cells per synthetic meshblock r,theta,phi (default 16,16,16).", default="16,16,16")
+        a("--levels", help="Refinement levels of the synthetic file (default 1).", type=int, default=1)
+        a("--variables", help="Number of variables in the synthetic file (default 1).", type=int, default=1)
+        a("--benchmarks", help="Comma separated benchmarks to run (default all): " + ",".join(BENCHMARKS), default="")
+        a("--repeats", help="Runs of each benchmark (default 3).", type=int, default=3)
+        a("--workers", help="Processes for the parallel expansion benchmark (default 2).", type=int, default=2)
+        a("--points", help="Points for the locate and lookup benchmarks (default 100000).", type=int, default=100000)
+        a("--skip", help="Stride for the truncate benchmark (default 4).", type=int, default=4)
+        a("--output", help="Write the results to this JSON file.", default="")
+        a("--baseline", help="Compare the results to this results JSON file.", default="")
+        a("--tolerance", help="Fraction slower than the baseline reported as a regression (default 0.25).", type=float, default=0.25)
+        a("--quiet", help="Don't print helpful output.", action="store_true")
+        self.args = parser.parse_args()
+        self.verbose = not self.args.quiet
+
+    def run(self):
+        args = self.args
+        names = [name.strip() for name in args.benchmarks.split(",") if name.strip()] or list(BENCHMARKS)
+        with tempfile.TemporaryDirectory() as scratch:
+            if args.source:
+                source = {"path": os.path.abspath(args.source), "bytes": os.path.getsize(args.source)}
+                path = args.source
+            else:
+                path = os.path.join(scratch, "synthetic.athdf")
+                source = synthetic.write_athdf(path, args.blocks, synthetic.parse_triple(args.block_size),
+                    args.levels, args.variables)
+                # the description without the temporary path identifies the file for comparisons
+                del source["path"]
+            if self.verbose:
+                print("Benchmarking", source)
+            suite = Suite(path, scratch, args.repeats, args.workers, args.points, args.skip, verbose=self.verbose)
+            benchmarks = suite.run(names)
+        results = {
+            "version": RESULTS_VERSION,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": environment(),
+            "source": source,
+            "settings": {"repeats": args.repeats, "workers": args.workers, "points": args.points, "skip": args.skip},
+            "benchmarks": benchmarks,
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1)
+            if self.verbose:
+                print("wrote results to", repr(args.output))
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print("Regressions:", ", ".join(regressions))
+        return regressions
+
+if __name__ == "__main__":
+    regressions = Runner().run()
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,140 @@
+"""
+Generate synthetic Athena++ style .athdf files for benchmarks and tests.
+
+The mesh covers r in r_limits, theta in [0, pi] and phi in [0, 2 pi] with a root grid of
+meshblocks.  Each refinement level splits the innermost radial layer of blocks of the previous
+level into 8 children, so levels nest like the shells of a real run (2:1 balanced).  Every
+block has block_size (r, theta, phi) cells.  Variables are stored in (phi, theta, r) order in
+datasets of up to MAX_DATASET_VARIABLES variables, with the attributes FileReader expects.
+
+Example usage:
+
+$ python -m radiation_viz.benchmark.synthetic /tmp/synthetic.athdf --blocks 512 --block_size 16,16,16 --levels 2
+"""
+
+import argparse
+import itertools
+import h5py
+import numpy as np
+
+MAX_DATASET_VARIABLES = 5
+VARIABLE_NAMES = ("rho", "press", "vel1", "vel2", "vel3", "Er", "Fr1", "Fr2", "Fr3")
+
+def root_for_blocks(num_blocks):
+    "Root grid (r, theta, phi) of about num_blocks blocks with twice as many blocks in phi."
+    side = max(1, int(round((num_blocks / 2.0) ** (1.0 / 3))))
+    return (side, side, 2 * side)
+
+def mesh_blocks(root, levels=0):
+    "(level, (i, j, k) logical location at that level) of every meshblock."
+    blocks = [(0, location) for location in itertools.product(*[range(n) for n in root])]
+    for level in range(levels):
+        refined = []
+        for (block_level, (i, j, k)) in blocks:
+            if block_level == level and i == 0:
+                for (a, b, c) in itertools.product((0, 1), repeat=3):
+                    refined.append((level + 1, (2 * i + a, 2 * j + b, 2 * k + c)))
+            else:
+                refined.append((block_level, (i, j, k)))
+        blocks = refined
+    return blocks
+
+def block_faces(blocks, root, block_size, r_limits=(1.0, 3.0)):
+    "x1f, x2f, x3f face arrays (num_blocks, n + 1) of the meshblocks."
+    limits = [r_limits, (0.0, np.pi), (0.0, 2 * np.pi)]
+    levels = np.array([level for (level, location) in blocks])
+    locations = np.array([location for (level, location) in blocks])
+    faces = []
+    for (d, (low, high)) in enumerate(limits):
+        width = (high - low) / (root[d] * 2.0 ** levels)
+        start = low + locations[:, d] * width
+        steps = np.arange(block_size[d] + 1) / float(block_size[d])
+        faces.append((start[:, None] + width[:, None] * steps[None, :]).astype(np.float32))
+    return faces
+
+def variable_values(index, rs, thetas, phis, noise, rng):
+    "Smooth (phi, theta, r) values of variable index in the blocks with face arrays rs, thetas, phis."
+    (r, t, p) = [0.5 * (faces[:, 1:] + faces[:, :-1]) for faces in (rs, thetas, phis)]
+    r = r[:, None, None, :]
+    t = t[:, None, :, None]
+    p = p[:, :, None, None]
+    values = np.sin(2 * r) * np.cos(t) + 0.3 * (1 + 0.1 * index) * np.cos(p + index)
+    if noise:
+        values = values + noise * rng.standard_normal(values.shape)
+    return values.astype(np.float32)
+
+def write_athdf(path, num_blocks=64, block_size=(8, 8, 8), levels=0, num_variables=3, root=None,
+        time=0.0, noise=0.01, seed=0, chunk_blocks=64, verbose=False):
+    """
+    Write a synthetic .athdf file.  root (the (r, theta, phi) root grid of meshblocks) defaults to
+    about num_blocks blocks before refinement.  Returns a description of the file.
+    """
+    assert 0 < num_variables <= len(VARIABLE_NAMES), "between 1 and %s variables" % len(VARIABLE_NAMES)
+    root = tuple(root or root_for_blocks(num_blocks))
+    rng = np.random.RandomState(seed)
+    blocks = mesh_blocks(root, levels)
+    # meshblocks of a real file are in no particular radial order
+    blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+    (rs, thetas, phis) = block_faces(blocks, root, block_size)
+    names = VARIABLE_NAMES[:num_variables]
+    counts = [len(names[start:start + MAX_DATASET_VARIABLES]) for start in range(0, num_variables, MAX_DATASET_VARIABLES)]
+    dataset_names = ["prim"] + ["aux%s" % i for i in range(1, len(counts))]
+    (nr, nt, nph) = block_size
+    with h5py.File(path, "w") as f:
+        f.attrs["VariableNames"] = np.array([name.encode("utf8") for name in names])
+        f.attrs["DatasetNames"] = np.array([name.encode("utf8") for name in dataset_names])
+        f.attrs["NumVariables"] = np.array(counts)
+        f.attrs["NumMeshBlocks"] = len(blocks)
+        f.attrs["MaxLevel"] = levels
+        f.attrs["RootGridSize"] = np.array([root[d] * block_size[d] for d in range(3)])
+        f.attrs["MeshBlockSize"] = np.array(block_size)
+        f.attrs["Time"] = float(time)
+        f.create_dataset("x1f", data=rs)
+        f.create_dataset("x2f", data=thetas)
+        f.create_dataset("x3f", data=phis)
+        f.create_dataset("Levels", data=np.array([level for (level, location) in blocks], dtype=np.int32))
+        f.create_dataset("LogicalLocations", data=np.array([location for (level, location) in blocks], dtype=np.int64))
+        index = 0
+        for (ds, count) in zip(dataset_names, counts):
+            dataset = f.create_dataset(ds, shape=(count, len(blocks), nph, nt, nr), dtype=np.float32,
+                chunks=(1, 1, nph, nt, nr))
+            for v in range(count):
+                # a chunk of blocks at a time bounds the memory for large files
+                for start in range(0, len(blocks), chunk_blocks):
+                    end = min(start + chunk_blocks, len(blocks))
+                    dataset[v, start:end] = variable_values(
+                        index, rs[start:end], thetas[start:end], phis[start:end], noise, rng)
+                index += 1
+    description = {
+        "path": path,
+        "num_blocks": len(blocks),
+        "root": list(root),
+        "block_size": list(block_size),
+        "levels": levels,
+        "num_variables": num_variables,
+        "value_bytes": len(blocks) * nr * nt * nph * num_variables * 4,
+    }
+    if verbose:
+        print("wrote", description)
+    return description
+
+def parse_triple(text):
+    values = tuple(int(x) for x in text.split(","))
+    assert len(values) == 3, "expected three comma separated integers " + repr(text)
+    return values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    a = parser.add_argument
+    a("path", help="File to write.  Should end in '.athdf'.")
+    a("--blocks", help="Approximate number of root meshblocks (default 64).", type=int, default=64)
+    a("--root", help="Root grid of meshblocks r,theta,phi (overrides --blocks).", default="")
+    a("--block_size", help="Cells per meshblock r,theta,phi (default 8,8,8).", default="8,8,8")
+    a("--levels", help="Number of refinement levels (default 0).", type=int, default=0)
+    a("--variables", help="Number of variables (default 3).", type=int, default=3)
+    a("--time", help="Simulation time attribute (default 0).", type=float, default=0.0)
+    a("--noise", help="Standard deviation of the noise added to the smooth values (default 0.01).", type=float, default=0.01)
+    a("--seed", help="Random seed (default 0).", type=int, default=0)
+    args = parser.parse_args()
+    write_athdf(args.path, args.blocks, parse_triple(args.block_size), args.levels, args.variables,
+        args.root and parse_triple(args.root), args.time, args.noise, args.seed, verbose=True)
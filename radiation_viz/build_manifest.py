@@ -0,0 +1,167 @@
+"""
+Build manifest recording which source file state produced each output in a data directory.
+
+Each output prefix (the JSON and binary pair written by dump_files) is keyed on the identity of
+its source file (size, modification time and optionally a content hash), the variable, the skip
+stride, the output options (such as the encoding) and the pipeline version.  An output whose record still matches is current and need not be
+rebuilt.
+
+Several processes may write outputs into the same directory (as the commands of a build plan do):
+save re-reads the manifest under an exclusive lock and merges in only the entries this process
+updated, so the entries written by the other processes are kept.
+"""
+
+import os
+import json
+import hashlib
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    # no advisory locking on this platform
+    fcntl = None
+
+MANIFEST_FILENAME = "build_manifest.json"
+LOCK_FILENAME = "build_manifest.json.lock"
+
+# Increase when the format or content of the outputs changes so existing outputs become stale.
+# 2: value encodings and binary section offsets in the JSON.
+# 3: block_directory of per block value ranges and offsets.
+# 4: variable, skip, source and time metadata in the output JSON for the paged config.
+# 5: optional isosurface mesh outputs recorded with each output.
+PIPELINE_VERSION = 5
+
+HASH_CHUNK_BYTES = 1 << 24
+
+def file_hash(path):
+    "sha1 hex digest of the file contents, read in chunks."
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def source_identity(path, hash_contents=False):
+    "Size and modification time of the source file, with its content hash if requested."
+    st = os.stat(path)
+    identity = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if hash_contents:
+        identity["sha1"] = file_hash(path)
+    return identity
+
+def output_sizes(directory, filenames):
+    "Sizes of the output files, or None if any of them is missing."
+    sizes = {}
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path):
+            return None
+        sizes[filename] = os.path.getsize(path)
+    return sizes
+
+def make_entry(directory, filenames, source_path, identity, variable, skip, options=None):
+    "Manifest entry for the output files just written in directory (e.g. as returned by dump_files)."
+    sizes = output_sizes(directory, filenames)
+    assert sizes is not None, "cannot record missing outputs " + repr(filenames)
+    return {
+        "source_path": source_path,
+        "source": identity,
+        "variable": variable,
+        "skip": skip,
+        "options": options or {},
+        "pipeline_version": PIPELINE_VERSION,
+        "outputs": sizes,
+    }
+
+class BuildManifest:
+
+    def __init__(self, directory, verbose=False, load=True):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.verbose = verbose
+        # entries added by this process, merged into the manifest on disk by save
+        self.updated = {}
+        self.entries = self.read() if load else {}
+
+    def read(self):
+        "The entries of the manifest file (empty if it is missing or damaged)."
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                value = json.load(f)
+            return value.get("outputs", {})
+        except ValueError:
+            # a damaged manifest only costs a rebuild
+            if self.verbose:
+                print("    ignoring unreadable manifest", repr(self.path))
+            return {}
+
+    @contextlib.contextmanager
+    def locked(self):
+        "Hold an exclusive lock on the manifest of the directory."
+        with open(os.path.join(self.directory, LOCK_FILENAME), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def stale_reason(self, prefix, source_path, identity, variable, skip, options=None, hash_contents=False):
+        """
+        None if the outputs for prefix are current for this source, variable, skip and options,
+        otherwise a short description of why they must be rebuilt.
+        """
+        entry = self.entries.get(prefix)
+        if entry is None:
+            return "not in manifest"
+        sizes = output_sizes(self.directory, entry.get("outputs", {}))
+        if sizes is None:
+            return "missing output"
+        if entry.get("pipeline_version") != PIPELINE_VERSION:
+            return "pipeline version changed"
+        if entry.get("variable") != variable or entry.get("skip") != skip:
+            return "variable or skip changed"
+        if entry.get("options", {}) != (options or {}):
+            return "output options changed"
+        if entry.get("outputs") != sizes:
+            return "output files changed"
+        source = entry.get("source", {})
+        if source.get("size") != identity["size"]:
+            return "source size changed"
+        if source.get("mtime_ns") != identity["mtime_ns"]:
+            # a touched or copied file with the same contents is still current
+            if not (hash_contents and "sha1" in source):
+                return "source modified"
+            if "sha1" not in identity:
+                identity["sha1"] = file_hash(source_path)
+            if source["sha1"] != identity["sha1"]:
+                return "source contents changed"
+        return None
+
+    def update(self, entries):
+        "Add entries (prefix --> entry) made by make_entry."
+        self.entries.update(entries)
+        self.updated.update(entries)
+
+    def save(self):
+        """
+        Under the lock, re-read the manifest, merge in the entries updated by this process and
+        write it atomically: write a temporary file and rename it into place.
+        """
+        with self.locked():
+            entries = self.read()
+            entries.update(self.updated)
+            temp_path = self.path + ".tmp"
+            value = {"pipeline_version": PIPELINE_VERSION, "outputs": entries}
+            with open(temp_path, "w") as f:
+                json.dump(value, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        self.entries = entries
+        if self.verbose:
+            print("    saved manifest with", len(self.entries), "entries to", repr(self.path))
@@ -21,6 +21,20 @@ $ python -m radiation_viz.build_plan \
     --clean  --var_substring rho \
     --out /mnt/ceph/users/awatters/logs --limit 10 > plan.sh
 
+Each command adds its outputs to the paged config.json as they are written, so no final
+rescan of the data directory is needed.  --rebuild_config ends the plan with a --config_only
+command which rebuilds the config from all of the output files, to repair a directory.
+
+Files are grouped into commands from a rough cost model built from each file's HDF5 metadata:
+several small files share one command and large files get a command each.  The predicted
+totals are printed to stderr.  Use --max_mem to refuse plans with a file predicted to need more
+memory than a task has.
+
+With --profile each command prints a JSON line of stage times, memory and counters per file
+into its log.  After the run, summarize the logs in the --out directory:
+
+$ python -m radiation_viz.build_plan --out ~/tmp/output --summary > summary.json
+
 Then to execute on the cluster in flatiron:
 
  % module load slurm
@@ -32,22 +46,93 @@ Submitted batch job 552107
 
 import argparse
 import os
+import sys
+import json
 import glob
+import h5py
+import numpy as np
+from . import profiling
+
+# Rough cost model constants for one prepare_viz_data process.
+STARTUP_SECONDS = 2.0
+SECONDS_PER_MB_READ = 0.02
+SECONDS_PER_MILLION_VALUES = 1.0
+BASE_MEMORY_BYTES = 256 * 2 ** 20
+# float32 expanded output plus the float64 face and index temporaries of the expansion
+BYTES_PER_EXPANDED_VALUE = 16
+# prepare_viz_data default --memory_budget
+READ_BUDGET_BYTES = 2048 * 2 ** 20
+
+class FileCost:
+
+    "Predicted runtime and peak memory for converting one file, from its HDF5 metadata."
+
+    def __init__(self, path, var_substring="", skip=0):
+        self.path = path
+        with h5py.File(path, "r") as f:
+            variable_names = [b.decode("utf8") for b in f.attrs["VariableNames"]]
+            num_variables = f.attrs["NumVariables"]
+            dataset_names = [b.decode("utf8") for b in f.attrs["DatasetNames"]]
+            count = 0
+            variable_bytes = []
+            for (nv, ds) in zip(num_variables, dataset_names):
+                dataset = f[ds]
+                for index in range(nv):
+                    if var_substring in variable_names[count]:
+                        (self.num_blocks, nphi, ntheta, nr) = dataset.shape[1:]
+                        slab_size = int(np.prod(dataset.shape[1:]))
+                        variable_bytes.append(slab_size * (dataset.dtype.itemsize + 4))
+                    count += 1
+        self.num_variables = len(variable_bytes)
+        if not variable_bytes:
+            (self.seconds, self.peak_bytes, self.output_bytes) = (0.0, 0, 0)
+            return
+        skip = skip or 1
+        expanded_values = self.num_blocks * (len(range(0, nr, skip)) + 1) * (ntheta + 1) * (len(range(0, nphi, skip)) + 1)
+        self.output_bytes = self.num_variables * expanded_values * 4
+        read_bytes = sum(variable_bytes)
+        self.seconds = (STARTUP_SECONDS + read_bytes / 2.0 ** 20 * SECONDS_PER_MB_READ
+            + self.num_variables * expanded_values / 1e6 * SECONDS_PER_MILLION_VALUES)
+        batch_bytes = max(max(variable_bytes), min(read_bytes, READ_BUDGET_BYTES))
+        self.peak_bytes = BASE_MEMORY_BYTES + batch_bytes + expanded_values * BYTES_PER_EXPANDED_VALUE
+
+def balanced_groups(costs, group_seconds):
+    """
+    Pack the file costs into groups predicted to take at most group_seconds (first fit, largest first).
+    Files predicted to take longer than group_seconds get a group of their own.
+    """
+    groups = []
+    for cost in sorted(costs, key=lambda c: -c.seconds):
+        for group in groups:
+            if sum(c.seconds for c in group) + cost.seconds <= group_seconds:
+                group.append(cost)
+                break
+        else:
+            groups.append([cost])
+    return groups
 
 class BuildPlan:
 
     def __init__(self):
         parser = self.parser = argparse.ArgumentParser()
         a = parser.add_argument
-        a("from_directory", help="Directory containing files to convert.")
-        a("to_directory", help="Directory where to place support files and visualization files.")
+        # the directories are only needed for planning, not for --summary
+        a("from_directory", help="Directory containing files to convert.", nargs="?")
+        a("to_directory", help="Directory where to place support files and visualization files.", nargs="?")
         a("--glob", help="Glob to match filenames (default *.athdf).", default="*.athdf")
         a("--limit", help="Maximum number of files to process (default all).", type=int, default=0)
         a("--clean", help="Delete and replace to_directory if it exists.", action="store_true")
         a("--var_substring", help="Exclude variables with names that do not match this substring (default '').", default='')
         a("--skip", help="Skip stride for truncated views (default to full resolution).", type=int, default=0)
         a("--out", help="Directory for output files.", default="")
+        a("--group_seconds", help="Target predicted seconds per command for grouping small files (default 1800).", type=float, default=1800.0)
+        a("--max_mem", "--max-mem", help="Refuse to plan files predicted to need more megabytes than this (default no limit).", type=int, default=0)
+        a("--rebuild_config", help="End the plan with a --config_only command rescanning all of the outputs (to repair a directory).", action="store_true")
+        a("--profile", help="Add --profile to the commands so each logs stage times, memory and counters per file.", action="store_true")
+        a("--summary", help="Instead of planning, print a JSON run summary of the --profile lines in the --out logs.", action="store_true")
         self.args = parser.parse_args()
+        if not self.args.summary and self.args.to_directory is None:
+            parser.error("from_directory and to_directory are required to plan")
         self.out = None
         out = self.args.out
         if (out):
@@ -67,6 +152,8 @@ class BuildPlan:
         return "> " + logpath + " 2>&1"
 
     def build(self):
+        if self.args.summary:
+            return self.summarize_logs()
         prefix = "python -u -m radiation_viz.prepare_viz_data"
         clean_option = ""
         substring_option = ""
@@ -75,27 +162,64 @@ class BuildPlan:
         from_directory = self.fix_path(args.from_directory)
         to_directory = self.fix_path(args.to_directory)
         glob_path = os.path.join(from_directory, args.glob)
-        files = glob.glob(glob_path)
+        files = sorted(glob.glob(glob_path))
         assert files, "No files found matching: " + repr(glob_path)
+        if args.limit > 0:
+            files = files[:args.limit]
         if args.clean:
             clean_option = "--clean"
         if args.var_substring:
             substring_option = "--var_substring " + args.var_substring
+        profile_option = "--profile" if args.profile else ""
         # disable truncated output if skip is not specified
         skip_option = "--skip 0"
         if (args.skip):
             skip_option = "--truncated --skip " + repr(args.skip)
-        count = 0
-        for path in files:
-            redir = self.redirect(path)
-            print(prefix, path, clean_option, substring_option, skip_option, "--no_config --to_directory", to_directory, "--force", redir)
+        costs = [FileCost(path, args.var_substring, args.skip) for path in files]
+        if args.max_mem:
+            too_big = [c for c in costs if c.peak_bytes > args.max_mem * 2 ** 20]
+            assert not too_big, "Files predicted to need more than --max_mem %s MB: %s" % (
+                args.max_mem, ", ".join("%s (%.0f MB)" % (c.path, c.peak_bytes / 2.0 ** 20) for c in too_big))
+        groups = balanced_groups(costs, args.group_seconds)
+        self.summarize(costs, groups)
+        for group in groups:
+            paths = " ".join(c.path for c in group)
+            redir = self.redirect(group[0].path)
+            # each command adds its own outputs to the (locked) config as they are written
+            print(prefix, paths, clean_option, substring_option, skip_option, profile_option, "--to_directory", to_directory, "--force", redir)
             clean_option = ""  # after first don't clean
-            count += 1
-            if (args.limit > 0) and (count >= args.limit):
-                break
-        # finally build config file
-        redir = self.redirect("config.json")
-        print (prefix, "dummy_argument.athdf", "--config_only --to_directory", to_directory, "--force", redir)
+        if args.rebuild_config:
+            # rescan every output file to repair the config
+            redir = self.redirect("config.json")
+            print (prefix, "dummy_argument.athdf", "--config_only --to_directory", to_directory, "--force", redir)
+
+    def summarize(self, costs, groups):
+        "Print the predicted totals to stderr so they stay out of the plan."
+        def mb(nbytes):
+            return "%.1f MB" % (nbytes / 2.0 ** 20)
+        group_seconds = [sum(c.seconds for c in group) for group in groups]
+        p = lambda *values: print(*values, file=sys.stderr)
+        p("planned", len(costs), "files in", len(groups), "commands")
+        p("    predicted total seconds %.1f, longest command %.1f" % (sum(group_seconds), max(group_seconds)))
+        p("    predicted peak memory", mb(max(c.peak_bytes for c in costs)))
+        p("    predicted output", mb(sum(c.output_bytes for c in costs)))
+
+    def summarize_logs(self):
+        "Print the run level summary of the profile records in the logs of the --out directory."
+        assert self.out, "--summary needs the --out log directory"
+        paths = sorted(glob.glob(os.path.join(self.out, "*.log")))
+        records = profiling.read_records(paths)
+        assert records, "No profile records found in logs in " + repr(self.out)
+        summary = profiling.summarize(records)
+        json.dump(summary, sys.stdout, indent=1)
+        print()
+        p = lambda *values: print(*values, file=sys.stderr)
+        p("summarized", summary["files"], "files from", len(paths), "logs")
+        for (name, totals) in sorted(summary["stages"].items(), key=lambda item: -item[1]["wall"]):
+            p("    %-10s wall %10.1f s  cpu %10.1f s  calls %s" % (name, totals["wall"], totals["cpu"], totals["calls"]))
+        if summary["peak_rss_bytes"] is not None:
+            p("    peak RSS %.1f MB" % (summary["peak_rss_bytes"] / 2.0 ** 20))
+        return summary
 
 if __name__ == "__main__":
     plan = BuildPlan()
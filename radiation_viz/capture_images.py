@@ -2,7 +2,8 @@
 Top level control for capturing an image sequence from the
 visualization.
 
-- Launch a node based http server serving the visualization in a subprocess.
+- Launch the built in threaded web server (viz_server) serving the visualization,
+  or with --node_server a node based http server in a subprocess.
 - Launch a node/puppeteer headless browser scraper script to scrape the images from the http server.
 - Wait for the scraper script to terminate.
 - Terminate the http server.
@@ -10,7 +11,7 @@ visualization.
 This implementation is designed to work with the Node.js
 scraping logic in ../image_capturer.
 
-It also assumes the existence of the node based web server http-server.
+With --node_server it also assumes the existence of the node based web server http-server.
 
 npm install -g http-server
 
@@ -48,6 +49,7 @@ import os
 import argparse
 import subprocess
 import urllib.parse
+from . import viz_server
 
 SERVER_EXECUTABLE = "http-server"
 SCRAPER_NODE_SCRIPT = "scrape_images.js"
@@ -64,6 +66,7 @@ class Runner:
         a("--settings_path", help="Camera settings file path containing camera settings parameters.")
         a("--limit", help="Maximum number of images to capture (default all).", type=int, default=0)
         a("--port", help="Port where to run the server (default 9393).", type=int, default=9393)
+        a("--node_server", help="Serve with the node http-server executable instead of the built in server.", action="store_true")
         #a("--mac", help="Use Mac chrome configuration.", action="store_true")
         a("--quiet", help="Don't print helpful output.", action="store_true")
         args = self.args = parser.parse_args()
@@ -118,6 +121,11 @@ class Runner:
 
     def launch_web_server(self):
         args = self.args
+        if not args.node_server:
+            if self.verbose:
+                print("starting built in web server for", repr(self.http_directory), "on port", args.port)
+            self.web_server = viz_server.start_server(self.http_directory, "127.0.0.1", args.port, self.verbose)
+            return
         cmd_args = [SERVER_EXECUTABLE, self.http_directory, "-p", repr(args.port)]
         if self.verbose:
             print("starting web server", cmd_args)
@@ -141,7 +149,13 @@ class Runner:
     def stop_web_server(self):
         if self.verbose:
             print("stopping web server.")
-        self.web_server.terminate()
+        if self.args.node_server:
+            self.web_server.terminate()
+            return
+        self.web_server.shutdown()
+        self.web_server.server_close()
+        if self.verbose:
+            print("web server statistics", self.web_server.statistics())
 
 if __name__=="__main__":
     rnr = Runner()
@@ -2,7 +2,10 @@ import h5py
 import numpy as np
 import json
 import os
+import gzip
 from . import expand_blocks
+from . import resample
+from . import profiling
 
 # save canvas as image
 # https://stackoverflow.com/questions/28299050/how-to-use-filesaver-js-with-canvas/28305948
@@ -24,69 +27,155 @@ class BlockDescriptions:
         self.thetas = thetas
         self.phis = phis
         self.values = values
+        # bytes read from the source file, if known
+        self.bytes_read = 0
+        # staged binary file already holding these arrays in the dump_files layout, if any
+        self.binary_path = None
+
+    # Wrap around phi at 2*pi
+    limits = [None, None, 2 * np.pi - 1e-10]
+    #limits = [None, None, None] # for testing
 
     def interpolator(self):
-        # Wrap around phi at 2*pi
-        limits = [None, None, 2 * np.pi - 1e-10]
-        #limits = [None, None, None] # for testing
-        return expand_blocks.interpolator_from_arrays(self.values, self.rs, self.thetas, self.phis, limits)
-
-    def interp_data_cube(self, side, default=0.0, substitute=None, verbose=True):
-        result = np.zeros((side, side, side), dtype=np.float)
-        interp = self.interpolator()
-        if verbose:
-            print("interp", interp)
-        def ticks(arr):
-            M = arr.max()
-            m = arr.min()
-            d = M - m
-            assert d > 1e-5, "difference in array too small " + repr((M, m, d))
-            di = d / side
-            return [(i, m + di * i) for i in range(side)]
-        for (i,r) in ticks(self.rs):
-            if verbose:
-                print("at r", i, r)
-            for (j,theta) in ticks(self.thetas):
-                for (k,phi) in ticks(self.phis):
-                    p = np.array([r, theta, phi], dtype=np.float)
-                    result[i,j,k] = interp.interpolate(p, default, substitute=substitute)
+        return expand_blocks.interpolator_from_arrays(self.values, self.rs, self.thetas, self.phis, self.limits)
+
+    def interp_data_cube(self, side, default=0.0, substitute=None, verbose=True, 
+        grid="spherical", cache_dir=None, out_path=None):
+        """
+        Resample the blocks to a side^3 cube on a uniform spherical (r, theta, phi) grid
+        or a Cartesian (x, y, z) grid.  The gather table for the mesh is cached in cache_dir
+        (if given) and reused for other snapshots with the same mesh.  If out_path is given
+        the cube is written to a .npy memory map at that path.
+        """
+        table = resample.resample_table(self, side, grid, cache_dir, verbose=verbose)
+        out = None
+        if out_path:
+            out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float64, shape=(side, side, side))
+        result = table.apply(self.values, default, substitute, out=out)
+        if out_path:
+            result.flush()
         return result
 
-    def dump_files(self, to_dir, to_prefix, indent=None, verbose=True):
+    @profiling.staged("dump")
+    def dump_files(self, to_dir, to_prefix, indent=None, verbose=True, encoding="float32", compress=False, metadata=None):
+        """
+        Write the binary file block by block and a small JSON metadata file.
+        The binary holds float32 r, theta and phi face values followed by the values in the
+        given encoding (see ENCODINGS); the JSON records the byte offsets of each section and
+        the per block offset and scale of quantized values.  With compress the bytes of each
+        block are shuffled and the whole file is gzip compressed to a .bin.gz file.
+        The JSON block_directory lists the bounds and value range of every block and, for
+        uncompressed files, the byte offset and length of each block for range requests.
+        metadata items (such as the variable and snapshot time) are added to the JSON.
+        """
+        assert encoding in ENCODINGS, "unknown encoding " + repr(encoding)
         json_fn = to_prefix + ".json"
-        bin_fn = to_prefix + ".bin"
+        bin_fn = to_prefix + (".bin.gz" if compress else ".bin")
         json_path = os.path.join(to_dir, json_fn)
         bin_path = os.path.join(to_dir, bin_fn)
-        r_values = self.rs
-        theta_values = self.thetas
-        phi_values = self.phis
         values = self.values
         (num_blocks, r_size, theta_size, phi_size) = values.shape
+        layout = binary_layout(self.rs.shape, self.thetas.shape, self.phis.shape)
+        (value_mins, value_maxes) = ([], [])
+        def note_range(block):
+            value_mins.append(float(block.min()))
+            value_maxes.append(float(block.max()))
+        (block_offsets, block_scales) = ([], [])
+        (max_error, sum_squares) = (0.0, 0.0)
+        if self.binary_path is not None and encoding == "float32" and not compress:
+            # the staged file written by expand is complete: finish it with a rename
+            values.flush()
+            for block in values:
+                note_range(block)
+            os.replace(self.binary_path, bin_path)
+            self.binary_path = None
+            if verbose:
+                print("    moved staged binary to", bin_path)
+        else:
+            if compress:
+                bin_f = gzip.GzipFile(bin_path, "wb", mtime=0)
+            else:
+                bin_f = open(bin_path, "wb")
+            with bin_f:
+                for coordinates in (self.rs, self.thetas, self.phis):
+                    bin_f.write(a32(coordinates).tobytes())
+                # min and max in the same pass as the write, holding one encoded block at a time
+                for block in values:
+                    block = np.asarray(block, dtype=np.float32)
+                    note_range(block)
+                    (encoded, offset, scale) = encode_block(block, encoding)
+                    if offset is not None:
+                        block_offsets.append(offset)
+                        block_scales.append(scale)
+                    if encoding != "float32":
+                        error = np.abs(decode_block(encoded, offset, scale).astype(np.float64) - block)
+                        max_error = max(max_error, float(error.max()))
+                        sum_squares += float((error * error).sum())
+                    if compress:
+                        bin_f.write(shuffle_bytes(encoded))
+                    else:
+                        bin_f.write(encoded.tobytes())
+            if self.binary_path is not None:
+                os.remove(self.binary_path)
+                self.binary_path = None
+            if verbose:
+                print("    wrote binary to", bin_path)
+        # a binary from an earlier run with the other suffix would be paired with this JSON
+        for suffix in BINARY_SUFFIXES:
+            other_path = os.path.join(to_dir, to_prefix + suffix)
+            if other_path != bin_path and os.path.exists(other_path):
+                os.remove(other_path)
+        (intensity_min, intensity_max) = (min(value_mins), max(value_maxes))
+        directory = {
+            "r_min": self.rs.min(axis=1).tolist(),
+            "r_max": self.rs.max(axis=1).tolist(),
+            "theta_min": self.thetas.min(axis=1).tolist(),
+            "theta_max": self.thetas.max(axis=1).tolist(),
+            "phi_min": self.phis.min(axis=1).tolist(),
+            "phi_max": self.phis.max(axis=1).tolist(),
+            "value_min": value_mins,
+            "value_max": value_maxes,
+        }
+        if not compress:
+            block_bytes = (values.size // num_blocks) * np.dtype(encoding).itemsize
+            directory["offset"] = [layout["values_offset"] + b * block_bytes for b in range(num_blocks)]
+            directory["length"] = [block_bytes] * num_blocks
         json_value = {
-            "r_max": float(r_values.max()),
-            "intensity_max": float(values.max()),
-            "intensity_min": float(values.min()),
+            "r_max": float(self.rs.max()),
+            "intensity_max": intensity_max,
+            "intensity_min": intensity_min,
             "r_size": r_size,
             "theta_size": theta_size,
             "phi_size": phi_size,
             "num_blocks": num_blocks,
-            "r_values": r_values.ravel().tolist(),
-            "theta_values": theta_values.ravel().tolist(),
-            "phi_values": phi_values.ravel().tolist(),
             "binary_file": bin_fn,
+            "values_encoding": encoding,
         }
+        json_value.update(layout)
+        if metadata:
+            json_value.update(metadata)
+        json_value["block_directory"] = directory
+        if block_offsets:
+            json_value["block_offsets"] = block_offsets
+            json_value["block_scales"] = block_scales
+        if compress:
+            json_value["compression"] = "gzip"
+            json_value["shuffle"] = True
+        if encoding != "float32":
+            rms_error = float(np.sqrt(sum_squares / values.size))
+            json_value["encoding_error"] = {"max": max_error, "rms": rms_error}
+            if verbose:
+                print("    %s encoding error: max %g rms %g (values %g to %g)" % (
+                    encoding, max_error, rms_error, intensity_min, intensity_max))
         json_f = open(json_path, "w")
         json.dump(json_value, json_f, indent=indent)
         json_f.close()
         if verbose:
             print("    wrote json to", json_path)
-        bin_f = open(bin_path, "wb")
-        values.ravel().astype(np.float32).tofile(bin_f)
-        bin_f.close()
-        if verbose:
-            print("    wrote binary to", bin_path)
+        profiling.count("bytes_written", os.path.getsize(json_path) + os.path.getsize(bin_path))
         return(json_fn , bin_fn)
 
+    @profiling.staged("truncate")
     def truncate_r_phi(self, skip, verbose=True):
         r_values = truncate(self.rs, skip)
         theta_values = self.thetas # truncate(self.thetas)
@@ -97,10 +186,230 @@ class BlockDescriptions:
             print ("   to", r_values.shape, theta_values.shape, phi_values.shape, values.shape)
         return self.__class__(r_values, theta_values, phi_values, values)
 
-    def expand(self, verbose=True):
-        interp = self.interpolator()
-        e = interp.expand_all(verbose=verbose)
-        return self.__class__(e["x_values"], e["y_values"], e["z_values"], e["intensities"], )
+    @profiling.staged("truncate")
+    def pool_r_phi(self, factor, mode="mean", verbose=True):
+        """
+        Reduce r and phi by factor, combining each run of factor cells into one coarse cell.
+        mode is "mean" (averages weighted by the cell widths along r and phi), "max", or
+        "stride" (keep the first cell of each run, like truncate_r_phi).
+        The coarse faces are the faces at the run boundaries; a shorter last run is allowed.
+        """
+        assert mode in POOL_MODES, "unknown pool mode " + repr(mode)
+        values = self.values
+        rs = self.rs
+        phis = self.phis
+        for (axis, faces) in ((1, rs), (3, phis)):
+            n = values.shape[axis]
+            starts = np.arange(0, n, factor)
+            new_faces = faces[:, np.append(starts, n)]
+            if mode == "stride":
+                values = values.take(starts, axis=axis)
+            elif mode == "max":
+                values = np.maximum.reduceat(values, starts, axis=axis)
+            else:
+                widths_shape = [values.shape[0], 1, 1, 1]
+                widths_shape[axis] = n
+                widths = np.diff(faces, axis=1).astype(np.float64).reshape(widths_shape)
+                totals = np.add.reduceat(values * widths, starts, axis=axis)
+                values = (totals / np.add.reduceat(widths, starts, axis=axis)).astype(self.values.dtype)
+            if axis == 1:
+                rs = new_faces
+            else:
+                phis = new_faces
+        if verbose:
+            print("    pooling", self.values.shape, "by", factor, mode, "to", values.shape)
+        return self.__class__(rs, self.thetas, phis, values)
+
+    def reduce_r_phi(self, factors, mode="mean", verbose=True):
+        """
+        Reduced views for each factor (1 is self) in one pass: each level is pooled from the
+        finest level already built whose factor divides it.  For "stride" and "max" this is exactly
+        pooling the full data; for "mean" only up to float32 rounding, since the intermediate
+        levels are stored as float32.
+        """
+        levels = {1: self}
+        for factor in sorted(set(factors)):
+            if factor in levels:
+                continue
+            base = max(f for f in levels if factor % f == 0)
+            levels[factor] = levels[base].pool_r_phi(factor // base, mode, verbose)
+        return dict((factor, levels[factor]) for factor in factors)
+
+    @profiling.staged("expand")
+    def expand(self, verbose=True, workers=1, out_path=None):
+        """
+        Expand the blocks by one cell on the upper faces, writing float32 values.
+        With out_path the expanded values go directly into a memory mapped binary file in the
+        dump_files layout, so dump_files only needs to rename it.
+        """
+        out = sections = None
+        if out_path is not None:
+            (nb, nr, nt, nph) = self.values.shape
+            sections = create_binary(out_path, (nb, nr + 2), (nb, nt + 2), (nb, nph + 2), (nb, nr + 1, nt + 1, nph + 1))
+            out = sections["values"]
+        if workers > 1:
+            e = expand_blocks.expand_all_parallel(
+                self.values, self.rs, self.thetas, self.phis, self.limits, workers, verbose=verbose, out=out)
+        else:
+            interp = self.interpolator()
+            e = interp.expand_all(verbose=verbose, out=out)
+        profiling.count("blocks", self.values.shape[0])
+        profiling.add_counters(expand_blocks.summable_statistics(e["statistics"]))
+        result = self.__class__(e["x_values"], e["y_values"], e["z_values"], e["intensities"], )
+        if sections is not None:
+            sections["r_values"][...] = e["x_values"]
+            sections["theta_values"][...] = e["y_values"]
+            sections["phi_values"][...] = e["z_values"]
+            for section in sections.values():
+                section.flush()
+            result.binary_path = out_path
+        return result
+
+FLOAT32_BYTES = 4
+
+# value encodings for dump_files: float32 is exact, the others are lossy
+ENCODINGS = ("float32", "float16", "uint16", "uint8")
+BINARY_SUFFIXES = (".bin", ".bin.gz")
+
+# reductions for BlockDescriptions.pool_r_phi
+POOL_MODES = ("mean", "max", "stride")
+
+def dump_pyramid(to_dir, pyramid_prefix, level_prefixes, mode, verbose=True):
+    """
+    Write a JSON manifest listing the levels of a detail pyramid, coarsest first.
+    level_prefixes maps each reduction factor to the prefix of its files written by dump_files.
+    """
+    levels = []
+    for factor in sorted(level_prefixes, reverse=True):
+        prefix = level_prefixes[factor]
+        json_fn = prefix + ".json"
+        with open(os.path.join(to_dir, json_fn)) as json_f:
+            json_value = json.load(json_f)
+        bin_fn = json_value["binary_file"]
+        levels.append({
+            "factor": factor,
+            "prefix": prefix,
+            "json": json_fn,
+            "bin": bin_fn,
+            "r_size": json_value["r_size"],
+            "theta_size": json_value["theta_size"],
+            "phi_size": json_value["phi_size"],
+            "bytes": os.path.getsize(os.path.join(to_dir, bin_fn)),
+        })
+    pyramid_fn = pyramid_prefix + ".json"
+    pyramid_path = os.path.join(to_dir, pyramid_fn)
+    with open(pyramid_path, "w") as pyramid_f:
+        json.dump({"pool": mode, "levels": levels}, pyramid_f, indent=1)
+    if verbose:
+        print("    wrote pyramid manifest to", pyramid_path)
+    return pyramid_fn
+
+def binary_prefix(filename):
+    "The output prefix of a binary file name written by dump_files, or None."
+    for suffix in BINARY_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+def encode_block(block, encoding):
+    """
+    Encode a float32 block.  Returns (encoded, offset, scale) where offset and scale are
+    None unless the encoding is an unsigned integer quantization: value ~ offset + q * scale.
+    """
+    if encoding == "float32":
+        return (block, None, None)
+    if encoding == "float16":
+        return (block.astype(np.float16), None, None)
+    dtype = np.dtype(encoding)
+    levels = np.iinfo(dtype).max
+    (m, M) = (float(block.min()), float(block.max()))
+    scale = (M - m) / levels if M > m else 1.0
+    q = np.rint((block.astype(np.float64) - m) / scale)
+    return (np.clip(q, 0, levels).astype(dtype), m, scale)
+
+def decode_block(encoded, offset=None, scale=None):
+    "Inverse of encode_block, as float32."
+    if offset is None:
+        return encoded.astype(np.float32)
+    return (offset + encoded * scale).astype(np.float32)
+
+def shuffle_bytes(array):
+    "Bytes of array grouped by byte position (all first bytes, then all second bytes...), which compresses better."
+    array = np.ascontiguousarray(array)
+    return array.view(np.uint8).reshape((-1, array.dtype.itemsize)).T.tobytes()
+
+def unshuffle_bytes(data, dtype):
+    "Inverse of shuffle_bytes for a 1d array of dtype."
+    dtype = np.dtype(dtype)
+    grouped = np.frombuffer(data, dtype=np.uint8).reshape((dtype.itemsize, -1))
+    return np.ascontiguousarray(grouped.T).view(dtype).reshape((-1,))
+
+def binary_layout(rs_shape, thetas_shape, phis_shape):
+    "Byte offsets of the sections of a binary file written by dump_files."
+    layout = {}
+    offset = 0
+    for (name, shape) in (("r_values", rs_shape), ("theta_values", thetas_shape), ("phi_values", phis_shape)):
+        layout[name + "_offset"] = offset
+        offset += int(np.prod(shape)) * FLOAT32_BYTES
+    layout["values_offset"] = offset
+    return layout
+
+def create_binary(bin_path, rs_shape, thetas_shape, phis_shape, values_shape):
+    "Create a float32 binary file in the dump_files layout and return np.memmap views of its sections."
+    layout = binary_layout(rs_shape, thetas_shape, phis_shape)
+    size = layout["values_offset"] + int(np.prod(values_shape)) * FLOAT32_BYTES
+    with open(bin_path, "wb") as bin_f:
+        bin_f.truncate(size)
+    shapes = (("r_values", rs_shape), ("theta_values", thetas_shape), ("phi_values", phis_shape), ("values", values_shape))
+    return dict((name, np.memmap(bin_path, dtype=np.float32, mode="r+", offset=layout[name + "_offset"], shape=shape))
+        for (name, shape) in shapes)
+
+def load_files(json_path):
+    """
+    Read BlockDescriptions from files written by dump_files.
+    Uncompressed float32 values are memory mapped, other encodings are decoded to float32.
+    Older files with the coordinates in the JSON are also supported.
+    """
+    with open(json_path) as json_f:
+        json_value = json.load(json_f)
+    bin_path = os.path.join(os.path.dirname(json_path), json_value["binary_file"])
+    num_blocks = json_value["num_blocks"]
+    shape = (num_blocks, json_value["r_size"], json_value["theta_size"], json_value["phi_size"])
+    data = None
+    if json_value.get("compression") == "gzip":
+        with gzip.open(bin_path, "rb") as bin_f:
+            data = bin_f.read()
+    def section(offset, dtype, count):
+        if data is not None:
+            return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        return np.memmap(bin_path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+    def coordinates(name, size):
+        shape = (num_blocks, size + 1)
+        if name + "_offset" in json_value:
+            return section(json_value[name + "_offset"], np.float32, num_blocks * (size + 1)).reshape(shape)
+        return a32(json_value[name]).reshape(shape)
+    rs = coordinates("r_values", shape[1])
+    thetas = coordinates("theta_values", shape[2])
+    phis = coordinates("phi_values", shape[3])
+    encoding = json_value.get("values_encoding", "float32")
+    values_offset = json_value.get("values_offset", 0)
+    if encoding == "float32" and not json_value.get("shuffle"):
+        values = section(values_offset, np.float32, int(np.prod(shape))).reshape(shape)
+    else:
+        dtype = np.dtype(encoding)
+        block_size = int(np.prod(shape[1:]))
+        values = np.zeros(shape, dtype=np.float32)
+        for b in range(num_blocks):
+            offset = values_offset + b * block_size * dtype.itemsize
+            if json_value.get("shuffle"):
+                encoded = unshuffle_bytes(section(offset, np.uint8, block_size * dtype.itemsize), dtype)
+            else:
+                encoded = section(offset, dtype, block_size)
+            (m, scale) = (None, None)
+            if "block_offsets" in json_value:
+                (m, scale) = (json_value["block_offsets"][b], json_value["block_scales"][b])
+            values[b] = decode_block(encoded, m, scale).reshape(shape[1:])
+    return BlockDescriptions(rs, thetas, phis, values)
 
 """ historical
 class BlockDescriptions2(BlockDescriptions):
@@ -110,15 +419,7 @@ class BlockDescriptions2(BlockDescriptions):
 """
 
 def truncate(array, skip):
-    (b, k) = array.shape
-    indices = list(range(0, k, skip))
-    #print (indices)
-    shape2 = (b, len(indices))
-    #print (shape2, array.shape)
-    out = np.zeros(shape2, array.dtype)
-    for i in indices:
-        out[:,i//skip] = array[:, i]
-    return out
+    return np.ascontiguousarray(array[:, ::skip])
 
 """
 def get_values_and_geometry0(from_filename, source="prim", index=0, verbose=True):
@@ -142,7 +443,7 @@ def copy_single_value(from_filename, to_filename, source="prim", index=0):
     phis = a32(f["x1f"][:])
     thetas = a32(f["x2f"][:])
     rs = a32(f["x3f"][:])
-    values1 = a32(f[source][:][index])
+    values1 = a32(read_variable(f, source, index))
     (bb, nphi, ntheta, nr) = values1.shape
     ext_values = values1.reshape((1, bb, nphi, ntheta, nr))
     out.create_dataset('x1f', data=phis)
@@ -152,48 +453,99 @@ def copy_single_value(from_filename, to_filename, source="prim", index=0):
     out.close()
     print("from", from_filename, "copied", source, index, "to", to_filename)
 
-def get_values_and_geometry(from_filename, source="prim", index=0, verbose=True):
-    f = h5py.File(from_filename, 'r')
-    phis = a32(f["x1f"][:])
-    thetas = a32(f["x2f"][:])
-    rs = a32(f["x3f"][:])
-    values1 = f[source][:][index]
-    values = values1
-    if 1:
-        # don't know how to do this the smart way
-        rs = a32(f["x1f"][:])
-        thetas = a32(f["x2f"][:])
-        phis = a32(f["x3f"][:])
-        (bb, nphi, ntheta, nr) = values1.shape
-        values = np.zeros((bb, nr, ntheta, nphi), dtype=np.float32)
-        for b in range(bb):
-            for ir in range(nr):
-                for itheta in range(ntheta):
-                    #for iphi in range(nphi):
-                    #    values[b, ir, itheta, iphi] = values1[b, iphi, itheta, ir]
-                    values[b, ir, itheta, :] = values1[b, :, itheta, ir]
+# bytes of source blocks to transpose at a time
+TRANSPOSE_CHUNK_BYTES = 1 << 22
+
+@profiling.staged("transpose")
+def to_r_theta_phi(values1, dtype=np.float32):
+    """
+    Convert the Athena++ (block, phi, theta, r) layout to a contiguous (block, r, theta, phi) array.
+    Blocks are transposed a chunk at a time to keep the working set small enough for the cache.
+    """
+    (bb, nphi, ntheta, nr) = values1.shape
+    values = np.empty((bb, nr, ntheta, nphi), dtype=dtype)
+    block_bytes = max(nphi * ntheta * nr * values1.dtype.itemsize, 1)
+    chunk = max(1, TRANSPOSE_CHUNK_BYTES // block_bytes)
+    for start in range(0, bb, chunk):
+        end = min(start + chunk, bb)
+        values[start:end] = values1[start:end].transpose((0, 3, 2, 1))
+    return values
+
+def test_transpose(shape=(7, 5, 4, 6), seed=0):
+    "compare to_r_theta_phi to the explicit loop conversion on synthetic data."
+    values1 = np.random.RandomState(seed).normal(size=shape).astype(np.float32)
+    (bb, nphi, ntheta, nr) = shape
+    expected = np.zeros((bb, nr, ntheta, nphi), dtype=np.float32)
+    for b in range(bb):
+        for ir in range(nr):
+            for itheta in range(ntheta):
+                for iphi in range(nphi):
+                    expected[b, ir, itheta, iphi] = values1[b, iphi, itheta, ir]
+    values = to_r_theta_phi(values1)
+    assert values.flags["C_CONTIGUOUS"]
+    if not np.array_equal(values, expected):
+        raise ValueError("transposed values do not match loop conversion")
+    print ("all ok")
+
+def block_slice(block_range):
+    if block_range is None:
+        return slice(None)
+    (start, end) = block_range
+    return slice(start, end)
+
+@profiling.staged("read")
+def read_geometry(f, block_range=None):
+    "Read the (rs, thetas, phis) face arrays from an open athdf file, optionally for a block range."
+    blocks = block_slice(block_range)
+    rs = a32(f["x1f"][blocks])
+    thetas = a32(f["x2f"][blocks])
+    phis = a32(f["x3f"][blocks])
+    profiling.count("bytes_read", rs.nbytes + thetas.nbytes + phis.nbytes)
+    return (rs, thetas, phis)
+
+def read_variable(f, source, index, block_range=None):
+    """
+    Read one variable from an open athdf file as a (block, phi, theta, r) array.
+    Only the [index] hyperslab of the dataset (optionally for a block range) is read.
+    """
+    with profiling.stage("read"):
+        values = f[source][(index, block_slice(block_range))]
+    profiling.count("bytes_read", values.nbytes)
+    return values
+
+def read_variables(f, source, indices, block_range=None):
+    """
+    Read several variables of one dataset from an open athdf file in a single hyperslab selection.
+    Returns a (len(indices), block, phi, theta, r) array in sorted index order.
+    """
+    with profiling.stage("read"):
+        values = f[source][(sorted(indices), block_slice(block_range))]
+    profiling.count("bytes_read", values.nbytes)
+    return values
+
+def get_values_and_geometry(from_filename, source="prim", index=0, verbose=True, block_range=None):
+    with h5py.File(from_filename, 'r') as f:
+        (rs, thetas, phis) = read_geometry(f, block_range)
+        values1 = read_variable(f, source, index, block_range)
+    values = to_r_theta_phi(values1)
+    bytes_read = values1.nbytes + rs.nbytes + thetas.nbytes + phis.nbytes
     if verbose:
         print("from", from_filename, source, index)
         print (rs.shape, thetas.shape, phis.shape, values.shape)
-    return BlockDescriptions(rs, thetas, phis, values)
+        print("    read %s bytes for %s" % (bytes_read, (source, index)))
+    result = BlockDescriptions(rs, thetas, phis, values)
+    result.bytes_read = bytes_read
+    return result
 
 def get_viz_values(from_filename, source="prim", index=0, verbose=True):
     f = h5py.File(from_filename, 'r')
     rs = a32(f["x1f"][:])
     thetas = a32(f["x2f"][:])
     phis = a32(f["x3f"][:])
-    values1 = f[source][:][index]
+    values1 = read_variable(f, source, index)
     print("v", values1.shape, "r", rs.shape, "theta", thetas.shape, "phi", phis.shape)
     #values = values1.copy()
-    # don't know how to do this the smart way
-    (bb, nphi, ntheta, nr) = values1.shape
-    values = np.zeros((bb, nr, ntheta, nphi), dtype=np.float32)
-    for b in range(bb):
-        for ir in range(nr):
-            for itheta in range(ntheta):
-                for iphi in range(nphi):
-                    values[b, ir, itheta, iphi] = values1[b, iphi, itheta, ir]
+    values = to_r_theta_phi(values1)
     if verbose:
         print (rs.shape, thetas.shape, phis.shape, values.shape)
     return BlockDescriptions(rs, thetas, phis, values)
-
@@ -1,12 +1,14 @@
 import numpy as np
 from bisect import bisect_right, bisect_left
+from math import floor
+from multiprocessing import Pool, shared_memory
 
 #np.set_printoptions(6, suppress=True)
 
 def ar(*values):
-    return np.array(values, dtype=np.float)
+    return np.array(values, dtype=np.float64)
 
-vertex_coefficients = np.zeros((8,8), dtype=np.float)
+vertex_coefficients = np.zeros((8,8), dtype=np.float64)
 
 for i in range(2):
     for j in range(2):
@@ -35,7 +37,7 @@ def interpolate_corners(corner_values, xyz_offset):
     #print(matrix)
     xyz_centered = 2 * xyz_offset - 1
     (x,y,z) = xyz_centered
-    terms = np.array([x*y*z, x*y, x*z, y*z, x, y, z, 1.0], dtype=np.float)
+    terms = np.array([x*y*z, x*y, x*z, y*z, x, y, z, 1.0], dtype=np.float64)
     #print("terms")
     #print(terms)
     summands = (matrix.T).dot(terms.T)
@@ -43,11 +45,30 @@ def interpolate_corners(corner_values, xyz_offset):
     #print(summands)
     return summands.sum() / 8.0
 
+def corner_weights(xyz_offsets):
+    """
+    Trilinear weights for an (N,3) array of offsets in the unit cube.
+    Result has shape (N,8) with corners in the interpolate_corners order (i*4 + j*2 + k).
+    """
+    xyz_offsets = np.asarray(xyz_offsets, dtype=np.float64)
+    def pair(t):
+        return np.stack([1.0 - t, t], axis=1)
+    wx = pair(xyz_offsets[:, 0])
+    wy = pair(xyz_offsets[:, 1])
+    wz = pair(xyz_offsets[:, 2])
+    weights = wx[:, :, None, None] * wy[:, None, :, None] * wz[:, None, None, :]
+    return weights.reshape((-1, 8))
+
+def interpolate_corners_batch(corner_values, xyz_offsets):
+    "Vectorized interpolate_corners for (N,2,2,2) corner values and (N,3) offsets."
+    corner_values = np.asarray(corner_values).reshape((-1, 8))
+    return (corner_values * corner_weights(xyz_offsets)).sum(axis=1)
+
 def test_corners0():
     for x_offset in (0,1):
         for y_offset in (0,1):
             for z_offset in (0,1):
-                xyz_offset = np.array([x_offset, y_offset, z_offset], dtype=np.float)
+                xyz_offset = np.array([x_offset, y_offset, z_offset], dtype=np.float64)
                 corner_values = (np.arange(8)).reshape((2,2,2)) + x_offset *3 + y_offset * 7 + z_offset * 2 - 2
                 test_value = x_offset + y_offset * 3 + z_offset * 5 - 12
                 corner_values[x_offset, y_offset, z_offset] = test_value
@@ -61,7 +82,7 @@ def test_center():
     for x_offset in (0,1):
         for y_offset in (0,1):
             for z_offset in (0,1):
-                xyz_offset = np.array([0.5, 0.5, 0.5], dtype=np.float)
+                xyz_offset = np.array([0.5, 0.5, 0.5], dtype=np.float64)
                 corner_values = (np.arange(8)).reshape((2,2,2)) + x_offset *3 + y_offset * 7 + z_offset * 2 - 2
                 test_value = corner_values.mean()
                 interp = interpolate_corners(corner_values, xyz_offset)
@@ -70,10 +91,42 @@ def test_center():
                 print (xyz_offset, test_value)
     print ("all ok")
 
+def test_batch(npoints=1000, seed=0):
+    "compare the batch interpolation to the point by point interpolation."
+    rng = np.random.RandomState(seed)
+    shape = (5, 4, 6)
+    block = rng.normal(size=shape)
+    offsets = [np.cumsum(rng.uniform(0.5, 2.0, size=n+1)).astype(np.float32) for n in shape]
+    b = BlockInterpolator(block, *offsets)
+    mins = b.mins - 0.5
+    maxes = b.maxes + 0.5
+    xyzs = mins + rng.uniform(size=(npoints, 3)) * (maxes - mins)
+    # include the grid points themselves
+    xyzs[:shape[0], 0] = offsets[0][:shape[0]]
+    (values, missing) = b.interpolate_points(xyzs)
+    for (i, xyz) in enumerate(xyzs):
+        expected = b.interpolate(xyz.copy())
+        if expected is None:
+            if not missing[i]:
+                raise ValueError("%s should be missing" % (xyz,))
+        elif missing[i] or abs(values[i] - expected) > 1e-10:
+            raise ValueError("%s expected %s but got %s" % (xyz, expected, values[i]))
+    print ("missing", missing.sum(), "of", npoints)
+    print ("all ok")
+
+def expanded_offsets(old_offsets):
+    ln = old_offsets.shape[0]
+    result = np.zeros(ln+1)
+    result[:ln] = old_offsets
+    result[ln] = old_offsets[-1]  # keep consistency for now.
+    return result
+
 class BlockInterpolator:
     
-    def __init__(self, block, x_offsets, y_offsets, z_offsets):
+    def __init__(self, block, x_offsets, y_offsets, z_offsets, identifier=None):
         (self.block, self.x_offsets, self.y_offsets, self.z_offsets) = (block, x_offsets, y_offsets, z_offsets)
+        # position of the block in the source arrays, if known
+        self.identifier = identifier
         #self.offsets = [x_offsets, y_offsets, z_offsets]
         self.delta_x = x_offsets[1:] - x_offsets[:-1]
         self.delta_y = y_offsets[1:] - y_offsets[:-1]
@@ -83,38 +136,38 @@ class BlockInterpolator:
         self.maxes = ar(x_offsets[nx-1], y_offsets[ny-1], z_offsets[nz-1])
 
     def lower_border(self):
-        "hash lookup along minimum x,y,z values"
+        """
+        Points (M,3), values (M,) and flat block indices (M,) along the minimum x,y,z faces
+        for exact border lookups.
+        """
         (block, x_offsets, y_offsets, z_offsets) = (self.block, self.x_offsets, self.y_offsets, self.z_offsets)
         (nx, ny, nz) = block.shape
-        border = {}
-        k = 0
-        for i in range(nx):
-            for j in range(ny):
-                border[(x_offsets[i], y_offsets[j], z_offsets[k])] = block[i,j,k]
-        j = 0
-        for i in range(nx):
-            for k in range(nz):
-                border[(x_offsets[i], y_offsets[j], z_offsets[k])] = block[i,j,k]
-        i = 0
-        for k in range(nz):
-            for j in range(ny):
-                border[(x_offsets[i], y_offsets[j], z_offsets[k])] = block[i,j,k]
-        return border
+        def face(I, J, K):
+            (I, J, K) = np.meshgrid(I, J, K, indexing="ij")
+            return (I.ravel(), J.ravel(), K.ravel())
+        (ax, ay, az) = (np.arange(nx), np.arange(ny), np.arange(nz))
+        faces = [face(ax, ay, [0]), face(ax, [0], az), face([0], ay, az)]
+        (I, J, K) = [np.concatenate([f[d] for f in faces]) for d in range(3)]
+        points = np.stack([x_offsets[I], y_offsets[J], z_offsets[K]], axis=1).astype(np.float64)
+        return (points, block[I, J, K], np.ravel_multi_index((I, J, K), block.shape))
         
-    def expand(self, interpolator):
+    def new_block(self, out=None):
+        "Array for the expanded block: out if given, otherwise a new array of the block dtype."
+        (nx, ny, nz) = self.block.shape
+        shape = (nx+1, ny+1, nz+1)
+        if out is None:
+            return np.zeros(shape, dtype=self.block.dtype)
+        assert out.shape == shape, "bad output slot shape " + repr((out.shape, shape))
+        return out
+
+    def expand(self, interpolator, out=None):
         old_block = self.block
         (nx, ny, nz) = old_block.shape
         (nx1, ny1, nz1) = (nx-1, ny-1, nz-1)
-        new_block = np.zeros((nx+1, ny+1, nz+1), dtype=np.float)
-        def new_offsets(old_offsets):
-            ln = old_offsets.shape[0]
-            result = np.zeros(ln+1)
-            result[:ln] = old_offsets
-            result[ln] = old_offsets[-1]  # keep consistency for now.
-            return result
-        new_x_offsets = new_offsets(self.x_offsets)
-        new_y_offsets = new_offsets(self.y_offsets)
-        new_z_offsets = new_offsets(self.z_offsets)
+        new_block = self.new_block(out)
+        new_x_offsets = expanded_offsets(self.x_offsets)
+        new_y_offsets = expanded_offsets(self.y_offsets)
+        new_z_offsets = expanded_offsets(self.z_offsets)
         # fill in new block
         new_block[:nx, :ny, :nz] = old_block
         # interpolate expanded boundary
@@ -133,6 +186,49 @@ class BlockInterpolator:
             for j in range(ny+1):
                 interpolate(nx, j, k)
         return BlockInterpolator(new_block, new_x_offsets, new_y_offsets, new_z_offsets)
+
+    def expand_points(self, points_interpolator, slabs=None, out=None):
+        """
+        Expand like expand, but gather all the new face points into one (N,3) array
+        and resolve them with a single call points_interpolator(xyzs, defaults) --> values.
+        slabs optionally maps an axis to the lower slab of a same level neighbor across
+        the upper face on that axis, which is copied instead of interpolated.
+        out is an optional preallocated (nx+1, ny+1, nz+1) slot to write the expanded block into.
+        """
+        slabs = slabs or {}
+        old_block = self.block
+        (nx, ny, nz) = old_block.shape
+        new_block = self.new_block(out)
+        new_x_offsets = expanded_offsets(self.x_offsets)
+        new_y_offsets = expanded_offsets(self.y_offsets)
+        new_z_offsets = expanded_offsets(self.z_offsets)
+        new_block[:nx, :ny, :nz] = old_block
+        def face(I, J, K):
+            (I, J, K) = np.meshgrid(I, J, K, indexing="ij")
+            return (I.ravel(), J.ravel(), K.ravel())
+        (ax, ay, az) = (np.arange(nx+1), np.arange(ny+1), np.arange(nz+1))
+        faces = [face(ax, ay, [nz]), face(ax, [ny], az), face([nx], ay, az)]
+        (I, J, K) = [np.concatenate([f[d] for f in faces]) for d in range(3)]
+        xyzs = np.stack([new_x_offsets[I], new_y_offsets[J], new_z_offsets[K]], axis=1)
+        defaults = old_block[np.minimum(I, nx-1), np.minimum(J, ny-1), np.minimum(K, nz-1)]
+        # face interiors covered by a neighbor slab need no interpolation
+        (shape, indices) = ((nx, ny, nz), (I, J, K))
+        copied = np.zeros(I.shape, dtype=bool)
+        for axis in slabs:
+            (a, b) = [d for d in range(3) if d != axis]
+            copied |= (indices[axis] == shape[axis]) & (indices[a] < shape[a]) & (indices[b] < shape[b])
+        values = np.zeros(I.shape, dtype=np.float64)
+        interpolated = ~copied
+        values[interpolated] = points_interpolator(xyzs[interpolated], defaults[interpolated])
+        (k_face, j_face, i_face) = np.split(values, [(nx+1) * (ny+1), (nx+1) * (ny+1 + nz+1)])
+        new_block[:, :, nz] = k_face.reshape((nx+1, ny+1))
+        new_block[:, ny, :] = j_face.reshape((nx+1, nz+1))
+        new_block[nx, :, :] = i_face.reshape((ny+1, nz+1))
+        for (axis, slab) in slabs.items():
+            index = [slice(0, nx), slice(0, ny), slice(0, nz)]
+            index[axis] = shape[axis]
+            new_block[tuple(index)] = slab
+        return BlockInterpolator(new_block, new_x_offsets, new_y_offsets, new_z_offsets)
         
     def info(self):
         print ("x", self.x_offsets)
@@ -174,10 +270,318 @@ class BlockInterpolator:
             return interpolate_corners(corner_values, cxyz)
         else:
             return None # no interpolation in this block
-        
+
+    def corner_weights(self, xyzs):
+        """
+        Locate an (N,3) array of points in the block.
+        Returns (corners, weights, missing) where corners are (N,8) flat indices into self.block,
+        weights are the matching (N,8) trilinear weights and missing marks points outside the block.
+        Corners and weights of missing points are zero.
+        """
+        xyzs = np.asarray(xyzs, dtype=np.float64).reshape((-1, 3))
+        block = self.block
+        (nx, ny, nz) = block.shape
+        missing = np.zeros((xyzs.shape[0],), dtype=bool)
+        def offset(x, x_offsets, delta_x, n):
+            ix = np.searchsorted(x_offsets, x, side="right")
+            missing[:] |= (ix <= 0) | (ix >= n)
+            ix = np.clip(ix, 1, max(n - 1, 1))
+            dx = (x - x_offsets[ix-1]) / delta_x[ix-1]
+            return (ix - 1, dx)
+        (ix, dx) = offset(xyzs[:, 0], self.x_offsets, self.delta_x, nx)
+        (iy, dy) = offset(xyzs[:, 1], self.y_offsets, self.delta_y, ny)
+        (iz, dz) = offset(xyzs[:, 2], self.z_offsets, self.delta_z, nz)
+        base = (ix * ny + iy) * nz + iz
+        corner_steps = np.array(
+            [i * ny * nz + j * nz + k for i in range(2) for j in range(2) for k in range(2)])
+        corners = base[:, None] + corner_steps[None, :]
+        weights = corner_weights(np.stack([dx, dy, dz], axis=1))
+        corners[missing] = 0
+        weights[missing] = 0
+        return (corners, weights, missing)
+
+    def interpolate_points(self, xyzs):
+        """
+        Batch version of interpolate for an (N,3) array of points.
+        Returns (values, missing) where missing marks the points not in this block (values 0 there).
+        """
+        (corners, weights, missing) = self.corner_weights(xyzs)
+        values = (self.block.ravel()[corners] * weights).sum(axis=1)
+        return (values, missing)
+
     def __lt__(self, other):
         return self.mins[0] < other.mins[0]
 
+# Face kinds for the adjacency table.  Face index 2*axis + side where side 0 is the lower face.
+FACE_BOUNDARY = 0
+FACE_SAME_LEVEL = 1
+FACE_COARSER = 2
+FACE_FINER = 3
+
+def face_adjacency(lows, highs, shapes, limits):
+    """
+    Classify the 6 faces of every block from the block bounds (lows, highs shape (B,3)),
+    the cell counts (shapes (B,3)) and the wrapped dimensions given by limits.
+    Returns (kinds, neighbors), both shape (B,6): the face kind and the neighbor block
+    for same level and coarser faces (-1 otherwise).
+    """
+    lows = np.asarray(lows, dtype=np.float64)
+    highs = np.asarray(highs, dtype=np.float64)
+    shapes = np.asarray(shapes)
+    nblocks = lows.shape[0]
+    kinds = np.zeros((nblocks, 6), dtype=np.int8)
+    neighbors = np.full((nblocks, 6), -1, dtype=np.int64)
+    # face coordinates match within a small fraction of the finest cell
+    tolerance = 1e-3 * ((highs - lows) / shapes).min(axis=0)
+    # upper faces at the wrap limit touch the lower faces at 0
+    wrapped_highs = highs.copy()
+    for (axis, limit) in enumerate(limits):
+        if limit is not None:
+            column = wrapped_highs[:, axis]
+            column[column >= limit] = 0
+    def classify(b, candidates, transverse):
+        if len(candidates) == 0:
+            return (FACE_BOUNDARY, -1)
+        if len(candidates) == 1:
+            [n] = candidates
+            t = transverse
+            tol = tolerance[t]
+            if (np.all(np.abs(lows[n, t] - lows[b, t]) <= tol) and
+                np.all(np.abs(highs[n, t] - highs[b, t]) <= tol)):
+                if np.all(shapes[n, t] == shapes[b, t]):
+                    return (FACE_SAME_LEVEL, n)
+                if np.all(shapes[n, t] <= shapes[b, t]):
+                    return (FACE_COARSER, n)
+            elif np.all(lows[n, t] <= lows[b, t] + tol) and np.all(highs[n, t] >= highs[b, t] - tol):
+                return (FACE_COARSER, n)
+        return (FACE_FINER, -1)
+    for axis in range(3):
+        transverse = [d for d in range(3) if d != axis]
+        tol = tolerance[axis]
+        for (side, mine, theirs) in ((0, lows, wrapped_highs), (1, wrapped_highs, lows)):
+            # candidates touching each face come from a sorted search on the other blocks' faces
+            order = np.argsort(theirs[:, axis], kind="stable")
+            sorted_faces = theirs[order, axis]
+            starts = np.searchsorted(sorted_faces, mine[:, axis] - tol, side="left")
+            ends = np.searchsorted(sorted_faces, mine[:, axis] + tol, side="right")
+            for b in range(nblocks):
+                touching = order[starts[b]:ends[b]]
+                touching = touching[touching != b]
+                t = transverse
+                overlap = (np.all(lows[touching][:, t] < highs[b, t] - tolerance[t], axis=1) &
+                    np.all(highs[touching][:, t] > lows[b, t] + tolerance[t], axis=1))
+                (kind, neighbor) = classify(b, touching[overlap], transverse)
+                kinds[b, 2 * axis + side] = kind
+                neighbors[b, 2 * axis + side] = neighbor
+    return (kinds, neighbors)
+
+# Status codes for InterpolateBlocks.gather_weights.
+GATHER_MISSING = 0
+GATHER_BORDER = 1
+GATHER_INTERPOLATED = 2
+
+class BorderIndex:
+
+    """
+    Coordinate lookup table for block border values.
+    Coordinates are quantized to their rank among the distinct values on each axis
+    and the combined ranks are kept sorted for vectorized searchsorted lookups.
+    Values on an axis within tolerance (one per axis, default exact) of each other get the same
+    rank, so a coordinate computed separately by a neighboring block which differs by a few ulps
+    still matches.  Exactly matching coordinates get the same ranks as with an exact table.
+    """
+
+    def __init__(self, points, values, sources=None, tolerance=None):
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+        values = np.asarray(values)
+        self.tolerance = np.zeros((3,)) if tolerance is None else np.asarray(tolerance, dtype=np.float64)
+        # the distinct values on each axis and their ranks (the same for values within tolerance)
+        self.axes = []
+        self.axis_ranks = []
+        for d in range(3):
+            axis = np.unique(points[:, d])
+            starts = np.ones(axis.shape, dtype=bool)
+            starts[1:] = np.diff(axis) > self.tolerance[d]
+            self.axes.append(axis)
+            self.axis_ranks.append(np.cumsum(starts) - 1)
+        self.rank_counts = [int(ranks[-1]) + 1 if len(ranks) else 0 for ranks in self.axis_ranks]
+        keys = self.combine([self.axis_ranks[d][np.searchsorted(self.axes[d], points[:, d])] for d in range(3)])
+        # later entries win for repeated points, like dict.update
+        (self.keys, reversed_index) = np.unique(keys[::-1], return_index=True)
+        kept = len(keys) - 1 - reversed_index
+        self.values = values[kept]
+        # optional flat source array indices of the values
+        self.sources = None
+        if sources is not None:
+            self.sources = np.asarray(sources)[kept]
+        self.lookups = 0
+        self.hits = 0
+
+    def combine(self, ranks):
+        (n1, n2) = self.rank_counts[1:]
+        return (ranks[0].astype(np.int64) * n1 + ranks[1]) * n2 + ranks[2]
+
+    def nbytes(self):
+        result = self.keys.nbytes + self.values.nbytes + sum(a.nbytes for a in self.axes + self.axis_ranks)
+        if self.sources is not None:
+            result += self.sources.nbytes
+        return result
+
+    def lookup_point(self, xyz):
+        "Look up one point without array overhead, returning None if it is not in the table."
+        self.lookups += 1
+        ranks = []
+        for (d, axis) in enumerate(self.axes):
+            x = xyz[d]
+            position = bisect_left(axis, x)
+            # the nearer of the distinct values on either side
+            if position > 0 and (position == len(axis) or x - axis[position - 1] < axis[position] - x):
+                position -= 1
+            if position >= len(axis) or abs(axis[position] - x) > self.tolerance[d]:
+                return None
+            ranks.append(int(self.axis_ranks[d][position]))
+        (n1, n2) = self.rank_counts[1:]
+        key = (ranks[0] * n1 + ranks[1]) * n2 + ranks[2]
+        position = bisect_left(self.keys, key)
+        if position >= len(self.keys) or self.keys[position] != key:
+            return None
+        self.hits += 1
+        return self.values[position]
+
+    def positions(self, xyzs):
+        "Table positions (N,) and hit mask (N,) for an (N,3) array of points."
+        xyzs = np.asarray(xyzs, dtype=np.float64).reshape((-1, 3))
+        npoints = xyzs.shape[0]
+        hit = np.ones((npoints,), dtype=bool)
+        ranks = []
+        for (d, axis) in enumerate(self.axes):
+            x = xyzs[:, d]
+            above = np.minimum(np.searchsorted(axis, x), len(axis) - 1)
+            below = np.maximum(above - 1, 0)
+            # the nearer of the distinct values on either side
+            position = np.where(np.abs(axis[below] - x) < np.abs(axis[above] - x), below, above)
+            hit &= (np.abs(axis[position] - x) <= self.tolerance[d])
+            ranks.append(self.axis_ranks[d][position])
+        keys = self.combine(ranks)
+        position = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit &= (self.keys[position] == keys)
+        self.lookups += npoints
+        self.hits += int(hit.sum())
+        return (position, hit)
+
+    def lookup(self, xyzs):
+        """
+        Look up an (N,3) array of points.
+        Returns (values, hit) where hit marks points found in the table (values 0 elsewhere).
+        """
+        (position, hit) = self.positions(xyzs)
+        return (np.where(hit, self.values[position], 0), hit)
+
+    def lookup_sources(self, xyzs):
+        "Like lookup, but return the source indices of the values (requires sources)."
+        (position, hit) = self.positions(xyzs)
+        return (np.where(hit, self.sources[position], 0), hit)
+
+class BlockIndex:
+
+    """
+    Uniform bin grid over block bounding boxes for locating points in blocks.
+    A block contains the points with mins <= xyz < maxes.
+    """
+
+    def __init__(self, mins, maxes, max_bins=None):
+        mins = np.asarray(mins, dtype=np.float64)
+        maxes = np.asarray(maxes, dtype=np.float64)
+        (self.mins, self.maxes) = (mins, maxes)
+        nblocks = mins.shape[0]
+        if max_bins is None:
+            max_bins = 32 * nblocks + 1
+        low = mins.min(axis=0)
+        high = maxes.max(axis=0)
+        extent = high - low
+        extent[extent <= 0] = 1.0
+        # size bins by the smallest blocks, coarsening uniformly if there are too many bins
+        sizes = (maxes - mins).min(axis=0)
+        sizes = np.where(sizes > 0, sizes, extent)
+        shape = np.ceil(extent / sizes)
+        total = shape.prod()
+        if total > max_bins:
+            shape = np.ceil(shape * (max_bins / total) ** (1.0 / 3))
+        shape = np.maximum(shape, 1).astype(np.int64)
+        (self.low, self.shape) = (low, shape)
+        self.bin_size = extent / shape
+        # register every block in each bin its box overlaps
+        first = self.bin_coordinates(mins)
+        last = self.bin_coordinates(maxes)
+        spans = last - first + 1
+        counts = spans.prod(axis=1)
+        block_ids = np.repeat(np.arange(nblocks), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        plane = (spans[:, 1] * spans[:, 2])[block_ids]
+        bx = first[block_ids, 0] + local // plane
+        by = first[block_ids, 1] + (local % plane) // spans[block_ids, 2]
+        bz = first[block_ids, 2] + local % spans[block_ids, 2]
+        bins = (bx * shape[1] + by) * shape[2] + bz
+        order = np.argsort(bins, kind="stable")
+        self.bin_blocks = block_ids[order]
+        self.bin_starts = np.searchsorted(bins[order], np.arange(shape.prod() + 1))
+        self.lookups = 0
+        self.candidate_tests = 0
+        self.located = 0
+        # plain python copies for single point lookups
+        self.point_tables = (low.tolist(), self.bin_size.tolist(), shape.tolist(), 
+            self.bin_starts.tolist(), self.bin_blocks.tolist(), mins.tolist(), maxes.tolist())
+
+    def locate_point(self, xyz):
+        "Find the block containing one point (-1 if none) without array overhead."
+        (low, bin_size, shape, bin_starts, bin_blocks, mins, maxes) = self.point_tables
+        self.lookups += 1
+        b = 0
+        for i in range(3):
+            c = int(floor((xyz[i] - low[i]) / bin_size[i]))
+            c = min(max(c, 0), shape[i] - 1)
+            b = b * shape[i] + c
+        for candidate in bin_blocks[bin_starts[b]: bin_starts[b+1]]:
+            self.candidate_tests += 1
+            (m, M) = (mins[candidate], maxes[candidate])
+            if (m[0] <= xyz[0] < M[0]) and (m[1] <= xyz[1] < M[1]) and (m[2] <= xyz[2] < M[2]):
+                self.located += 1
+                return candidate
+        return -1
+
+    def bin_coordinates(self, xyzs):
+        coordinates = np.floor((xyzs - self.low) / self.bin_size).astype(np.int64)
+        return np.clip(coordinates, 0, self.shape - 1)
+
+    def locate(self, xyzs):
+        """
+        Find the blocks containing an (N,3) array of points.
+        Returns an (N,) array of block indices, -1 where no block contains the point.
+        """
+        xyzs = np.asarray(xyzs, dtype=np.float64).reshape((-1, 3))
+        npoints = xyzs.shape[0]
+        block_ids = np.full((npoints,), -1, dtype=np.int64)
+        self.lookups += npoints
+        if npoints == 0:
+            return block_ids
+        (ix, iy, iz) = self.bin_coordinates(xyzs).T
+        shape = self.shape
+        bins = (ix * shape[1] + iy) * shape[2] + iz
+        starts = self.bin_starts[bins]
+        counts = self.bin_starts[bins + 1] - starts
+        (mins, maxes, bin_blocks) = (self.mins, self.maxes, self.bin_blocks)
+        for j in range(counts.max()):
+            active = np.nonzero((counts > j) & (block_ids < 0))[0]
+            if len(active) == 0:
+                break
+            candidates = bin_blocks[starts[active] + j]
+            points = xyzs[active]
+            inside = np.all(mins[candidates] <= points, axis=1) & np.all(maxes[candidates] > points, axis=1)
+            block_ids[active[inside]] = candidates[inside]
+            self.candidate_tests += len(active)
+        self.located += int((block_ids >= 0).sum())
+        return block_ids
+
 """ HISTORICAL
 class InterpolateBlocks:
     
@@ -214,10 +618,10 @@ class InterpolateBlocks:
             y_values.append(eb.y_offsets)
             z_values.append(eb.z_offsets)
             intensities.append(eb.block)
-        intensities = np.array(intensities, dtype=np.float)
-        x_values = np.array(x_values, dtype=np.float)
-        y_values = np.array(y_values, dtype=np.float)
-        z_values = np.array(z_values, dtype=np.float)
+        intensities = np.array(intensities, dtype=np.float64)
+        x_values = np.array(x_values, dtype=np.float64)
+        y_values = np.array(y_values, dtype=np.float64)
+        z_values = np.array(z_values, dtype=np.float64)
         return {
             "intensities": intensities,
             "x_values": x_values,
@@ -265,41 +669,43 @@ class InterpolateBlocks:
         blocks = block_interpolators
         sort_index = 0
         self.x_block_list = sorted((b.maxes[sort_index], b) for b in blocks)
+        self.blocks = [b for (x, b) in self.x_block_list]
+        self.block_mins = np.array([b.mins for b in self.blocks])
+        self.block_maxes = np.array([b.maxes for b in self.blocks])
         maxes = blocks[0].maxes
         mins = blocks[0].mins
-        borders = {}
+        border_points = []
+        border_values = []
+        border_sources = []
         for b in blocks:
             maxes = np.maximum(maxes, b.maxes)
             mins = np.minimum(mins, b.mins)
-            borders.update(b.lower_border())
-        self.borders = borders
-        self.border_hits = 0
+            (points, values, indices) = b.lower_border()
+            border_points.append(points)
+            border_values.append(values)
+            if b.identifier is not None:
+                border_sources.append(b.identifier * b.block.size + indices)
+        if len(border_sources) < len(blocks):
+            border_sources = None
+        else:
+            border_sources = np.concatenate(border_sources)
+        # border coordinates match within a small fraction of the finest cell, like face_adjacency
+        widths = [[np.abs(b.delta_x).min(), np.abs(b.delta_y).min(), np.abs(b.delta_z).min()] for b in blocks]
+        tolerance = 1e-3 * np.min(widths, axis=0)
+        self.borders = BorderIndex(np.concatenate(border_points), np.concatenate(border_values), border_sources, tolerance)
         self.maxes = maxes
         self.mins = mins
         diff = maxes - mins
         self.diff = diff
         self.last_block = None
-        max_dict3 = {}
-        for b in blocks:
-            (x,y,z) = b.maxes
-            xdict = max_dict3.get(x, {})
-            ydict = xdict.get(y, {})
-            zlist = ydict.get(z, [])
-            zlist.append(b)
-            ydict[z] = zlist
-            xdict[y] = ydict
-            max_dict3[x] = xdict
-        x_order = sorted(max_dict3.keys())
-        self.x_order = x_order
-        for x in x_order:
-            xdict = max_dict3[x]
-            y_order = sorted(xdict.keys())
-            for y in y_order:
-                ydict = xdict[y]
-                z_order = sorted(ydict.keys())
-                xdict[y] = (z_order, ydict)
-            max_dict3[x] = (y_order, xdict)
-        self.max_dict3 = max_dict3
+        self.last_block_hits = 0
+        self.index = BlockIndex(self.block_mins, self.block_maxes)
+        # face adjacency from the full block extents
+        lows = np.array([[b.x_offsets[0], b.y_offsets[0], b.z_offsets[0]] for b in self.blocks])
+        highs = np.array([[b.x_offsets[-1], b.y_offsets[-1], b.z_offsets[-1]] for b in self.blocks])
+        shapes = np.array([b.block.shape for b in self.blocks])
+        (self.face_kinds, self.face_neighbors) = face_adjacency(lows, highs, shapes, limits)
+        self.slab_copies = 0
         M = blocks[0].block.max()
         for b in blocks:
             M = max(M, b.block.max())
@@ -309,80 +715,74 @@ class InterpolateBlocks:
             self.default = default
         #self.minimum = m
         
-    def expand_all(self, verbose=False):
-        "Expand all blocks and return summary structures"
-        intensities = []
-        x_values = []
-        y_values = []
-        z_values = []
+    def expanded_shapes(self):
+        "Shapes of the expanded intensities, x_values, y_values and z_values arrays."
+        nblocks = len(self.blocks)
+        b = self.blocks[0]
+        (nx, ny, nz) = b.block.shape
+        return [(nblocks, nx+1, ny+1, nz+1), (nblocks, len(b.x_offsets)+1), (nblocks, len(b.y_offsets)+1),
+            (nblocks, len(b.z_offsets)+1)]
+
+    def expand_all(self, verbose=False, batch=True, dtype=np.float32, out=None):
+        """
+        Expand all blocks and return summary structures.
+        By default resolve each block's new faces in one batch, otherwise point by point.
+        The expanded intensities are allocated once with the given dtype and each block is
+        written into its slot.  out may be a preallocated array or np.memmap of that shape instead.
+        """
+        (intensities_shape, x_shape, y_shape, z_shape) = self.expanded_shapes()
+        if out is None:
+            intensities = np.zeros(intensities_shape, dtype=dtype)
+        else:
+            assert out.shape == intensities_shape, "bad output shape " + repr((out.shape, intensities_shape))
+            intensities = out
+        x_values = np.zeros(x_shape, dtype=np.float64)
+        y_values = np.zeros(y_shape, dtype=np.float64)
+        z_values = np.zeros(z_shape, dtype=np.float64)
         expanded = []
         count = 0
-        for (x, b) in self.x_block_list:
+        for (block_id, b) in enumerate(self.blocks):
             if verbose:
                 count += 1
-                print("block", count, b.block.shape, self.border_hits)
-            eb = b.expand(self.interpolate)
+                print("block", count, b.block.shape, self.statistics())
+            slot = intensities[block_id]
+            if batch:
+                eb = b.expand_points(self.interpolate_points, self.same_level_slabs(block_id), out=slot)
+            else:
+                eb = b.expand(self.interpolate, out=slot)
             expanded.append(eb)
-            x_values.append(eb.x_offsets)
-            y_values.append(eb.y_offsets)
-            z_values.append(eb.z_offsets)
-            intensities.append(eb.block)
-        intensities = np.array(intensities, dtype=np.float)
-        x_values = np.array(x_values, dtype=np.float)
-        y_values = np.array(y_values, dtype=np.float)
-        z_values = np.array(z_values, dtype=np.float)
+            x_values[block_id] = eb.x_offsets
+            y_values[block_id] = eb.y_offsets
+            z_values[block_id] = eb.z_offsets
         return {
             "intensities": intensities,
             "x_values": x_values,
             "y_values": y_values,
             "z_values": z_values,
             "blocks": expanded,
+            "statistics": self.statistics(),
         }
         
     def interpolate(self, xyz, default=None, substitute=None):
         #print("b2 interpolating", xyz)
-        # try to find in precomputed borders
-        borders = self.borders
         # wrap limited dimensions
         for (index, limit) in enumerate(self.limits):
             if limit is not None and xyz[index] >= limit:
                 xyz[index] = 0
-        txyz = tuple(xyz)
-        hit = borders.get(txyz, None)
+        # try to find in precomputed borders
+        hit = self.borders.lookup_point(xyz)
         if hit is not None:
-            self.border_hits += 1
             return hit
         result = None
         # see if the last block still works
         block = self.last_block
         if (block is None) or (not block.in_range(xyz)):
-            #print ("  last block fails", block)
             block = None
-            (x, y, z) = xyz
-            max_dict3 = self.max_dict3
-            x_order = self.x_order
-            max_dict3 = self.max_dict3
-            startx = bisect_right(x_order, x)
-            for i in range(startx, len(x_order)):
-                Mx = x_order[i]
-                if (Mx < x) or (block is not None):
-                    break
-                (y_order, xdict) = max_dict3[Mx]
-                starty = bisect_right(y_order, y)
-                for j in range(starty, len(y_order)):
-                    My = y_order[j]
-                    if (My < y) or (block is not None):
-                        break
-                    (z_order, y_dict) = xdict[My]
-                    startz = bisect_right(z_order, z)
-                    for k in range(startz, len(z_order)):
-                        Mz = z_order[k]
-                        if (Mz < z) or (block is not None):
-                            break
-                        zlist = y_dict[Mz]
-                        for b in zlist:
-                            if b.in_range(xyz):
-                                block = b
+            block_id = self.index.locate_point(xyz)
+            if block_id >= 0:
+                block = self.blocks[block_id]
+        else:
+            self.last_block_hits += 1
         if block is not None:
             if substitute:
                 result = substitute
@@ -394,13 +794,234 @@ class InterpolateBlocks:
         self.last_block = block
         return result
 
+    def same_level_slabs(self, block_id):
+        "Map axis --> neighbor's lower slab for the upper faces of the block with same level neighbors."
+        slabs = {}
+        for axis in range(3):
+            face = 2 * axis + 1
+            if self.face_kinds[block_id, face] == FACE_SAME_LEVEL:
+                neighbor = self.blocks[self.face_neighbors[block_id, face]]
+                slabs[axis] = np.take(neighbor.block, 0, axis=axis)
+                self.slab_copies += slabs[axis].size
+        return slabs
+
+    def statistics(self):
+        "Lookup counters for reporting."
+        (index, borders) = (self.index, self.borders)
+        return {
+            "border_lookups": borders.lookups,
+            "border_hits": borders.hits,
+            "border_hit_rate": borders.hits / max(borders.lookups, 1),
+            "border_bytes": borders.nbytes(),
+            "last_block_hits": self.last_block_hits,
+            "lookups": index.lookups,
+            "candidate_tests": index.candidate_tests,
+            "located": index.located,
+            "slab_copies": self.slab_copies,
+        }
+
+    def wrap(self, xyzs):
+        "Wrap limited dimensions of an (N,3) array of points in place."
+        for (index, limit) in enumerate(self.limits):
+            if limit is not None:
+                column = xyzs[:, index]
+                column[column >= limit] = 0
+        return xyzs
+
+    def locate_points(self, xyzs):
+        """
+        Find the blocks containing an (N,3) array of points.
+        Returns an (N,) array of indices into self.blocks, -1 where no block contains the point.
+        """
+        xyzs = self.wrap(np.array(xyzs, dtype=np.float64).reshape((-1, 3)))
+        return self.index.locate(xyzs)
+
+    def interpolate_points(self, xyzs, defaults=None):
+        """
+        Batch version of interpolate for an (N,3) array of points.
+        Points not found in any block get the matching defaults entry (nan if defaults is None).
+        """
+        xyzs = self.wrap(np.array(xyzs, dtype=np.float64).reshape((-1, 3)))
+        npoints = xyzs.shape[0]
+        result = np.full((npoints,), np.nan, dtype=np.float64)
+        if defaults is not None:
+            result[:] = defaults
+        # try to find in precomputed borders
+        (values, hit) = self.borders.lookup(xyzs)
+        result[hit] = values[hit]
+        todo = np.nonzero(~hit)[0]
+        block_ids = self.index.locate(xyzs[todo])
+        for block_id in np.unique(block_ids[block_ids >= 0]):
+            selected = todo[block_ids == block_id]
+            (values, missing) = self.blocks[block_id].interpolate_points(xyzs[selected])
+            assert not missing.any()
+            result[selected] = values
+        return result
+
+    def gather_weights(self, xyzs):
+        """
+        Resolve an (N,3) array of points to gather weights over the flattened source values
+        (blocks must have identifiers from interpolator_from_arrays).
+        Returns (indices, weights, status): (N,8) flat source indices, (N,8) weights and
+        an (N,) status of GATHER_MISSING, GATHER_BORDER or GATHER_INTERPOLATED.
+        """
+        xyzs = self.wrap(np.array(xyzs, dtype=np.float64).reshape((-1, 3)))
+        npoints = xyzs.shape[0]
+        indices = np.zeros((npoints, 8), dtype=np.int64)
+        weights = np.zeros((npoints, 8), dtype=np.float64)
+        status = np.full((npoints,), GATHER_MISSING, dtype=np.int8)
+        (sources, hit) = self.borders.lookup_sources(xyzs)
+        indices[hit, 0] = sources[hit]
+        weights[hit, 0] = 1.0
+        status[hit] = GATHER_BORDER
+        todo = np.nonzero(~hit)[0]
+        block_ids = self.index.locate(xyzs[todo])
+        for block_id in np.unique(block_ids[block_ids >= 0]):
+            selected = todo[block_ids == block_id]
+            b = self.blocks[block_id]
+            (corners, corner_weights, missing) = b.corner_weights(xyzs[selected])
+            assert not missing.any()
+            indices[selected] = b.identifier * b.block.size + corners
+            weights[selected] = corner_weights
+            status[selected] = GATHER_INTERPOLATED
+        return (indices, weights, status)
+
 def interpolator_from_arrays(intensities, x_values, y_values, z_values, limits):
      blocks = []
      for (index, chunk) in enumerate(intensities):
          x_chunk = x_values[index]
          y_chunk = y_values[index]
          z_chunk = z_values[index]
-         b = BlockInterpolator(chunk, x_chunk, y_chunk, z_chunk)
+         b = BlockInterpolator(chunk, x_chunk, y_chunk, z_chunk, identifier=index)
          blocks.append(b)
      return InterpolateBlocks(blocks, limits)
 
+
+
+# statistics which are sizes or ratios rather than counts
+UNSUMMABLE_STATISTICS = ("border_hit_rate", "border_bytes")
+
+def summable_statistics(statistics):
+    "The counters of InterpolateBlocks.statistics which add up across blocks and files."
+    return dict((name, value) for (name, value) in statistics.items() if name not in UNSUMMABLE_STATISTICS)
+
+def share_array(array):
+    "Copy array into new shared memory.  Returns (shared_memory, shared_array, spec) where spec can attach it."
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return (shm, shared, (shm.name, array.shape, array.dtype.str))
+
+def attach_array(spec):
+    "Attach to an array in shared memory created by share_array."
+    (name, shape, dtype) = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return (shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+
+def memmap_spec(array):
+    "Spec for opening the file behind np.memmap array in another process."
+    return ("memmap", array.filename, array.offset, array.shape, array.dtype.str)
+
+# per process state for expand_all_parallel workers
+worker_state = {}
+
+def expand_worker_init(source_specs, output_specs, limits):
+    handles = []
+    def attach(spec):
+        if spec[0] == "memmap":
+            (kind, filename, offset, shape, dtype) = spec
+            return np.memmap(filename, dtype=np.dtype(dtype), mode="r+", offset=offset, shape=shape)
+        (shm, array) = attach_array(spec)
+        handles.append(shm)
+        return array
+    (intensities, x_values, y_values, z_values) = [attach(spec) for spec in source_specs]
+    worker_state["handles"] = handles
+    worker_state["outputs"] = [attach(spec) for spec in output_specs]
+    worker_state["interpolator"] = interpolator_from_arrays(intensities, x_values, y_values, z_values, limits)
+
+def expand_worker(block_range):
+    """
+    Expand the blocks in block_range (in InterpolateBlocks.blocks order) into the shared outputs.
+    Returns the block range and the lookup counters for the range.
+    """
+    (start, end) = block_range
+    interpolator = worker_state["interpolator"]
+    before = summable_statistics(interpolator.statistics())
+    (intensities, x_values, y_values, z_values) = worker_state["outputs"]
+    for block_id in range(start, end):
+        b = interpolator.blocks[block_id]
+        slabs = interpolator.same_level_slabs(block_id)
+        eb = b.expand_points(interpolator.interpolate_points, slabs, out=intensities[block_id])
+        x_values[block_id] = eb.x_offsets
+        y_values[block_id] = eb.y_offsets
+        z_values[block_id] = eb.z_offsets
+    after = summable_statistics(interpolator.statistics())
+    return (block_range, dict((name, after[name] - before[name]) for name in after))
+
+def expand_all_parallel(intensities, x_values, y_values, z_values, limits, workers, verbose=False,
+    dtype=np.float32, out=None):
+    """
+    Expand all blocks like interpolator_from_arrays(...).expand_all() using worker processes.
+    The source arrays and the expanded output live in shared memory and each worker expands
+    disjoint ranges of blocks directly into their output slots.  The resulting arrays are
+    identical to the serial expansion (the "blocks" list of BlockInterpolators is not built).
+    If out is an np.memmap the workers write the expanded intensities straight into its file.
+    """
+    (nblocks, nx, ny, nz) = intensities.shape
+    output_shapes = [
+        (nblocks, nx + 1, ny + 1, nz + 1),
+        (nblocks, x_values.shape[1] + 1),
+        (nblocks, y_values.shape[1] + 1),
+        (nblocks, z_values.shape[1] + 1),
+    ]
+    output_dtypes = [dtype if out is None else out.dtype, np.float64, np.float64, np.float64]
+    if out is not None:
+        assert out.shape == output_shapes[0], "bad output shape " + repr((out.shape, output_shapes[0]))
+    handles = []
+    try:
+        source_specs = []
+        for array in (intensities, x_values, y_values, z_values):
+            (shm, shared, spec) = share_array(np.ascontiguousarray(array))
+            handles.append(shm)
+            source_specs.append(spec)
+        outputs = []
+        output_specs = []
+        for (index, shape) in enumerate(output_shapes):
+            if index == 0 and isinstance(out, np.memmap):
+                # workers open the file themselves
+                outputs.append(out)
+                output_specs.append(memmap_spec(out))
+                continue
+            (shm, shared, spec) = share_array(np.zeros(shape, dtype=output_dtypes[index]))
+            handles.append(shm)
+            outputs.append(shared)
+            output_specs.append(spec)
+        # several ranges per worker to balance the load
+        nranges = min(nblocks, workers * 4)
+        bounds = np.linspace(0, nblocks, nranges + 1).astype(int)
+        ranges = [(int(bounds[i]), int(bounds[i+1])) for i in range(nranges)]
+        totals = {}
+        with Pool(workers, expand_worker_init, (source_specs, output_specs, limits)) as pool:
+            for (block_range, statistics) in pool.imap_unordered(expand_worker, ranges):
+                if verbose:
+                    print("expanded blocks", block_range, statistics)
+                for (name, amount) in statistics.items():
+                    totals[name] = totals.get(name, 0) + amount
+        (x_values, y_values, z_values) = [np.array(array) for array in outputs[1:]]
+        if out is None:
+            intensities = np.array(outputs[0])
+        else:
+            if outputs[0] is not out:
+                out[...] = outputs[0]
+            intensities = out
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+    return {
+        "intensities": intensities,
+        "x_values": x_values,
+        "y_values": y_values,
+        "z_values": z_values,
+        "statistics": totals,
+    }
@@ -0,0 +1,305 @@
+"""
+Precomputed isosurface meshes for expanded blocks.
+
+Each block is triangulated by marching tetrahedra in its (r, theta, phi) index space: every
+cube of 8 samples is split into the 6 tetrahedra sharing its main diagonal (so neighboring
+cubes agree on their shared faces), all cubes of a block are classified at once with numpy,
+and the crossing points on the tetrahedron edges are shared by the triangles which meet there.
+As in the viewer, sample i of a block lies on face i of its coordinate arrays and positions
+between samples are linear in r, theta and phi before the mapping to Cartesian coordinates.
+Triangles are oriented so their normals point towards increasing values.
+
+write_meshes writes <prefix>.mesh holding, for each iso-level, uint16 positions quantized to
+the bounding box of the level and uint16 or uint32 triangle vertex indices.  <prefix>.mesh.json
+indexes the byte ranges of every level.  Blocks are triangulated in parallel worker processes.
+
+Example usage:
+
+$ python -m radiation_viz.isosurface ~/tmp/radiation_test/processed_data/x_rho_full.json --num_levels 3 --workers 4
+"""
+
+import argparse
+import os
+import json
+import numpy as np
+from multiprocessing import Pool
+from . import dump_json_and_binary
+from . import expand_blocks
+
+MESH_SUFFIX = ".mesh"
+POSITION_LEVELS = 65535
+
+# (dr, dtheta, dphi) offsets of the cube corners, numbered 4 * dr + 2 * dtheta + dphi
+CUBE_CORNERS = np.array([[(c >> 2) & 1, (c >> 1) & 1, c & 1] for c in range(8)])
+
+# the 6 tetrahedra of a cube around the diagonal from corner 0 to corner 7
+TETRAHEDRA = np.array([[0, 4, 6, 7], [0, 4, 5, 7], [0, 2, 6, 7], [0, 2, 3, 7], [0, 1, 5, 7], [0, 1, 3, 7]])
+
+def tetrahedron_cases():
+    """
+    For each of the 16 patterns of tetrahedron corners above the level (bit c set for corner c)
+    the triangles as lists of 3 edges (corner above, corner below).
+    """
+    cases = []
+    for code in range(16):
+        above = [c for c in range(4) if (code >> c) & 1]
+        below = [c for c in range(4) if not (code >> c) & 1]
+        if len(above) in (0, 4):
+            cases.append([])
+        elif len(above) == 1:
+            cases.append([[(above[0], c) for c in below]])
+        elif len(above) == 3:
+            cases.append([[(c, below[0]) for c in above]])
+        else:
+            # the crossing is a quadrilateral through edges ac, ad, bd, bc
+            ((a, b), (c, d)) = (above, below)
+            cases.append([[(a, c), (a, d), (b, d)], [(a, c), (b, d), (b, c)]])
+    return cases
+
+CASES = tetrahedron_cases()
+
+def spherical_to_cartesian(r, theta, phi):
+    sin_theta = np.sin(theta)
+    return np.stack([r * sin_theta * np.cos(phi), r * sin_theta * np.sin(phi), r * np.cos(theta)], axis=1)
+
+def block_isosurface(values, rs, thetas, phis, level):
+    """
+    Isosurface of one block of (r, theta, phi) samples with face arrays rs, thetas, phis.
+    Returns (vertices, triangles): (n, 3) float64 Cartesian positions and (m, 3) int64 vertex indices.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    (a, b, c) = values.shape
+    above = values > level
+    # only cubes with corners on both sides of the level hold triangles
+    count = np.zeros((a - 1, b - 1, c - 1), dtype=np.int8)
+    for (dr, dt, dp) in CUBE_CORNERS:
+        count += above[dr:a - 1 + dr, dt:b - 1 + dt, dp:c - 1 + dp]
+    (i, j, k) = np.nonzero((count > 0) & (count < 8))
+    if len(i) == 0:
+        return (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+    npoints = values.size
+    strides = np.array([b * c, c, 1])
+    origins = (i * b + j) * c + k
+    corner_index = origins[:, None] + (CUBE_CORNERS @ strides)[None, :]
+    tet_index = corner_index[:, TETRAHEDRA].reshape((-1, 4))
+    tet_above = above.reshape(-1)[tet_index]
+    codes = tet_above @ np.array([1, 2, 4, 8])
+    def grid_points(flat):
+        return np.stack([flat // (b * c), (flat // c) % b, flat % c], axis=-1).astype(np.float64)
+    (starts, ends, directions) = ([], [], [])
+    for code in range(1, 15):
+        selected = np.nonzero(codes == code)[0]
+        if len(selected) == 0:
+            continue
+        tets = tet_index[selected]
+        # direction of increasing value across the tetrahedron, for orienting its triangles
+        corners = grid_points(tets)
+        mask = tet_above[selected][:, :, None]
+        direction = (corners * mask).sum(axis=1) / mask.sum(axis=1) - (corners * ~mask).sum(axis=1) / (~mask).sum(axis=1)
+        for triangle in CASES[code]:
+            starts.append(tets[:, [edge[0] for edge in triangle]])
+            ends.append(tets[:, [edge[1] for edge in triangle]])
+            directions.append(direction)
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    directions = np.concatenate(directions)
+    # one vertex for each crossed edge (edges are keyed by the (above, below) sample pair)
+    (edge_keys, triangles) = np.unique((starts * npoints + ends).reshape(-1), return_inverse=True)
+    triangles = triangles.reshape((-1, 3))
+    (edge_starts, edge_ends) = (edge_keys // npoints, edge_keys % npoints)
+    flat = values.reshape(-1)
+    t = (level - flat[edge_starts]) / (flat[edge_ends] - flat[edge_starts])
+    (p0, p1) = (grid_points(edge_starts), grid_points(edge_ends))
+    points = p0 + t[:, None] * (p1 - p0)
+    # orient in index space: the mapping to Cartesian preserves orientation
+    normals = np.cross(points[triangles[:, 1]] - points[triangles[:, 0]], points[triangles[:, 2]] - points[triangles[:, 0]])
+    flip = (normals * directions).sum(axis=1) < 0
+    triangles[flip] = triangles[flip][:, [0, 2, 1]]
+    r = np.interp(points[:, 0], np.arange(len(rs)), rs)
+    theta = np.interp(points[:, 1], np.arange(len(thetas)), thetas)
+    phi = np.interp(points[:, 2], np.arange(len(phis)), phis)
+    return (spherical_to_cartesian(r, theta, phi), triangles)
+
+def merge_meshes(meshes):
+    "Concatenate (vertices, triangles) meshes, offsetting the vertex indices."
+    (all_vertices, all_triangles) = ([], [])
+    offset = 0
+    for (vertices, triangles) in meshes:
+        all_vertices.append(vertices)
+        all_triangles.append(triangles + offset)
+        offset += len(vertices)
+    if not all_vertices:
+        return (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+    return (np.concatenate(all_vertices), np.concatenate(all_triangles))
+
+def range_isosurfaces(values, rs, thetas, phis, levels, block_range):
+    "Mesh of each level for the blocks in block_range."
+    (start, end) = block_range
+    return [merge_meshes([block_isosurface(values[b], rs[b], thetas[b], phis[b], level) for b in range(start, end)])
+        for level in levels]
+
+# per process state for isosurfaces workers
+worker_state = {}
+
+def iso_worker_init(specs, levels):
+    handles = []
+    arrays = []
+    for spec in specs:
+        if spec[0] == "memmap":
+            (kind, filename, offset, shape, dtype) = spec
+            arrays.append(np.memmap(filename, dtype=np.dtype(dtype), mode="r", offset=offset, shape=shape))
+        else:
+            (shm, array) = expand_blocks.attach_array(spec)
+            handles.append(shm)
+            arrays.append(array)
+    worker_state["handles"] = handles
+    worker_state["arrays"] = arrays
+    worker_state["levels"] = levels
+
+def iso_worker(block_range):
+    (values, rs, thetas, phis) = worker_state["arrays"]
+    return (block_range, range_isosurfaces(values, rs, thetas, phis, worker_state["levels"], block_range))
+
+def isosurfaces(blocks, levels, workers=1, verbose=False):
+    "Mesh (vertices, triangles) of each level for all of the (expanded) BlockDescriptions blocks."
+    arrays = (blocks.values, blocks.rs, blocks.thetas, blocks.phis)
+    nblocks = blocks.values.shape[0]
+    if workers <= 1:
+        return range_isosurfaces(*arrays, levels, (0, nblocks))
+    # several ranges per worker to balance the load
+    nranges = min(nblocks, workers * 4)
+    bounds = np.linspace(0, nblocks, nranges + 1).astype(int)
+    ranges = [(int(bounds[i]), int(bounds[i + 1])) for i in range(nranges)]
+    handles = []
+    try:
+        specs = []
+        for array in arrays:
+            if isinstance(array, np.memmap) and array.filename and os.path.exists(array.filename):
+                # workers map the file themselves (unless it was renamed, like a staged binary)
+                specs.append(expand_blocks.memmap_spec(array))
+                continue
+            (shm, shared, spec) = expand_blocks.share_array(np.ascontiguousarray(array))
+            handles.append(shm)
+            specs.append(spec)
+        results = {}
+        with Pool(workers, iso_worker_init, (specs, list(levels))) as pool:
+            for (block_range, meshes) in pool.imap_unordered(iso_worker, ranges):
+                if verbose:
+                    print("    triangulated blocks", block_range, [len(t) for (v, t) in meshes], "triangles")
+                results[block_range] = meshes
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+    # block order, as in the serial result
+    return [merge_meshes([results[block_range][index] for block_range in ranges]) for index in range(len(levels))]
+
+def quantize_positions(vertices):
+    "(uint16 positions, minimum, scale) with vertices ~ minimum + positions * scale for each axis."
+    if len(vertices) == 0:
+        return (np.zeros((0, 3), dtype=np.uint16), [0.0, 0.0, 0.0], [1.0, 1.0, 1.0])
+    low = vertices.min(axis=0)
+    extent = vertices.max(axis=0) - low
+    scale = np.where(extent > 0, extent / POSITION_LEVELS, 1.0)
+    positions = np.rint((vertices - low) / scale).astype(np.uint16)
+    return (positions, low.tolist(), scale.tolist())
+
+def padding(nbytes):
+    "Bytes to the next multiple of 4 so every section can be viewed as a typed array."
+    return (-nbytes) % 4
+
+def write_meshes(blocks, to_dir, prefix, levels, workers=1, metadata=None, verbose=True):
+    "Write the isosurfaces of blocks at levels to <prefix>.mesh and its JSON index.  Returns (json_fn, bin_fn)."
+    levels = [float(level) for level in levels]
+    meshes = isosurfaces(blocks, levels, workers, verbose)
+    (json_fn, bin_fn) = (prefix + MESH_SUFFIX + ".json", prefix + MESH_SUFFIX)
+    index = []
+    offset = 0
+    with open(os.path.join(to_dir, bin_fn), "wb") as f:
+        for (level, (vertices, triangles)) in zip(levels, meshes):
+            (positions, low, scale) = quantize_positions(vertices)
+            index_type = "uint16" if len(vertices) <= 65536 else "uint32"
+            entry = {
+                "level": level,
+                "vertices": len(vertices),
+                "triangles": len(triangles),
+                "position_min": low,
+                "position_scale": scale,
+                "max_position_error": 0.5 * max(scale) if len(vertices) else 0.0,
+                "index_type": index_type,
+            }
+            for (name, data) in (("positions", positions), ("indices", triangles.astype(index_type))):
+                data = data.tobytes()
+                entry[name + "_offset"] = offset
+                entry[name + "_bytes"] = len(data)
+                f.write(data + b"\0" * padding(len(data)))
+                offset += len(data) + padding(len(data))
+            index.append(entry)
+            if verbose:
+                print("    level %g: %s vertices, %s triangles" % (level, len(vertices), len(triangles)))
+    json_value = {
+        "binary_file": bin_fn,
+        "num_blocks": blocks.values.shape[0],
+        "r_max": float(np.asarray(blocks.rs).max()),
+        "position_encoding": "uint16",
+        "bytes": offset,
+        "levels": index,
+    }
+    json_value.update(metadata or {})
+    with open(os.path.join(to_dir, json_fn), "w") as f:
+        json.dump(json_value, f, indent=1)
+    if verbose:
+        print("    wrote", len(levels), "isosurface levels to", repr(os.path.join(to_dir, bin_fn)))
+    return (json_fn, bin_fn)
+
+def load_meshes(json_path):
+    "Read the meshes written by write_meshes: a list of (level, vertices, triangles)."
+    with open(json_path) as f:
+        json_value = json.load(f)
+    with open(os.path.join(os.path.dirname(json_path), json_value["binary_file"]), "rb") as f:
+        data = f.read()
+    result = []
+    for entry in json_value["levels"]:
+        positions = np.frombuffer(data, dtype=np.uint16, count=3 * entry["vertices"], offset=entry["positions_offset"])
+        vertices = np.array(entry["position_min"]) + positions.reshape((-1, 3)) * np.array(entry["position_scale"])
+        triangles = np.frombuffer(data, dtype=entry["index_type"], count=3 * entry["triangles"], offset=entry["indices_offset"])
+        result.append((entry["level"], vertices, triangles.reshape((-1, 3)).astype(np.int64)))
+    return result
+
+def even_levels(blocks, count):
+    "count levels evenly spaced strictly inside the value range of blocks."
+    (m, M) = (float(blocks.values.min()), float(blocks.values.max()))
+    return [m + (M - m) * (i + 1) / (count + 1) for i in range(count)]
+
+def test_sphere(n=12, level=1.5):
+    "The isosurface of the radius over a spherical shell is a closed sphere of that radius."
+    rs = np.linspace(1.0, 2.0, n + 1)
+    thetas = np.linspace(0.0, np.pi, n + 1)
+    phis = np.linspace(0.0, 2 * np.pi, 2 * n + 1)
+    values = np.broadcast_to(rs[:, None, None], (n + 1, n + 1, 2 * n + 1))
+    (vertices, triangles) = block_isosurface(values, rs, thetas, phis, level)
+    radii = np.sqrt((vertices ** 2).sum(axis=1))
+    assert np.allclose(radii, level), "vertices off the sphere"
+    # outward normals: the radius increases outwards
+    (p0, p1, p2) = [vertices[triangles[:, i]] for i in range(3)]
+    normals = np.cross(p1 - p0, p2 - p0)
+    areas = np.sqrt((normals ** 2).sum(axis=1))
+    outward = (normals * (p0 + p1 + p2)).sum(axis=1)
+    assert (outward[areas > 1e-12] > 0).all(), "inward facing triangles"
+    area = 0.5 * areas.sum()
+    print("sphere", len(vertices), "vertices", len(triangles), "triangles, area", area, "expected about", 4 * np.pi * level ** 2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    a = parser.add_argument
+    a("json_path", help="JSON file of an (expanded) output written by prepare_viz_data.")
+    a("--levels", help="Comma separated iso-levels.", default="")
+    a("--num_levels", help="Number of levels evenly spaced in the value range if --levels is not given (default 1).", type=int, default=1)
+    a("--workers", help="Number of processes triangulating blocks (default 1).", type=int, default=1)
+    a("--quiet", help="Don't print helpful output.", action="store_true")
+    args = parser.parse_args()
+    blocks = dump_json_and_binary.load_files(args.json_path)
+    levels = [float(x) for x in args.levels.split(",") if x.strip()] or even_levels(blocks, args.num_levels)
+    (to_dir, json_fn) = os.path.split(os.path.abspath(args.json_path))
+    write_meshes(blocks, to_dir, json_fn[:-len(".json")], levels, args.workers,
+        metadata={"source_json": json_fn}, verbose=not args.quiet)
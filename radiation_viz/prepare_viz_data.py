@@ -11,15 +11,20 @@ import numpy as np
 import shutil
 import json
 from . import dump_json_and_binary
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from . import build_manifest
+from . import viz_server
+from . import viz_config
+from . import profiling
+from . import isosurface
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import webbrowser
 
 SOURCE_SUFFIX = '.athdf'
 DEFAULT_DIR = "./radiation_viz"
 DATA_SUBDIRECTORY = "processed_data"
-CONFIG_FILENAME = "config.json"
+CONFIG_FILENAME = viz_config.CONFIG_FILENAME
 
 MY_DIR = os.path.dirname(__file__)
 
@@ -37,13 +42,30 @@ class Runner:
         a("--var_substring", help="Exclude variables with names that do not match this substring (default '').", default='')
         a("--truncated", help="Don't generate full resolution.", action="store_true")
         a("--skip", help="Skip stride for truncated views (0 for none).", type=int, default=4)
+        a("--pyramid", help="Comma separated r and phi reduction factors to write from one read, e.g. 1,2,4,8 (replaces --skip and --truncated).", default="")
+        a("--pool", help="How reduced views combine cells: mean (width weighted), max or stride (default stride, or mean with --pyramid).",
+            choices=dump_json_and_binary.POOL_MODES, default=None)
+        a("--workers", help="Number of processes for expanding blocks (default 1).", type=int, default=1)
+        a("--memory_budget", help="Megabytes of variable data to hold at once per file (default 2048).", type=int, default=2048)
+        a("--encoding", help="Encoding of the binary values (default float32, uint8/uint16 quantize each block).",
+            choices=dump_json_and_binary.ENCODINGS, default="float32")
+        a("--gzip", help="Write byte shuffled, gzip compressed .bin.gz binaries.", action="store_true")
+        a("--iso_levels", help="Comma separated values of isosurface meshes to precompute for each output (see isosurface.py).", default="")
+        a("--num_iso_levels", help="Number of isosurface meshes evenly spaced in the value range of each output (if no --iso_levels).", type=int, default=0)
+        a("--jobs", help="Number of source files to process at once in worker processes (default 1).", type=int, default=1)
+        a("--jobs_memory", help="Megabytes of estimated memory for all files in process with --jobs (default jobs * memory_budget).", type=int, default=0)
         a("--quiet", help="Don't print helpful output.", action="store_true")
+        a("--profile", help="Print a JSON line of stage times, memory and counters for each file (see build_plan --summary).", action="store_true")
         a("--force", help="Don't prompt for verification and overwrite existing files.", action="store_true")
+        a("--rebuild_stale", "--rebuild-stale", help="Report outputs which are out of date with the build manifest and rebuild only those.", action="store_true")
+        a("--hash_sources", help="Also compare source file content hashes in the build manifest.", action="store_true")
         a("--clean", help="Delete existing visualization folder if it exists.", action="store_true")
         a("--dry_run", help="List intended actions but don't make permanent changes.", action="store_true")
         a("--launch", help="Start server and attempt to open the visualization in a browser.", action="store_true")
-        a("--no_config", help="Do not write the config.json file after run.", action="store_true")
-        a("--config_only", help="Write the config.json file based on extant files and do nothing else.", action="store_true")
+        a("--no_config", help="Do not add the outputs to the config.json file as they are written.", action="store_true")
+        a("--config_only", help="Rebuild the config.json file by scanning the extant files and do nothing else.", action="store_true")
+        a("--config_page_size", help="Number of outputs listed per config page (default %s)." % viz_config.DEFAULT_PAGE_SIZE,
+            type=int, default=viz_config.DEFAULT_PAGE_SIZE)
         a("--view_only", help="Only start server and attempt to open the visualization in a browser.", action="store_true")
         args = self.args = parser.parse_args()
         self.verbose = (not args.quiet) or args.dry_run
@@ -59,6 +81,7 @@ class Runner:
             if (not args.config_only):
                 self.load_file_data()
                 self.check_directory()
+                self.load_manifest()
                 self.check_output_files()
                 if self.verbose:
                     print()
@@ -72,12 +95,13 @@ class Runner:
                         return
                 self.copy_directory_if_needed()
                 self.write_output_files()
-            if (not args.no_config):
+            elif (not args.no_config):
+                # outputs written by a run are added to the config as each file finishes
                 self.set_up_configuration()
         if self.args.launch or self.args.view_only:
             self.launch_server_and_open()
 
-    def launch_server_and_open(self, server_name="0.0.0.0", port=9999, server_class=HTTPServer, handler_class=SimpleHTTPRequestHandler):
+    def launch_server_and_open(self, server_name="0.0.0.0", port=9999):
         self.port = port
         if self.verbose:
             print("Attempting to launch web server and redirect system browser.")
@@ -86,11 +110,8 @@ class Runner:
         self.start_delayed_redirect(url)
         # launch browser rooted at directory above to_directory
         #root = self.to_directory
-        os.chdir(root)
-        server_address = (server_name, port)
-        httpd = server_class(server_address, handler_class)
-        print("Starting simple web server.  Use CONTROL-C to terminate:", url)
-        httpd.serve_forever()
+        print("Starting web server.  Use CONTROL-C to terminate:", url)
+        viz_server.serve(root, server_name, port, self.verbose)
 
     def start_delayed_redirect(self, url):
         thread = BrowserRedirect(url)
@@ -107,10 +128,18 @@ class Runner:
             print("Loading data from file(s).")
         self.file_readers = {}
         force_files = args.force or args.clean
-        for filename in self.files:
+        def load(filename):
             if self.verbose:
                 print("   loading metadata for", repr(filename))
-            self.file_readers[filename] = FileReader(filename, args.truncated, args.skip, force_files, self.args, self.verbose)
+            return FileReader(filename, args.truncated, args.skip, force_files, self.args, self.verbose)
+        if args.jobs > 1:
+            # overlap the metadata reads for many files
+            with ThreadPoolExecutor(args.jobs) as executor:
+                readers = list(executor.map(load, self.files))
+        else:
+            readers = [load(filename) for filename in self.files]
+        for (filename, reader) in zip(self.files, readers):
+            self.file_readers[filename] = reader
 
     def check_directory(self):
         "Determine whether the output directory needs to be created and initialized."
@@ -144,7 +173,7 @@ class Runner:
         if not self.make_folder:
             if self.verbose:
                 print("Assuming existing directory infrastructure is okay. " + repr(folder))
-                return
+            return
         if os.path.exists(folder):
             if self.verbose:
                 print("deleting existing folder " + repr(folder))
@@ -153,68 +182,135 @@ class Runner:
             print("Setting up directory " + repr(folder))
         shutil.copytree(self.template_folder, folder)
 
+    def load_manifest(self):
+        "Read the build manifest of the data directory, which is empty if the directory will be created."
+        self.manifest = build_manifest.BuildManifest(self.data_directory, self.verbose, load=not self.make_folder)
+
     def check_output_files(self):
         "Check whether any output files are overwrites."
         #self.data_directory = os.path.join(self.to_directory, DATA_SUBDIRECTORY)
         if self.verbose:
             print("Checking whether output data files exist.")
         for filename in self.files:
-            self.file_readers[filename].check_output_files(self.data_directory)
+            self.file_readers[filename].check_output_files(self.data_directory, self.manifest)
+        if self.args.rebuild_stale:
+            self.report_stale()
+
+    def report_stale(self):
+        "Print the outputs which will be rebuilt because they are out of date with the manifest."
+        (stale, current) = (0, 0)
+        print("Outputs out of date with", repr(self.manifest.path))
+        for filename in self.files:
+            reader = self.file_readers[filename]
+            for (prefix, reason) in sorted(reader.stale_reasons.items()):
+                print("    rebuild", repr(prefix), "--", reason)
+            stale += len(reader.stale_reasons)
+            current += len(reader.current_prefixes)
+        print("%s outputs to rebuild, %s current outputs skipped." % (stale, current))
         if (not self.args.no_config):
             if self.verbose:
-                print(CONFIG_FILENAME, "will be written.")
+                print(CONFIG_FILENAME, "will be updated.")
 
     def write_output_files(self):
         "Create JSON and binary files from inputs files."
         if self.verbose:
             print("Writing output data files.")
+        if self.args.jobs > 1:
+            return self.write_output_files_parallel()
         for filename in self.files:
-            self.file_readers[filename].write_output_files(self.data_directory)
+            reader = self.file_readers[filename]
+            entries = reader.write_output_files(self.data_directory)
+            self.record_entries(entries)
+            self.emit_profile(reader.profile_record)
 
-    def set_up_configuration(self, limit=None):
-        "Create the configuration file for the visualization."
-        datadir = self.data_directory
-        todir = self.to_directory
-        config_path = os.path.join(todir, CONFIG_FILENAME)
-        files = set(os.listdir(datadir))
-        #print("examining", len(files), "files from", datadir)
-        files_info = []
-        count = 0
-        for bin_fn in sorted(files):
-            #print("trying to configure", bin_fn)
-            if bin_fn.endswith(".bin"):
-                prefix = bin_fn[:-4]
-                json_fn = prefix + ".json"
-                if json_fn in files:
-                    files_info.append({"prefix": prefix, "bin": bin_fn, "json": json_fn})
-                    count += 1
-                    if limit and count > limit:
-                        if self.verbose:
-                            print("Limiting files list to", limit, "entries in config file.")
+    def emit_profile(self, record):
+        if record is not None:
+            profiling.emit(record)
+
+    def record_entries(self, entries):
+        "Record finished outputs in the build manifest and the config."
+        if entries:
+            self.manifest.update(entries)
+            self.manifest.save()
+            if not self.args.no_config:
+                config = viz_config.VizConfig(self.to_directory, DATA_SUBDIRECTORY, self.args.config_page_size)
+                pairs = []
+                for entry in entries.values():
+                    # the dump_files pair (an entry may also list other files, like meshes)
+                    [bin_fn] = [fn for fn in entry["outputs"] if dump_json_and_binary.binary_prefix(fn) is not None]
+                    pairs.append((dump_json_and_binary.binary_prefix(bin_fn) + ".json", bin_fn))
+                config.update_outputs(pairs)
+
+    def write_output_files_parallel(self):
+        """
+        Write the outputs for several files at once in a process pool.  A file is only started
+        when its estimated peak memory fits in the jobs memory budget with the files in process
+        (one file is always allowed to run).
+        """
+        args = self.args
+        budget = (args.jobs_memory or args.jobs * args.memory_budget) * 2 ** 20
+        pending = list(self.files)
+        running = {}
+        (finished, total) = (0, len(pending))
+        with ProcessPoolExecutor(args.jobs) as executor:
+            while pending or running:
+                while pending and len(running) < args.jobs:
+                    reader = self.file_readers[pending[0]]
+                    estimate = reader.estimated_peak_bytes()
+                    in_use = sum(r[1] for r in running.values())
+                    if running and in_use + estimate > budget:
                         break
-                else:
-                    #print("no json")
-                    pass
-            else:
-                #print("not a bin")
-                pass
-        config_value = {
-            "files": files_info,
-        }
-        with open(config_path, "w") as out:
-            json.dump(config_value, out, indent=4)
+                    filename = pending.pop(0)
+                    future = executor.submit(write_file_outputs, reader, self.data_directory)
+                    running[future] = (filename, estimate, time.time())
+                    if self.verbose:
+                        print("    started %s (estimated %.1f MB, %.1f MB in process)" % (
+                            repr(filename), estimate / 2.0 ** 20, (in_use + estimate) / 2.0 ** 20))
+                (done, not_done) = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    (filename, estimate, start) = running.pop(future)
+                    (entries, profile_record) = future.result()
+                    self.record_entries(entries)
+                    self.emit_profile(profile_record)
+                    finished += 1
+                    if self.verbose:
+                        print("    [%s/%s] wrote %s outputs for %s in %.1f seconds" % (
+                            finished, total, len(entries), repr(filename), time.time() - start))
+
+    def set_up_configuration(self, limit=None):
+        "Rebuild the configuration files for the visualization from the extant data files."
+        config = viz_config.VizConfig(self.to_directory, DATA_SUBDIRECTORY, self.args.config_page_size, self.verbose)
+        entries = config.rebuild(limit)
         if self.verbose:
-            print("Configured %s files in %s." % (len(files_info), config_path))
+            print("Configured %s files in %s." % (len(entries), config.path))
 
 class FileReader:
 
     def __init__(self, filename, truncated, skip, force, args, verbose):
         (self.filename, self.truncated, self.skip, self.force, self.verbose) = (filename, truncated, skip, force, verbose)
         self.var_substring = args.var_substring
+        self.rebuild_stale = args.rebuild_stale
+        self.hash_sources = args.hash_sources
+        self.encoding = args.encoding
+        self.gzip = args.gzip
+        self.pyramid = [int(factor) for factor in args.pyramid.split(",") if factor.strip()]
+        assert all(factor > 0 for factor in self.pyramid), "pyramid factors must be positive " + repr(args.pyramid)
+        self.pool = args.pool or ("mean" if self.pyramid else "stride")
+        self.workers = args.workers
+        self.iso_levels = [float(level) for level in args.iso_levels.split(",") if level.strip()]
+        self.num_iso_levels = args.num_iso_levels
+        self.profile = args.profile
+        self.profile_record = None
+        self.memory_budget = args.memory_budget * 2 ** 20
         assert filename.endswith(SOURCE_SUFFIX), "Filename has incorrect extension: " + repr((filename, SOURCE_SUFFIX))
-        assert (not truncated) or skip, "truncated file must have a non-zero skip value " + repr(filename)
+        assert (not truncated) or skip or self.pyramid, "truncated file must have a non-zero skip value " + repr(filename)
         # extract the metadata for quantity locations
-        f = h5py.File(filename, 'r')
+        with h5py.File(filename, 'r') as f:
+            self.read_metadata(f)
+
+    def read_metadata(self, f):
+        "Map variable names to datasets and record the dataset shapes."
+        filename = self.filename
         def to_str(b_array):
             return [b.decode("utf8") for b in b_array]
         variable_names = to_str(f.attrs["VariableNames"])
@@ -230,26 +326,52 @@ class FileReader:
                 count += 1
         assert count == len(variable_names), "variable names don't match datasets: " + repr((filename, variable_names, count))
         self.name_to_dataset_and_index = name_to_dataset_and_index
+        # simulation time of the snapshot, for ordering the config
+        self.time = float(f.attrs["Time"]) if "Time" in f.attrs else None
+        # (shape, itemsize) of each dataset for memory estimates
+        self.dataset_shapes = dict((ds, (tuple(f[ds].shape), f[ds].dtype.itemsize)) for ds in dataset_names)
         if self.verbose:
             for (name, dsi) in sorted(name_to_dataset_and_index.items()):
                 print ("    Found", repr(name), "at", dsi, "in", filename)
 
-    def check_output_files(self, to_directory):
+    def check_output_files(self, to_directory, manifest=None):
         self.to_directory = to_directory
+        self.identity = build_manifest.source_identity(self.filename)
         [self.source_dir, self.file_tail] = os.path.split(self.filename)
         self.file_prefix = self.file_tail[:-len(SOURCE_SUFFIX)]
         self.out_prefix = self.file_prefix.replace(".", "_")
         self.variable_and_skip_to_file_prefix = {}
+        # factor --> prefix of every pyramid level for each variable
+        self.pyramid_prefixes = {}
         for vr in sorted(self.name_to_dataset_and_index):
             # ignore variables which don't match substring
             if self.var_substring in vr:
+                if self.pyramid:
+                    for factor in self.pyramid:
+                        skip = 0 if factor == 1 else factor
+                        prefix = self.skip_prefix(vr, skip)
+                        self.variable_and_skip_to_file_prefix[(vr, skip)] = prefix
+                        self.pyramid_prefixes.setdefault(vr, {})[factor] = prefix
+                    continue
                 if not self.truncated:
-                    self.variable_and_skip_to_file_prefix[(vr, 0)] = "%s_%s_full"  % (self.file_prefix, vr)
+                    self.variable_and_skip_to_file_prefix[(vr, 0)] = self.skip_prefix(vr, 0)
                 if self.skip:
-                    self.variable_and_skip_to_file_prefix[(vr, self.skip)] = "%s_%s_skip_%s"  % (self.file_prefix, vr, self.skip)
+                    self.variable_and_skip_to_file_prefix[(vr, self.skip)] = self.skip_prefix(vr, self.skip)
+        # with rebuild_stale only keep the outputs which the manifest does not show as current
+        self.stale_reasons = {}
+        self.current_prefixes = []
+        if self.rebuild_stale and manifest is not None:
+            for ((vr, skip), prefix) in sorted(self.variable_and_skip_to_file_prefix.items()):
+                reason = manifest.stale_reason(
+                    prefix, self.filename, self.identity, vr, skip, self.output_options(), self.hash_sources)
+                if reason is None:
+                    self.current_prefixes.append(prefix)
+                    del self.variable_and_skip_to_file_prefix[(vr, skip)]
+                else:
+                    self.stale_reasons[prefix] = reason
         existing_files = 0
         for prefix in sorted(self.variable_and_skip_to_file_prefix.values()):
-            for ext in (".json", ".bin"):
+            for ext in (".json", ".bin.gz" if self.gzip else ".bin"):
                 path = os.path.join(self.to_directory, prefix + ext)
                 if os.path.exists(path):
                     existing_files += 1
@@ -258,25 +380,156 @@ class FileReader:
                         print("    Existing file to overwrite " + repr(path))
                 elif self.verbose:
                     print("    File will be created " + repr(path))
-        if existing_files > 0 and not self.force:
+        # stale outputs recorded in the manifest may be replaced
+        if existing_files > 0 and not (self.force or self.rebuild_stale):
             assert self.force, "Cannot overwrite existing %s files without --force flag." % existing_files
 
+    def skip_prefix(self, vr, skip):
+        "Output prefix for a variable at full resolution (skip 0) or reduced by skip."
+        if not skip:
+            return "%s_%s_full"  % (self.file_prefix, vr)
+        return "%s_%s_skip_%s"  % (self.file_prefix, vr, skip)
+
     def write_output_files(self, to_directory):
+        """
+        Write all outputs, reading the geometry once and each variable once for all its resolutions.
+        Returns the build manifest entries for the outputs written.  With --profile the stage
+        times, memory and counters are kept in profile_record.
+        """
+        if not self.profile:
+            return self.write_outputs(to_directory)
+        profile = profiling.Profile(self.filename)
+        with profiling.activated(profile):
+            entries = self.write_outputs(to_directory)
+        self.profile_record = profile.record(outputs=len(entries), workers=self.workers, encoding=self.encoding)
+        return entries
+
+    def write_outputs(self, to_directory):
         assert to_directory == self.to_directory
         source_filename = self.filename
-        for vr_skip in sorted(self.variable_and_skip_to_file_prefix):
-            (vr, skip) = vr_skip
-            to_prefix = self.variable_and_skip_to_file_prefix[vr_skip]
-            if self.verbose:
-                print("    writing expanded data", vr_skip, to_prefix)
+        entries = {}
+        if not self.variable_and_skip_to_file_prefix:
+            return entries
+        identity = self.identity
+        if self.hash_sources and "sha1" not in identity:
+            identity["sha1"] = build_manifest.file_hash(source_filename)
+        skips_by_variable = {}
+        for (vr, skip) in sorted(self.variable_and_skip_to_file_prefix):
+            skips_by_variable.setdefault(vr, []).append(skip)
+        with h5py.File(source_filename, 'r') as f:
+            geometry = dump_json_and_binary.read_geometry(f)
+            for batch in self.variable_batches(sorted(skips_by_variable)):
+                loaded = self.load_variables(f, geometry, batch)
+                for vr in batch:
+                    variable_blocks = loaded.pop(vr)
+                    # all the reduced views of the variable from the one read
+                    reduced = variable_blocks.reduce_r_phi(
+                        [skip or 1 for skip in skips_by_variable[vr]], self.pool, self.verbose)
+                    del variable_blocks
+                    for skip in skips_by_variable[vr]:
+                        vr_skip = (vr, skip)
+                        to_prefix = self.variable_and_skip_to_file_prefix[vr_skip]
+                        if self.verbose:
+                            print("    writing expanded data", vr_skip, to_prefix)
+                        blocks = reduced.pop(skip or 1)
+                        # xxxx always expand?  no verbose option
+                        # expand straight into a staged float32 binary which dump_files renames into place
+                        staged_path = None
+                        if self.encoding == "float32" and not self.gzip:
+                            staged_path = os.path.join(to_directory, to_prefix + ".bin.partial")
+                        expanded = blocks.expand(verbose=False, workers=self.workers, out_path=staged_path)
+                        metadata = {"variable": vr, "skip": skip, "source": self.file_tail, "time": self.time}
+                        filenames = expanded.dump_files(to_directory, to_prefix, verbose=self.verbose,
+                            encoding=self.encoding, compress=self.gzip, metadata=metadata)
+                        if self.iso_levels or self.num_iso_levels:
+                            with profiling.stage("isosurface"):
+                                levels = self.iso_levels or isosurface.even_levels(expanded, self.num_iso_levels)
+                                # the meshes belong to the output so missing meshes make it stale
+                                filenames = list(filenames) + list(isosurface.write_meshes(
+                                    expanded, to_directory, to_prefix, levels, self.workers,
+                                    metadata=metadata, verbose=self.verbose))
+                        entries[to_prefix] = build_manifest.make_entry(
+                            to_directory, filenames, source_filename, identity, vr, skip, self.output_options())
+                    if self.pyramid:
+                        pyramid_fn = dump_json_and_binary.dump_pyramid(to_directory, "%s_%s_pyramid" % (self.file_prefix, vr),
+                            self.pyramid_prefixes[vr], self.pool, self.verbose)
+                        # the levels own the pyramid manifest so a missing manifest makes them stale
+                        for prefix in self.pyramid_prefixes[vr].values():
+                            if prefix in entries:
+                                entries[prefix]["outputs"].update(build_manifest.output_sizes(to_directory, [pyramid_fn]))
+        return entries
+
+    def output_options(self):
+        "Options which change the output files, recorded in the build manifest."
+        options = {"encoding": self.encoding, "gzip": self.gzip, "pool": self.pool}
+        if self.iso_levels or self.num_iso_levels:
+            options["isosurfaces"] = self.iso_levels or self.num_iso_levels
+        return options
+
+    def variable_size(self, vr):
+        "Number of values of one variable."
+        (ds, index) = self.name_to_dataset_and_index[vr]
+        (shape, itemsize) = self.dataset_shapes[ds]
+        return int(np.prod(shape[1:]))
+
+    def variable_bytes(self, vr):
+        "Estimated memory for holding one variable: the raw slab plus the transposed copy."
+        (ds, index) = self.name_to_dataset_and_index[vr]
+        (shape, itemsize) = self.dataset_shapes[ds]
+        return self.variable_size(vr) * (itemsize + np.dtype(np.float32).itemsize)
+
+    def estimated_peak_bytes(self):
+        """
+        Estimated peak memory of write_output_files: the largest variable batch plus expanding one
+        variable (the float32 output, and shared memory copies of the source and output with workers).
+        """
+        variables = sorted(set(vr for (vr, skip) in self.variable_and_skip_to_file_prefix))
+        if not variables:
+            return 0
+        batch_bytes = max(sum(self.variable_bytes(vr) for vr in batch) for batch in self.variable_batches(variables))
+        expand_copies = 2 if self.workers <= 1 else 4
+        expand_bytes = max(self.variable_size(vr) for vr in variables) * np.dtype(np.float32).itemsize * expand_copies
+        return batch_bytes + expand_bytes
+
+    def variable_batches(self, variables):
+        "Group variables into batches which fit in the memory budget (at least one per batch)."
+        batch = []
+        batch_bytes = 0
+        for vr in variables:
+            size = self.variable_bytes(vr)
+            if batch and batch_bytes + size > self.memory_budget:
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(vr)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def load_variables(self, f, geometry, variables):
+        "Read a batch of variables with one hyperslab read per dataset and transpose each once."
+        (rs, thetas, phis) = geometry
+        indices_by_dataset = {}
+        for vr in variables:
             (ds, index) = self.name_to_dataset_and_index[vr]
-            blocks = dump_json_and_binary.get_values_and_geometry(source_filename, ds, index, self.verbose)
-            if skip:
-                blocks = blocks.truncate_r_phi(skip, self.verbose)
-            # xxxx always expand?  no verbose option
-            expanded = blocks.expand(verbose=False)
-            expanded.dump_files(to_directory, to_prefix, verbose=self.verbose)
+            indices_by_dataset.setdefault(ds, {})[index] = vr
+        loaded = {}
+        for (ds, index_to_variable) in sorted(indices_by_dataset.items()):
+            indices = sorted(index_to_variable)
+            slabs = dump_json_and_binary.read_variables(f, ds, indices)
+            if self.verbose:
+                print("    read %s bytes for %s from %s" % (slabs.nbytes, [index_to_variable[i] for i in indices], ds))
+            for (slab, index) in zip(slabs, indices):
+                values = dump_json_and_binary.to_r_theta_phi(slab)
+                loaded[index_to_variable[index]] = dump_json_and_binary.BlockDescriptions(rs, thetas, phis, values)
+            del slabs
+        return loaded
             
+def write_file_outputs(reader, to_directory):
+    "Process pool entry point: write the outputs for one FileReader and return its manifest entries and profile record."
+    entries = reader.write_output_files(to_directory)
+    return (entries, reader.profile_record)
+
 class BrowserRedirect(threading.Thread):
 
     def __init__ (self, url, delay=1.0):
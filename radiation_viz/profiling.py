@@ -0,0 +1,155 @@
+"""
+Lightweight stage timing, memory and counter instrumentation.
+
+A Profile accumulates wall clock and CPU seconds per named stage and numeric counters.
+Code reports to the active profile through the module functions stage, count and
+add_counters, which do nothing when no profile is active, so instrumented code costs
+almost nothing without --profile.
+
+Records are emitted as single JSON lines starting with PROFILE_MARKER so they can be found
+in mixed log output and collected with read_records and summarize.
+"""
+
+import sys
+import json
+import time
+import functools
+import contextlib
+try:
+    import resource
+except ImportError:
+    # no getrusage on this platform
+    resource = None
+
+PROFILE_MARKER = "PROFILE "
+
+def peak_rss_bytes(children=False):
+    "Peak resident set size of this process (or its finished child processes), None if unknown."
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+class Profile:
+
+    def __init__(self, label=None):
+        self.label = label
+        self.stages = {}
+        self.counters = {}
+        self.depths = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        "Time the enclosed code as stage name (nested entries of the same stage are counted once)."
+        depth = self.depths.get(name, 0)
+        self.depths[name] = depth + 1
+        (wall, cpu) = (time.perf_counter(), time.process_time())
+        try:
+            yield
+        finally:
+            self.depths[name] = depth
+            if depth == 0:
+                totals = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                totals["wall"] += time.perf_counter() - wall
+                totals["cpu"] += time.process_time() - cpu
+                totals["calls"] += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_counters(self, counters):
+        for (name, amount) in counters.items():
+            self.count(name, amount)
+
+    def record(self, **items):
+        "JSON serializable summary of the profile so far, with any extra items."
+        result = {
+            "label": self.label,
+            "wall": time.perf_counter() - self.start_wall,
+            "cpu": time.process_time() - self.start_cpu,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "children_peak_rss_bytes": peak_rss_bytes(children=True),
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+        result.update(items)
+        return result
+
+# the profile receiving reports from stage, count and add_counters, if any
+active = None
+
+@contextlib.contextmanager
+def activated(profile):
+    "Make profile (which may be None) the active profile in the enclosed code."
+    global active
+    previous = active
+    active = profile
+    try:
+        yield profile
+    finally:
+        active = previous
+
+def stage(name):
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name)
+
+def staged(name):
+    "Decorator timing every call of a function as stage name."
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+            with active.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, amount=1):
+    if active is not None:
+        active.count(name, amount)
+
+def add_counters(counters):
+    if active is not None:
+        active.add_counters(counters)
+
+def emit(record, file=None):
+    "Print a record as one marked JSON line."
+    print(PROFILE_MARKER + json.dumps(record, sort_keys=True), file=file or sys.stdout, flush=True)
+
+def read_records(paths):
+    "The profile records emitted into the log files at paths."
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(PROFILE_MARKER):
+                    records.append(json.loads(line[len(PROFILE_MARKER):]))
+    return records
+
+def summarize(records, slowest=5):
+    "Run level totals of stage times and counters, the maximum peak RSS and the slowest files."
+    stages = {}
+    counters = {}
+    for record in records:
+        for (name, totals) in record["stages"].items():
+            summary = stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            for key in summary:
+                summary[key] += totals[key]
+        for (name, amount) in record["counters"].items():
+            counters[name] = counters.get(name, 0) + amount
+    peaks = [r["peak_rss_bytes"] for r in records if r.get("peak_rss_bytes") is not None]
+    ordered = sorted(records, key=lambda r: -r["wall"])
+    return {
+        "files": len(records),
+        "wall": sum(r["wall"] for r in records),
+        "cpu": sum(r["cpu"] for r in records),
+        "peak_rss_bytes": max(peaks) if peaks else None,
+        "stages": stages,
+        "counters": counters,
+        "slowest": [{"label": r["label"], "wall": r["wall"]} for r in ordered[:slowest]],
+    }
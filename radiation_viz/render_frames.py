@@ -0,0 +1,416 @@
+"""
+Render an image sequence from the processed data on CPU nodes, without a browser or GPU.
+
+This is a pure numpy alternative to capture_images: frames are read straight from the
+processed_data JSON/bin outputs listed in config.json (in the viewer's "Load next" order)
+and drawn with the camera settings file saved by the viewer.
+
+- isosurface mode (the default) triangulates each frame at the settings threshold with
+  isosurface.py and draws it with a z-buffer rasterizer, colored by view space normals like
+  the viewer's isosurface panel.
+- volume mode ray casts a maximum intensity projection through a Cartesian resampling of
+  the frame (the resample table is cached and reused for frames with the same mesh).
+
+Frames are rendered in parallel worker processes and written as PNG files with Pillow.
+Frames per second are reported as frames finish.
+
+Example:
+
+python -m radiation_viz.render_frames \
+     --to_directory ~/tmp/images \
+     --http_directory ~/tmp/radiation_test \
+     --settings_path ~/repos/radiation_viz/radiation_viz/example_camera_settings.json \
+     --workers 8 --limit 30
+
+Use ffmpeg to combine the rendered images into a video, like this
+
+$ ffmpeg -framerate 10 -i "frame_%05d.png" video.webm
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from PIL import Image
+from . import dump_json_and_binary
+from . import isosurface
+from . import viz_config
+
+MODES = ("isosurface", "volume")
+
+# viewer camera: three.js PerspectiveCamera(45, aspect, 0.1, 10000)
+FIELD_OF_VIEW = 45.0
+NEAR = 0.1
+
+# candidate pixels tested at a time by the rasterizer
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+# value color ramp for volume rendering: (fraction, (red, green, blue))
+HEAT_COLORS = [(0.0, (0, 0, 0)), (0.35, (120, 0, 40)), (0.65, (230, 90, 0)), (0.85, (255, 210, 60)), (1.0, (255, 255, 255))]
+
+def read_camera_settings(path):
+    "The JSON object of a camera settings file saved by the viewer."
+    with open(path, encoding="utf8") as f:
+        text = f.read()
+    # trim leading garbage like utf bom markers, as capture_images does
+    return json.loads(text[text.index("{"):])
+
+def quaternion_matrix(q):
+    "Rotation matrix of a three.js quaternion array [x, y, z, w]."
+    (x, y, z, w) = np.array(q, dtype=np.float64) / np.linalg.norm(q)
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+
+class Camera:
+
+    "Perspective camera looking down its local -z axis with y up, as in three.js."
+
+    def __init__(self, position, rotation, scale, width, height, fov=FIELD_OF_VIEW):
+        self.position = np.array(position, dtype=np.float64)
+        self.rotation = np.array(rotation, dtype=np.float64)
+        self.scale = np.array(scale, dtype=np.float64)
+        (self.width, self.height) = (width, height)
+        self.focal = 1.0 / np.tan(np.radians(fov) / 2)
+        self.aspect = width / float(height)
+
+    @classmethod
+    def from_settings(cls, settings, width, height):
+        return cls(settings["d"], quaternion_matrix(settings["q"]), settings.get("s", [1, 1, 1]), width, height)
+
+    @classmethod
+    def looking_at(cls, center, radius, width, height):
+        "Camera on the +z side of center looking at a sphere of radius (like the viewer's initial camera)."
+        return cls(np.array(center) + [0, 0, 2.5 * radius], np.eye(3), [1, 1, 1], width, height)
+
+    def to_view(self, points):
+        "View space coordinates of (n, 3) world points."
+        return ((points - self.position) @ self.rotation) / self.scale
+
+    def project(self, view):
+        "(n, 2) pixel coordinates (x right, y down) and (n,) depths of view space points."
+        depth = -view[:, 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = self.focal / self.aspect * view[:, 0] / depth
+            y = self.focal * view[:, 1] / depth
+        pixels = np.stack([(x + 1) * 0.5 * self.width, (1 - y) * 0.5 * self.height], axis=1)
+        return (pixels, depth)
+
+    def rays(self):
+        "World space unit ray directions (height, width, 3) through the pixel centers."
+        x = ((np.arange(self.width) + 0.5) / self.width * 2 - 1) * self.aspect / self.focal
+        y = (1 - (np.arange(self.height) + 0.5) / self.height * 2) / self.focal
+        view = np.stack(np.broadcast_arrays(x[None, :], y[:, None], -1.0), axis=-1) * self.scale
+        directions = view @ self.rotation.T
+        return directions / np.sqrt((directions ** 2).sum(axis=-1))[..., None]
+
+def nearest_fragments(pixel, depth, *attributes):
+    "Keep the nearest of the fragments falling on each pixel."
+    order = np.lexsort((depth, pixel))
+    pixel = pixel[order]
+    first = np.ones(len(pixel), dtype=bool)
+    first[1:] = pixel[1:] != pixel[:-1]
+    keep = order[first]
+    return (pixel[first], depth[keep]) + tuple(a[keep] for a in attributes)
+
+def rasterize(pixels, depths, triangles, width, height, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Z-buffer rasterization of triangles whose vertices have (n, 2) pixel coordinates and (n,) depths.
+    Returns the triangle drawn at each pixel (height, width) (-1 for none) and the perspective
+    correct barycentric weights of its vertices there (height, width, 3).
+    Triangles are processed in batches of similar size so every batch is one numpy computation.
+    """
+    P = pixels[triangles]
+    Z = depths[triangles]
+    # drop triangles crossing the near plane
+    (visible,) = np.nonzero((Z > NEAR).all(axis=1) & np.isfinite(P).all(axis=(1, 2)))
+    lows = np.ceil(P[visible].min(axis=1) - 0.5).astype(np.int64)
+    highs = np.floor(P[visible].max(axis=1) - 0.5).astype(np.int64)
+    lows = np.maximum(lows, 0)
+    highs = np.minimum(highs, [width - 1, height - 1])
+    sizes = (highs - lows + 1).max(axis=1)
+    fragments = []
+    bins = np.ceil(np.log2(np.maximum(sizes, 1))).astype(int)
+    for b in np.unique(bins[(highs >= lows).all(axis=1)]):
+        side = 2 ** b
+        (offset_y, offset_x) = [a.reshape(-1) for a in np.mgrid[0:side, 0:side]]
+        (members,) = np.nonzero((bins == b) & (highs >= lows).all(axis=1))
+        step = max(1, chunk_size // (side * side))
+        for start in range(0, len(members), step):
+            chosen = members[start:start + step]
+            tris = visible[chosen]
+            x = lows[chosen, 0][:, None] + offset_x[None, :]
+            y = lows[chosen, 1][:, None] + offset_y[None, :]
+            inside = (x <= highs[chosen, 0][:, None]) & (y <= highs[chosen, 1][:, None])
+            ((x0, y0), (x1, y1), (x2, y2)) = [(P[tris, i, 0][:, None], P[tris, i, 1][:, None]) for i in range(3)]
+            area = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+            (cx, cy) = (x + 0.5, y + 0.5)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                w0 = ((x1 - cx) * (y2 - cy) - (x2 - cx) * (y1 - cy)) / area
+                w1 = ((x2 - cx) * (y0 - cy) - (x0 - cx) * (y2 - cy)) / area
+            w2 = 1 - w0 - w1
+            inside &= (w0 >= 0) & (w1 >= 0) & (w2 >= 0) & (area != 0)
+            (rows, columns) = np.nonzero(inside)
+            weights = np.stack([w0[rows, columns], w1[rows, columns], w2[rows, columns]], axis=1)
+            # interpolate 1/depth linearly in screen space for perspective correct values
+            inverse = weights / Z[tris[rows]]
+            total = inverse.sum(axis=1)
+            fragments.append(nearest_fragments(y[rows, columns] * width + x[rows, columns], 1 / total,
+                tris[rows], inverse / total[:, None]))
+    drawn = np.full((height * width,), -1, dtype=np.int64)
+    weights = np.zeros((height * width, 3))
+    if fragments:
+        (pixel, depth, tris, bary) = nearest_fragments(*[np.concatenate(f) for f in zip(*fragments)])
+        drawn[pixel] = tris
+        weights[pixel] = bary
+    return (drawn.reshape((height, width)), weights.reshape((height, width, 3)))
+
+def vertex_normals(vertices, triangles):
+    "Area weighted unit vertex normals (as computeVertexNormals in three.js)."
+    face = np.cross(vertices[triangles[:, 1]] - vertices[triangles[:, 0]], vertices[triangles[:, 2]] - vertices[triangles[:, 0]])
+    normals = np.zeros_like(vertices)
+    for i in range(3):
+        np.add.at(normals, triangles[:, i], face)
+    length = np.sqrt((normals ** 2).sum(axis=1))
+    return normals / np.where(length > 0, length, 1)[:, None]
+
+def render_mesh(vertices, triangles, camera, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    (height, width, 3) uint8 image of a mesh colored by its view space normals on black, like a
+    double sided three.js MeshNormalMaterial.
+    """
+    image = np.zeros((camera.height, camera.width, 3), dtype=np.uint8)
+    if len(triangles) == 0:
+        return image
+    view = camera.to_view(vertices)
+    (pixels, depths) = camera.project(view)
+    (drawn, weights) = rasterize(pixels, depths, triangles, camera.width, camera.height, chunk_size)
+    mask = drawn >= 0
+    tris = triangles[drawn[mask]]
+    normals = vertex_normals(vertices, triangles) @ camera.rotation
+    normal = (normals[tris] * weights[mask][:, :, None]).sum(axis=1)
+    # back faces show their reversed normal (counter clockwise is front facing with y up)
+    p = pixels[tris]
+    winding = (p[:, 1, 0] - p[:, 0, 0]) * (p[:, 2, 1] - p[:, 0, 1]) - (p[:, 2, 0] - p[:, 0, 0]) * (p[:, 1, 1] - p[:, 0, 1])
+    normal[winding > 0] *= -1
+    normal /= np.maximum(np.sqrt((normal ** 2).sum(axis=1)), 1e-12)[:, None]
+    image[mask] = np.clip(np.rint((normal * 0.5 + 0.5) * 255), 0, 255).astype(np.uint8)
+    return image
+
+def color_ramp(fractions, colors=HEAT_COLORS):
+    "(n, 3) uint8 colors of fractions in [0, 1]."
+    stops = [stop for (stop, color) in colors]
+    channels = [np.interp(fractions, stops, [color[c] for (stop, color) in colors]) for c in range(3)]
+    return np.rint(np.stack(channels, axis=-1)).astype(np.uint8)
+
+def render_volume(cube, r_max, camera, value_range, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    (height, width, 3) uint8 maximum intensity projection of a Cartesian resampled cube covering
+    [-r_max, r_max]^3 (nan outside the data), colored over value_range.
+    """
+    side = cube.shape[0]
+    step = 2.0 * r_max / side
+    directions = camera.rays().reshape((-1, 3))
+    origin = camera.position
+    # ray segments inside the cube
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t0 = (-r_max - origin) / directions
+        t1 = (r_max - origin) / directions
+    entry = np.nanmax(np.minimum(t0, t1), axis=1).clip(0)
+    exit = np.nanmin(np.maximum(t0, t1), axis=1)
+    nsteps = int(np.ceil(np.sqrt(3) * side)) + 1
+    maxima = np.full((len(directions),), np.nan)
+    pixel_step = max(1, chunk_size // nsteps)
+    for start in range(0, len(directions), pixel_step):
+        end = min(start + pixel_step, len(directions))
+        t = entry[start:end, None] + step * (np.arange(nsteps) + 0.5)[None, :]
+        inside = t < exit[start:end, None]
+        points = origin + t[:, :, None] * directions[start:end, None, :]
+        index = np.clip(np.floor((points + r_max) / step).astype(np.int64), 0, side - 1)
+        samples = cube[index[..., 0], index[..., 1], index[..., 2]]
+        samples[~inside] = np.nan
+        with np.errstate(invalid="ignore"):
+            valid = (~np.isnan(samples)).any(axis=1)
+            maxima[start:end][valid] = np.nanmax(samples[valid], axis=1)
+    (m, M) = value_range
+    fractions = np.clip((maxima - m) / ((M - m) or 1.0), 0, 1)
+    image = color_ramp(np.nan_to_num(fractions))
+    image[np.isnan(maxima)] = 0
+    return image.reshape((camera.height, camera.width, 3))
+
+class FrameRenderer:
+
+    "Render one frame from a processed data JSON file (picklable for worker processes)."
+
+    def __init__(self, settings, width, height, mode="isosurface", threshold=None, volume_side=128, cache_dir=None,
+            chunk_size=DEFAULT_CHUNK_SIZE):
+        assert mode in MODES, "unknown mode " + repr(mode)
+        (self.settings, self.width, self.height, self.mode) = (settings, width, height, mode)
+        (self.threshold, self.volume_side, self.cache_dir, self.chunk_size) = (threshold, volume_side, cache_dir, chunk_size)
+
+    def camera(self, center, radius):
+        if self.settings:
+            return Camera.from_settings(self.settings, self.width, self.height)
+        return Camera.looking_at(center, radius, self.width, self.height)
+
+    def frame_threshold(self, json_value):
+        "Isosurface level: --threshold, then the camera settings, then the middle of the value range."
+        if self.threshold is not None:
+            return self.threshold
+        if self.settings and self.settings.get("threshold") is not None:
+            return float(self.settings["threshold"])
+        return 0.5 * (json_value["intensity_min"] + json_value["intensity_max"])
+
+    def render(self, json_path):
+        "(image, statistics) for the output at json_path."
+        with open(json_path) as f:
+            json_value = json.load(f)
+        blocks = dump_json_and_binary.load_files(json_path)
+        r_max = float(np.asarray(blocks.rs).max())
+        if self.mode == "volume":
+            cube = blocks.interp_data_cube(self.volume_side, default=np.nan, verbose=False, grid="cartesian",
+                cache_dir=self.cache_dir)
+            image = render_volume(cube, r_max, self.camera(np.zeros(3), r_max),
+                (json_value["intensity_min"], json_value["intensity_max"]), self.chunk_size)
+            return (image, {"voxels": cube.size})
+        level = self.frame_threshold(json_value)
+        [(vertices, triangles)] = isosurface.isosurfaces(blocks, [level])
+        if len(vertices):
+            (low, high) = (vertices.min(axis=0), vertices.max(axis=0))
+            (center, radius) = (0.5 * (low + high), 0.5 * np.sqrt(((high - low) ** 2).sum()))
+        else:
+            (center, radius) = (np.zeros(3), r_max)
+        image = render_mesh(vertices, triangles, self.camera(center, radius), self.chunk_size)
+        return (image, {"threshold": level, "triangles": len(triangles)})
+
+# per process state for render workers
+worker_state = {}
+
+def render_worker_init(renderer):
+    worker_state["renderer"] = renderer
+
+def render_worker(job):
+    "Render and save one frame.  Returns (index, path, seconds, statistics)."
+    (index, json_path, png_path) = job
+    start = time.perf_counter()
+    (image, statistics) = worker_state["renderer"].render(json_path)
+    Image.fromarray(image).save(png_path)
+    return (index, png_path, time.perf_counter() - start, statistics)
+
+def render_frames(renderer, frames, workers=1, verbose=True):
+    """
+    Render (json_path, png_path) frames, in worker processes if workers > 1.
+    Returns a summary with the overall frames per second.
+    """
+    jobs = [(index, json_path, png_path) for (index, (json_path, png_path)) in enumerate(frames)]
+    start = time.perf_counter()
+    seconds = []
+    def report(result):
+        (index, png_path, elapsed, statistics) = result
+        seconds.append(elapsed)
+        if verbose:
+            wall = time.perf_counter() - start
+            print("    [%s/%s] %s in %.2f s %s, %.2f frames per second" % (
+                len(seconds), len(jobs), repr(png_path), elapsed, statistics, len(seconds) / wall))
+    if workers > 1:
+        with Pool(workers, render_worker_init, (renderer,)) as pool:
+            for result in pool.imap_unordered(render_worker, jobs):
+                report(result)
+    else:
+        render_worker_init(renderer)
+        for job in jobs:
+            report(render_worker(job))
+    wall = time.perf_counter() - start
+    summary = {
+        "frames": len(jobs),
+        "workers": workers,
+        "wall": wall,
+        "frames_per_second": len(jobs) / wall if wall > 0 else None,
+        "mean_frame_seconds": float(np.mean(seconds)) if seconds else None,
+    }
+    if verbose:
+        print("rendered", summary)
+    return summary
+
+def config_outputs(http_directory, substring="", limit=0):
+    "JSON paths of the outputs listed in the config.json of a visualization directory, in order."
+    config = viz_config.VizConfig(http_directory)
+    config.load()
+    paths = []
+    for index in range(len(config.pages)):
+        for entry in config.entries(index):
+            if substring in entry["prefix"]:
+                paths.append(os.path.join(config.data_directory, entry["json"]))
+                if limit and len(paths) >= limit:
+                    return paths
+    return paths
+
+def test_render_sphere(size=64):
+    "A sphere rendered from +z fills a centered disk facing the camera."
+    (vertices, triangles) = isosurface.block_isosurface(
+        np.broadcast_to(np.linspace(1, 2, 13)[:, None, None], (13, 13, 25)),
+        np.linspace(1, 2, 13), np.linspace(0, np.pi, 13), np.linspace(0, 2 * np.pi, 25), 1.5)
+    camera = Camera.looking_at(np.zeros(3), 1.5, size, size)
+    image = render_mesh(vertices, triangles, camera)
+    covered = image.any(axis=2)
+    center = size // 2
+    assert covered[center, center] and not covered[0, 0], "sphere not centered"
+    # the nearest point faces the camera: normal (0, 0, 1) is colored (128, 128, 255)
+    assert np.abs(image[center, center].astype(int) - [128, 128, 255]).max() < 20, repr(image[center, center])
+    print("sphere covers", covered.mean(), "of the image")
+
+class Runner:
+
+    def __init__(self):
+        parser = self.parser = argparse.ArgumentParser()
+        a = parser.add_argument
+        a("--to_directory", help="Destination directory where to place the images.", required=True)
+        a("--http_directory", help="Visualization directory containing config.json and processed_data.", required=True)
+        a("--settings_path", help="Camera settings file path containing camera settings parameters.")
+        a("--limit", help="Maximum number of images to render (default all).", type=int, default=0)
+        a("--substring", help="Only render outputs with prefixes containing this substring (default all).", default="")
+        a("--mode", help="What to render: isosurface or volume (maximum intensity projection).", choices=MODES, default="isosurface")
+        a("--threshold", help="Isosurface level (default from the camera settings, or the middle of each value range).", type=float)
+        a("--width", help="Image width in pixels (default 800).", type=int, default=800)
+        a("--height", help="Image height in pixels (default 800).", type=int, default=800)
+        a("--volume_side", help="Side of the Cartesian resampling for volume mode (default 128).", type=int, default=128)
+        a("--workers", help="Number of processes rendering frames (default 1).", type=int, default=1)
+        a("--name_prefix", help="Image file name prefix, followed by the frame number (default 'frame_').", default="frame_")
+        a("--quiet", help="Don't print helpful output.", action="store_true")
+        args = self.args = parser.parse_args()
+        self.verbose = not args.quiet
+        self.http_directory = os.path.abspath(os.path.expanduser(args.http_directory))
+        assert os.path.isdir(self.http_directory), repr(self.http_directory) + " must be a directory."
+        self.to_directory = os.path.abspath(os.path.expanduser(args.to_directory))
+        self.settings = None
+        if args.settings_path:
+            self.settings = read_camera_settings(os.path.expanduser(args.settings_path))
+            if self.verbose:
+                print("using camera settings", self.settings)
+
+    def run(self):
+        args = self.args
+        if not os.path.isdir(self.to_directory):
+            if self.verbose:
+                print("creating output directory", repr(self.to_directory))
+            os.makedirs(self.to_directory)
+        paths = config_outputs(self.http_directory, args.substring, args.limit)
+        assert paths, "no outputs listed in " + repr(os.path.join(self.http_directory, viz_config.CONFIG_FILENAME))
+        frames = [(path, os.path.join(self.to_directory, "%s%05d.png" % (args.name_prefix, index)))
+            for (index, path) in enumerate(paths)]
+        cache_dir = os.path.join(self.to_directory, "resample_cache")
+        renderer = FrameRenderer(self.settings, args.width, args.height, args.mode, args.threshold, args.volume_side, cache_dir)
+        if args.mode == "volume" and args.workers > 1:
+            # build the resample table once before the workers would all build it at the same time
+            blocks = dump_json_and_binary.load_files(paths[0])
+            blocks.interp_data_cube(args.volume_side, verbose=self.verbose, grid="cartesian", cache_dir=cache_dir)
+        if self.verbose:
+            print("rendering", len(frames), args.mode, "frames to", repr(self.to_directory), "with", args.workers, "workers")
+        return render_frames(renderer, frames, args.workers, self.verbose)
+
+if __name__ == "__main__":
+    Runner().run()
@@ -0,0 +1,173 @@
+"""
+Resample block data onto regular grids using precomputed gather tables.
+
+A ResampleTable records, for every target voxel, the flat indices of the source values
+and the trilinear weights which produce the voxel value.  The table depends only on the
+mesh geometry and the target grid, so it can be cached on disk and reused for every
+snapshot and variable which share the mesh.  Applying it is a vectorized
+gather-and-multiply processed in memory bounded chunks.
+"""
+
+import os
+import hashlib
+import numpy as np
+from . import expand_blocks
+
+# number of voxels resolved or resampled at a time
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+GRIDS = ("spherical", "cartesian")
+
+def ticks(arr, side):
+    "side evenly spaced samples starting at the array minimum (as in the original data cube)."
+    M = arr.max()
+    m = arr.min()
+    d = M - m
+    assert d > 1e-5, "difference in array too small " + repr((M, m, d))
+    di = d / side
+    # scalar arithmetic keeps the source precision, matching the original point by point cube
+    return np.array([m + di * i for i in range(side)], dtype=np.float64)
+
+class Grid:
+
+    "Target voxel grid: side^3 voxels in (r, theta, phi) or Cartesian (x, y, z) order."
+
+    def __init__(self, kind, side, rs, thetas, phis):
+        assert kind in GRIDS, "unknown grid kind " + repr(kind)
+        (self.kind, self.side) = (kind, side)
+        if kind == "spherical":
+            self.axes = [ticks(rs, side), ticks(thetas, side), ticks(phis, side)]
+        else:
+            # voxel centers of a cube enclosing the outer radius
+            r_max = float(rs.max())
+            step = 2 * r_max / side
+            axis = -r_max + step * (np.arange(side) + 0.5)
+            self.axes = [axis, axis, axis]
+
+    def size(self):
+        return self.side ** 3
+
+    def points(self, start, end):
+        "(r, theta, phi) locations of the voxels with flat indices in [start, end)."
+        side = self.side
+        flat = np.arange(start, end)
+        (i, j, k) = (flat // (side * side), (flat // side) % side, flat % side)
+        (a, b, c) = self.axes
+        if self.kind == "spherical":
+            return np.stack([a[i], b[j], c[k]], axis=1)
+        (x, y, z) = (a[i], b[j], c[k])
+        r = np.sqrt(x * x + y * y + z * z)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            theta = np.where(r > 0, np.arccos(np.clip(z / r, -1.0, 1.0)), 0.0)
+        phi = np.mod(np.arctan2(y, x), 2 * np.pi)
+        return np.stack([r, theta, phi], axis=1)
+
+class ResampleTable:
+
+    "Gather table of source indices, trilinear weights and status for every voxel of a grid."
+
+    def __init__(self, side, indices, weights, status):
+        (self.side, self.indices, self.weights, self.status) = (side, indices, weights, status)
+
+    @classmethod
+    def build(cls, interpolator, grid, chunk_size=DEFAULT_CHUNK_SIZE, prefix=None, verbose=False):
+        """
+        Resolve every voxel of the grid with interpolator.gather_weights, chunk by chunk.
+        If prefix is given the table is written directly to .npy files with that path prefix.
+        """
+        nvoxels = grid.size()
+        num_values = sum(b.block.size for b in interpolator.blocks)
+        index_type = np.int32 if num_values < 2 ** 31 else np.int64
+        shapes = {"indices": ((nvoxels, 8), index_type), "weights": ((nvoxels, 8), np.float32),
+            "status": ((nvoxels,), np.int8)}
+        arrays = {}
+        for (name, (shape, dtype)) in shapes.items():
+            if prefix:
+                arrays[name] = np.lib.format.open_memmap(
+                    table_path(prefix, name), mode="w+", dtype=dtype, shape=shape)
+            else:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+        for start in range(0, nvoxels, chunk_size):
+            end = min(start + chunk_size, nvoxels)
+            (indices, weights, status) = interpolator.gather_weights(grid.points(start, end))
+            arrays["indices"][start:end] = indices
+            arrays["weights"][start:end] = weights
+            arrays["status"][start:end] = status
+            if verbose:
+                print("    resolved voxels", start, "to", end, "of", nvoxels)
+        if prefix:
+            for array in arrays.values():
+                array.flush()
+        return cls(grid.side, arrays["indices"], arrays["weights"], arrays["status"])
+
+    @classmethod
+    def load(cls, prefix, side):
+        "Memory map a table saved by build."
+        (indices, weights, status) = [np.load(table_path(prefix, name), mmap_mode="r")
+            for name in ("indices", "weights", "status")]
+        return cls(side, indices, weights, status)
+
+    def apply(self, values, default=0.0, substitute=None, out=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Resample the source values (num_blocks, r, theta, phi) to a (side, side, side) cube.
+        Voxels outside the mesh get default; with substitute every interpolated voxel gets substitute.
+        out may be a preallocated (side, side, side) array or np.memmap.
+        """
+        side = self.side
+        if out is None:
+            out = np.zeros((side, side, side), dtype=np.float64)
+        flat_out = out.reshape(-1)
+        flat_values = np.ascontiguousarray(values).reshape(-1)
+        nvoxels = flat_out.shape[0]
+        for start in range(0, nvoxels, chunk_size):
+            end = min(start + chunk_size, nvoxels)
+            indices = self.indices[start:end]
+            weights = self.weights[start:end]
+            status = self.status[start:end]
+            chunk = (flat_values[indices] * weights).sum(axis=1)
+            if substitute:
+                chunk[status == expand_blocks.GATHER_INTERPOLATED] = substitute
+            chunk[status == expand_blocks.GATHER_MISSING] = default
+            flat_out[start:end] = chunk
+        return out
+
+def table_path(prefix, name):
+    return "%s_%s.npy" % (prefix, name)
+
+def geometry_key(rs, thetas, phis, values_shape, limits, kind, side):
+    "Hash identifying a mesh geometry and target grid."
+    h = hashlib.sha1()
+    for array in (rs, thetas, phis):
+        array = np.ascontiguousarray(array)
+        h.update(repr((array.shape, array.dtype.str)).encode("utf8"))
+        h.update(array.tobytes())
+    h.update(repr((tuple(values_shape), list(limits), kind, side)).encode("utf8"))
+    return h.hexdigest()[:20]
+
+def resample_table(blocks, side, kind="spherical", cache_dir=None, chunk_size=DEFAULT_CHUNK_SIZE, verbose=False):
+    """
+    Get the resample table for BlockDescriptions blocks, reusing a cached table in cache_dir
+    for the same geometry if there is one.
+    """
+    grid = Grid(kind, side, blocks.rs, blocks.thetas, blocks.phis)
+    prefix = None
+    if cache_dir:
+        key = geometry_key(blocks.rs, blocks.thetas, blocks.phis, blocks.values.shape, blocks.limits, kind, side)
+        prefix = os.path.join(cache_dir, "resample_" + key)
+        if os.path.exists(table_path(prefix, "status")):
+            if verbose:
+                print("    reusing resample table", prefix)
+            return ResampleTable.load(prefix, side)
+        os.makedirs(cache_dir, exist_ok=True)
+    if verbose:
+        print("    building resample table", kind, side, prefix)
+    # write to temporary files and rename so an interrupted build is never reused;
+    # the names are per process because several processes may build the same table at once
+    build_prefix = prefix and prefix + "_partial_%s" % os.getpid()
+    table = ResampleTable.build(blocks.interpolator(), grid, chunk_size, build_prefix, verbose)
+    if prefix:
+        del table
+        for name in ("indices", "weights", "status"):
+            os.replace(table_path(build_prefix, name), table_path(prefix, name))
+        table = ResampleTable.load(prefix, side)
+    return table
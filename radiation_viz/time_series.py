@@ -0,0 +1,343 @@
+"""
+Time series of one variable over consecutive snapshots on an identical mesh.
+
+The series binary <prefix>.series holds the float32 r, theta and phi face values once (in the
+dump_files layout) followed by one zlib compressed record per frame:
+
+- keyframes hold the byte shuffled float32 values of every block;
+- delta frames hold a float32 scale for every block followed by the byte shuffled quantized
+  differences (int16 or int8) from the previous decoded frame: value = previous + q * scale.
+
+Deltas are taken against the decoded previous frame so quantization errors do not accumulate.
+A keyframe is written every keyframe_interval frames, and also when a delta frame would exceed
+the error tolerance.  <prefix>.series.json records the shape, the byte offset and length of
+every frame record, its keyframe, time, source and value range.  Any frame is decoded from its
+keyframe and the following delta records, which are contiguous in the file.
+
+Example usage:
+
+$ python -m radiation_viz.time_series ~/data/*.athdf --variable rho --skip 4 --to_directory ~/tmp/radiation_test
+"""
+
+import argparse
+import os
+import json
+import zlib
+import h5py
+import numpy as np
+from . import dump_json_and_binary
+
+SERIES_SUFFIX = ".series"
+DELTA_ENCODINGS = ("int16", "int8")
+DEFAULT_KEYFRAME_INTERVAL = 10
+FLOAT32_BYTES = np.dtype(np.float32).itemsize
+
+def series_filenames(prefix):
+    "(json_fn, bin_fn) of a series.  Not .bin files, so the series are not listed as single outputs."
+    return (prefix + SERIES_SUFFIX + ".json", prefix + SERIES_SUFFIX)
+
+def quantize_delta(delta, delta_encoding):
+    "Quantize a float64 block difference symmetrically: returns (q, scale) with delta ~ q * scale."
+    levels = np.iinfo(np.dtype(delta_encoding)).max
+    amax = float(np.abs(delta).max())
+    scale = np.float32(amax / levels) if amax > 0 else np.float32(1.0)
+    q = np.clip(np.rint(delta / float(scale)), -levels, levels).astype(delta_encoding)
+    return (q, scale)
+
+def apply_delta(previous, q, scale):
+    "previous + q * scale in float64, rounded once to float32 (as the Javascript decoder does)."
+    return (previous.astype(np.float64) + q * float(scale)).astype(np.float32)
+
+class SeriesWriter:
+
+    def __init__(self, to_dir, prefix, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, delta_encoding="int16",
+            tolerance=None, compress_level=6, metadata=None, verbose=True):
+        """
+        Write frames to <prefix>.series in to_dir.  tolerance (if given) is the largest delta
+        error, relative to the value range of the frame, before a keyframe is forced.
+        """
+        assert keyframe_interval > 0, "keyframe interval must be positive " + repr(keyframe_interval)
+        assert delta_encoding in DELTA_ENCODINGS, "unknown delta encoding " + repr(delta_encoding)
+        (self.to_dir, self.prefix) = (to_dir, prefix)
+        (self.keyframe_interval, self.delta_encoding, self.tolerance) = (keyframe_interval, delta_encoding, tolerance)
+        self.compress_level = compress_level
+        self.metadata = metadata or {}
+        self.verbose = verbose
+        (self.json_fn, self.bin_fn) = series_filenames(prefix)
+        self.bin_path = os.path.join(to_dir, self.bin_fn)
+        self.partial_path = self.bin_path + ".partial"
+        self.bin_f = None
+        self.frames = []
+        self.previous = None
+        self.since_keyframe = 0
+        self.raw_bytes = 0
+
+    def add(self, blocks, time=None, source=None):
+        "Append the values of BlockDescriptions blocks (on the mesh of the first frame) as the next frame."
+        values = blocks.values
+        if self.bin_f is None:
+            self.start(blocks)
+        else:
+            for (name, first, coordinates) in zip(("r", "theta", "phi"), self.geometry,
+                    (blocks.rs, blocks.thetas, blocks.phis)):
+                assert np.array_equal(first, coordinates), "frame %s has a different %s mesh" % (len(self.frames), name)
+            assert values.shape == self.shape, "frame shape changed " + repr((values.shape, self.shape))
+        frame = {"time": time, "source": source}
+        (value_min, value_max) = (float(values.min()), float(values.max()))
+        record = None
+        if self.previous is not None and self.since_keyframe < self.keyframe_interval:
+            (record, decoded, max_error) = self.delta_record(values)
+            limit = self.tolerance and self.tolerance * (value_max - value_min)
+            if limit and max_error > limit:
+                # the change is too large for the delta encoding
+                record = None
+        if record is None:
+            decoded = np.ascontiguousarray(values, dtype=np.float32)
+            record = dump_json_and_binary.shuffle_bytes(decoded)
+            max_error = 0.0
+            self.keyframe = len(self.frames)
+            self.since_keyframe = 0
+        self.since_keyframe += 1
+        data = zlib.compress(record, self.compress_level)
+        frame.update({
+            "keyframe": self.keyframe,
+            "offset": self.offset,
+            "length": len(data),
+            "intensity_min": value_min,
+            "intensity_max": value_max,
+            "max_error": max_error,
+        })
+        self.bin_f.write(data)
+        self.offset += len(data)
+        self.raw_bytes += values.size * FLOAT32_BYTES
+        self.frames.append(frame)
+        self.previous = decoded
+        if self.verbose:
+            kind = "keyframe" if frame["keyframe"] == len(self.frames) - 1 else "delta"
+            print("    frame %s %s (%s) %s bytes, max error %g" % (len(self.frames) - 1, kind, source, len(data), max_error))
+
+    def start(self, blocks):
+        "Write the geometry of the first frame."
+        self.shape = blocks.values.shape
+        self.geometry = [np.array(c, dtype=np.float32) for c in (blocks.rs, blocks.thetas, blocks.phis)]
+        self.layout = dump_json_and_binary.binary_layout(*[c.shape for c in self.geometry])
+        self.bin_f = open(self.partial_path, "wb")
+        for coordinates in self.geometry:
+            self.bin_f.write(coordinates.tobytes())
+        self.offset = self.layout["values_offset"]
+
+    def delta_record(self, values):
+        "(record bytes, decoded values, max error) of the delta from the previous decoded frame."
+        previous = self.previous
+        scales = np.zeros((self.shape[0],), dtype=np.float32)
+        quantized = np.zeros(self.shape, dtype=self.delta_encoding)
+        decoded = np.zeros(self.shape, dtype=np.float32)
+        max_error = 0.0
+        for b in range(self.shape[0]):
+            block = np.asarray(values[b], dtype=np.float64)
+            (q, scale) = quantize_delta(block - previous[b], self.delta_encoding)
+            (quantized[b], scales[b]) = (q, scale)
+            decoded[b] = apply_delta(previous[b], q, scale)
+            max_error = max(max_error, float(np.abs(decoded[b] - block).max()))
+        record = scales.tobytes() + dump_json_and_binary.shuffle_bytes(quantized)
+        return (record, decoded, max_error)
+
+    def close(self):
+        "Finish the binary and write the JSON.  Returns (json_fn, bin_fn)."
+        assert self.frames, "no frames in series " + repr(self.prefix)
+        self.bin_f.close()
+        os.replace(self.partial_path, self.bin_path)
+        (num_blocks, r_size, theta_size, phi_size) = self.shape
+        json_value = {
+            "r_max": float(self.geometry[0].max()),
+            "intensity_min": min(frame["intensity_min"] for frame in self.frames),
+            "intensity_max": max(frame["intensity_max"] for frame in self.frames),
+            "r_size": r_size,
+            "theta_size": theta_size,
+            "phi_size": phi_size,
+            "num_blocks": num_blocks,
+            "binary_file": self.bin_fn,
+            "compression": "zlib",
+            "shuffle": True,
+            "delta_encoding": self.delta_encoding,
+            "keyframe_interval": self.keyframe_interval,
+            "num_frames": len(self.frames),
+            "bytes": self.offset,
+            "raw_bytes": self.raw_bytes,
+            "frames": self.frames,
+        }
+        json_value.update(self.layout)
+        json_value.update(self.metadata)
+        with open(os.path.join(self.to_dir, self.json_fn), "w") as f:
+            json.dump(json_value, f, indent=1)
+        if self.verbose:
+            print("    wrote %s frames to %s: %s bytes for %s float32 bytes (%.1fx)" % (
+                len(self.frames), repr(self.bin_path), self.offset, self.raw_bytes, self.raw_bytes / self.offset))
+        return (self.json_fn, self.bin_fn)
+
+class TimeSeries:
+
+    "Decoder for a series written by SeriesWriter."
+
+    def __init__(self, json_path):
+        with open(json_path) as f:
+            self.json_value = json.load(f)
+        json_value = self.json_value
+        self.bin_path = os.path.join(os.path.dirname(json_path), json_value["binary_file"])
+        self.frames = json_value["frames"]
+        self.shape = (json_value["num_blocks"], json_value["r_size"], json_value["theta_size"], json_value["phi_size"])
+        self.delta_encoding = np.dtype(json_value["delta_encoding"])
+        num_blocks = self.shape[0]
+        coordinates = []
+        for (name, size) in zip(("r_values", "theta_values", "phi_values"), self.shape[1:]):
+            coordinates.append(np.fromfile(self.bin_path, dtype=np.float32, count=num_blocks * (size + 1),
+                offset=json_value[name + "_offset"]).reshape((num_blocks, size + 1)))
+        (self.rs, self.thetas, self.phis) = coordinates
+
+    def __len__(self):
+        return len(self.frames)
+
+    def decode_record(self, data, previous):
+        "Values of a frame from its compressed record and the previous frame values (None for keyframes)."
+        record = zlib.decompress(data)
+        if previous is None:
+            return dump_json_and_binary.unshuffle_bytes(record, np.float32).reshape(self.shape)
+        num_blocks = self.shape[0]
+        scales = np.frombuffer(record, dtype=np.float32, count=num_blocks)
+        quantized = dump_json_and_binary.unshuffle_bytes(record[num_blocks * FLOAT32_BYTES:], self.delta_encoding)
+        quantized = quantized.reshape(self.shape)
+        values = np.zeros(self.shape, dtype=np.float32)
+        for b in range(num_blocks):
+            values[b] = apply_delta(previous[b], quantized[b], scales[b])
+        return values
+
+    def frame_values(self, index):
+        "Values of frame index, decoded from its keyframe with one read."
+        frame = self.frames[index]
+        first = self.frames[frame["keyframe"]]
+        with open(self.bin_path, "rb") as f:
+            f.seek(first["offset"])
+            data = f.read(frame["offset"] + frame["length"] - first["offset"])
+        values = None
+        for i in range(frame["keyframe"], index + 1):
+            start = self.frames[i]["offset"] - first["offset"]
+            values = self.decode_record(data[start: start + self.frames[i]["length"]], values)
+        return values
+
+    def iterate_values(self, start=0, end=None):
+        "Generate the values of frames start to end in order, decoding each record once."
+        end = len(self.frames) if end is None else end
+        values = None
+        with open(self.bin_path, "rb") as f:
+            for index in range(start, end):
+                frame = self.frames[index]
+                if values is None and frame["keyframe"] != index:
+                    values = self.frame_values(index)
+                else:
+                    f.seek(frame["offset"])
+                    data = f.read(frame["length"])
+                    values = self.decode_record(data, None if frame["keyframe"] == index else values)
+                yield values
+
+    def frame_blocks(self, index):
+        "BlockDescriptions of frame index."
+        return dump_json_and_binary.BlockDescriptions(self.rs, self.thetas, self.phis, self.frame_values(index))
+
+def variable_location(f, variable):
+    "(dataset, index) of a variable in an open athdf file."
+    variable_names = [b.decode("utf8") for b in f.attrs["VariableNames"]]
+    dataset_names = [b.decode("utf8") for b in f.attrs["DatasetNames"]]
+    count = 0
+    for (nv, ds) in zip(f.attrs["NumVariables"], dataset_names):
+        for index in range(nv):
+            if variable_names[count] == variable:
+                return (ds, index)
+            count += 1
+    raise KeyError("variable not found: " + repr(variable))
+
+def snapshot_time(filename):
+    "Simulation time of an athdf file (None if it is not recorded)."
+    with h5py.File(filename, "r") as f:
+        return float(f.attrs["Time"]) if "Time" in f.attrs else None
+
+def read_frame(filename, variable, skip=0, pool="stride", workers=1, verbose=False):
+    "Expanded BlockDescriptions of a variable of one snapshot, reduced by skip as in prepare_viz_data."
+    with h5py.File(filename, "r") as f:
+        (rs, thetas, phis) = dump_json_and_binary.read_geometry(f)
+        (ds, index) = variable_location(f, variable)
+        values = dump_json_and_binary.to_r_theta_phi(dump_json_and_binary.read_variable(f, ds, index))
+    blocks = dump_json_and_binary.BlockDescriptions(rs, thetas, phis, values)
+    factor = skip or 1
+    blocks = blocks.reduce_r_phi([factor], pool, verbose)[factor]
+    return blocks.expand(verbose=False, workers=workers)
+
+def write_series(filenames, to_dir, prefix, variable, skip=0, pool="stride", keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+        delta_encoding="int16", tolerance=None, workers=1, verbose=True):
+    "Write the series of variable over the snapshot files in time order.  Returns (json_fn, bin_fn)."
+    times = [(snapshot_time(fn), fn) for fn in filenames]
+    # snapshots without a time follow in filename order
+    times.sort(key=lambda pair: (pair[0] is None, pair[0] or 0.0, pair[1]))
+    metadata = {"variable": variable, "skip": skip, "pool": pool}
+    writer = SeriesWriter(to_dir, prefix, keyframe_interval, delta_encoding, tolerance, metadata=metadata, verbose=verbose)
+    for (time, filename) in times:
+        blocks = read_frame(filename, variable, skip, pool, workers)
+        writer.add(blocks, time, os.path.split(filename)[1])
+    return writer.close()
+
+def test_round_trip(num_frames=7, shape=(3, 4, 5, 6), keyframe_interval=3, seed=0):
+    "Decode a synthetic drifting series and check the delta error bounds."
+    import tempfile
+    rng = np.random.RandomState(seed)
+    (nb, nr, nt, nph) = shape
+    rs = np.tile(np.linspace(1, 2, nr + 1), (nb, 1)).astype(np.float32)
+    thetas = np.tile(np.linspace(0, 1, nt + 1), (nb, 1)).astype(np.float32)
+    phis = np.tile(np.linspace(0, 2, nph + 1), (nb, 1)).astype(np.float32)
+    values = rng.normal(size=shape).astype(np.float32)
+    expected = []
+    with tempfile.TemporaryDirectory() as to_dir:
+        for encoding in DELTA_ENCODINGS:
+            writer = SeriesWriter(to_dir, "test_" + encoding, keyframe_interval, encoding, verbose=False)
+            frames = []
+            for i in range(num_frames):
+                frame = (values + 0.01 * i * rng.normal(size=shape)).astype(np.float32)
+                frames.append(frame)
+                writer.add(dump_json_and_binary.BlockDescriptions(rs, thetas, phis, frame), time=0.1 * i)
+            (json_fn, bin_fn) = writer.close()
+            series = TimeSeries(os.path.join(to_dir, json_fn))
+            assert np.array_equal(series.rs, rs)
+            decoded = list(series.iterate_values())
+            for (i, frame) in enumerate(frames):
+                info = series.frames[i]
+                assert np.array_equal(series.frame_values(i), decoded[i])
+                assert np.abs(decoded[i] - frame).max() <= info["max_error"] + 1e-6
+                if info["keyframe"] == i:
+                    assert np.array_equal(decoded[i], frame)
+            expected.append(max(info["max_error"] for info in series.frames))
+    print("time series round trip max errors", dict(zip(DELTA_ENCODINGS, expected)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    a = parser.add_argument
+    a("filenames", help="Snapshot files of the series.  Must end in '.athdf'.", nargs='+', metavar='FILE')
+    a("--variable", help="Variable to write.", required=True)
+    a("--to_directory", help="Visualization directory (the series is written to its processed_data folder).",
+        default="./radiation_viz")
+    a("--prefix", help="Series file prefix (default <variable>_full or <variable>_skip_<skip>).", default="")
+    a("--skip", help="Reduction stride for r and phi (0 for full resolution).", type=int, default=0)
+    a("--pool", help="How reduced views combine cells (default stride).", choices=dump_json_and_binary.POOL_MODES, default="stride")
+    a("--keyframe_interval", help="Frames between keyframes (default %s)." % DEFAULT_KEYFRAME_INTERVAL,
+        type=int, default=DEFAULT_KEYFRAME_INTERVAL)
+    a("--delta_encoding", help="Quantization of the frame differences (default int16).", choices=DELTA_ENCODINGS, default="int16")
+    a("--tolerance", help="Force a keyframe when the delta error exceeds this fraction of the frame value range.",
+        type=float, default=None)
+    a("--workers", help="Number of processes for expanding blocks (default 1).", type=int, default=1)
+    a("--quiet", help="Don't print helpful output.", action="store_true")
+    args = parser.parse_args()
+    for filename in args.filenames:
+        assert filename.endswith(".athdf"), "Filename has incorrect extension: " + repr(filename)
+    prefix = args.prefix or ("%s_skip_%s" % (args.variable, args.skip) if args.skip else "%s_full" % args.variable)
+    data_dir = os.path.join(os.path.abspath(os.path.expanduser(args.to_directory)), "processed_data")
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    write_series(args.filenames, data_dir, prefix, args.variable, args.skip, args.pool, args.keyframe_interval,
+        args.delta_encoding, args.tolerance, args.workers, not args.quiet)
@@ -0,0 +1,267 @@
+"""
+Paged config.json maintenance for visualization directories.
+
+Every output (a JSON and binary pair written by dump_files) has one config entry recording its
+file names and sizes, variable, source snapshot and time, level of detail (skip), shape and
+value range.  Entries are kept in time order in page files under config_pages/, each holding
+up to page_size entries.  config.json lists the pages with their key ranges and value ranges,
+the global value range of each variable across the series, and (for viewers which do not page)
+the entries of the first page as "files".
+
+update adds or replaces the entries of finished outputs: only the affected page and config.json
+are rewritten, each atomically (temporary file and rename) under an exclusive lock so several
+processes may update the same directory.  rebuild scans the data directory and rewrites all pages.
+"""
+
+import os
+import json
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    # no advisory locking on this platform
+    fcntl = None
+from .dump_json_and_binary import binary_prefix
+
+CONFIG_FILENAME = "config.json"
+DATA_SUBDIRECTORY = "processed_data"
+PAGES_SUBDIRECTORY = "config_pages"
+LOCK_FILENAME = "config.json.lock"
+DEFAULT_PAGE_SIZE = 1000
+
+# items of the output JSON copied into its config entry
+ENTRY_ITEMS = ("variable", "source", "time", "skip", "r_size", "theta_size", "phi_size", "num_blocks",
+    "intensity_min", "intensity_max", "values_encoding")
+
+def entry_key(entry):
+    "Sort key of an entry: by time (entries without a time last), then prefix."
+    time = entry.get("time")
+    return (time is None, time or 0.0, entry["prefix"])
+
+def stored_key(entry):
+    "JSON form of the sort key, as recorded in the page list."
+    return [entry.get("time"), entry["prefix"]]
+
+def loaded_key(value):
+    (time, prefix) = value
+    return entry_key({"time": time, "prefix": prefix})
+
+def output_entry(data_directory, json_fn, bin_fn):
+    "Config entry for an output pair, with the metadata read from its JSON."
+    json_path = os.path.join(data_directory, json_fn)
+    with open(json_path) as f:
+        value = json.load(f)
+    entry = {"prefix": json_fn[:-len(".json")], "bin": bin_fn, "json": json_fn}
+    for name in ENTRY_ITEMS:
+        if name in value:
+            entry[name] = value[name]
+    entry["level"] = entry.get("skip") or 1
+    entry["bytes"] = os.path.getsize(os.path.join(data_directory, bin_fn))
+    entry["json_bytes"] = os.path.getsize(json_path)
+    return entry
+
+def write_json(path, value, indent=None):
+    "Write value to path atomically: write a temporary file and rename it into place."
+    temp_path = "%s.%s.tmp" % (path, os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(value, f, indent=indent)
+    os.replace(temp_path, path)
+
+class VizConfig:
+
+    def __init__(self, to_directory, data_subdirectory=DATA_SUBDIRECTORY, page_size=DEFAULT_PAGE_SIZE, verbose=False):
+        assert page_size > 0, "page size must be positive " + repr(page_size)
+        self.to_directory = to_directory
+        self.data_directory = os.path.join(to_directory, data_subdirectory)
+        self.data_subdirectory = data_subdirectory
+        self.path = os.path.join(to_directory, CONFIG_FILENAME)
+        self.page_size = page_size
+        self.verbose = verbose
+
+    @contextlib.contextmanager
+    def locked(self):
+        "Hold an exclusive lock on the config of the directory."
+        with open(os.path.join(self.to_directory, LOCK_FILENAME), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def load(self):
+        "Read config.json, converting an unpaged config (a plain files list) to a single page."
+        self.pages = []
+        self.page_entries = {}
+        self.next_page = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            config = json.load(f)
+        if "pages" in config:
+            self.pages = config["pages"]
+            self.next_page = config.get("next_page", len(self.pages))
+            if self.pages:
+                self.page_entries[0] = config.get("files", [])
+            return
+        # keep the listed outputs which still exist
+        entries = [entry for entry in config.get("files", [])
+            if os.path.exists(os.path.join(self.data_directory, entry["json"]))]
+        if entries:
+            self.new_page(0, sorted(entries, key=entry_key))
+            self.summarize_page(0)
+
+    def entries(self, index):
+        "Entries of page index, read from its file on first use."
+        if index not in self.page_entries:
+            with open(os.path.join(self.to_directory, self.pages[index]["file"])) as f:
+                self.page_entries[index] = json.load(f)["files"]
+        return self.page_entries[index]
+
+    def new_page(self, index, entries):
+        "Insert a page with entries (in key order) before the page at index."
+        filename = "%s/page_%05d.json" % (PAGES_SUBDIRECTORY, self.next_page)
+        self.next_page += 1
+        self.pages.insert(index, {"file": filename})
+        # shift the loaded entries of the following pages
+        self.page_entries = dict(((i + 1 if i >= index else i), e) for (i, e) in self.page_entries.items())
+        self.page_entries[index] = entries
+        return index
+
+    def find_page(self, key):
+        "Index of the page whose key range should hold key."
+        index = 0
+        for (i, page) in enumerate(self.pages):
+            if "first" not in page or loaded_key(page["first"]) <= key:
+                index = i
+            else:
+                break
+        return index
+
+    def insert(self, entry, changed):
+        "Add or replace entry in its page, recording the indices of changed pages."
+        key = entry_key(entry)
+        if not self.pages:
+            self.new_page(0, [])
+        index = self.find_page(key)
+        entries = [e for e in self.entries(index) if e["prefix"] != entry["prefix"]]
+        position = len(entries)
+        while position > 0 and entry_key(entries[position - 1]) > key:
+            position -= 1
+        entries.insert(position, entry)
+        self.page_entries[index] = entries
+        changed.add(index)
+        last = len(self.pages) - 1
+        if index == last and len(entries) > self.page_size:
+            # runs usually add later snapshots: start a new page after a full last page
+            self.page_entries[index] = entries[:self.page_size]
+            changed.add(self.new_page(index + 1, entries[self.page_size:]))
+        elif len(entries) > 2 * self.page_size:
+            half = len(entries) // 2
+            self.page_entries[index] = entries[:half]
+            new_index = self.new_page(index + 1, entries[half:])
+            changed = set((i + 1 if i >= new_index else i) for i in changed)
+            changed.update((index, new_index))
+        return changed
+
+    def summarize_page(self, index):
+        "Record the key range, time range and value ranges of page index in the page list."
+        entries = self.entries(index)
+        page = self.pages[index]
+        page["count"] = len(entries)
+        page["first"] = stored_key(entries[0])
+        page["last"] = stored_key(entries[-1])
+        times = [e["time"] for e in entries if e.get("time") is not None]
+        page["time_min"] = min(times) if times else None
+        page["time_max"] = max(times) if times else None
+        variables = {}
+        for e in entries:
+            if "variable" in e and "intensity_min" in e:
+                (m, M) = variables.get(e["variable"], (e["intensity_min"], e["intensity_max"]))
+                variables[e["variable"]] = (min(m, e["intensity_min"]), max(M, e["intensity_max"]))
+        page["variables"] = dict((vr, list(r)) for (vr, r) in variables.items())
+
+    def save(self, changed):
+        "Write the changed pages and config.json."
+        pages_directory = os.path.join(self.to_directory, PAGES_SUBDIRECTORY)
+        if not os.path.isdir(pages_directory):
+            os.makedirs(pages_directory)
+        for index in sorted(changed):
+            self.summarize_page(index)
+            write_json(os.path.join(self.to_directory, self.pages[index]["file"]), {"files": self.entries(index)})
+        # the global range of each variable from the page ranges
+        variables = {}
+        for page in self.pages:
+            for (vr, (m, M)) in page["variables"].items():
+                summary = variables.setdefault(vr, {"intensity_min": m, "intensity_max": M, "pages": 0})
+                summary["intensity_min"] = min(summary["intensity_min"], m)
+                summary["intensity_max"] = max(summary["intensity_max"], M)
+                summary["pages"] += 1
+        config = {
+            "files": self.entries(0) if self.pages else [],
+            "pages": self.pages,
+            "variables": variables,
+            "total": sum(page["count"] for page in self.pages),
+            "page_size": self.page_size,
+            "next_page": self.next_page,
+        }
+        write_json(self.path, config, indent=1)
+        if self.verbose:
+            print("    configured %s outputs in %s pages in %s" % (config["total"], len(self.pages), repr(self.path)))
+
+    def update(self, entries):
+        "Add or replace entries (made by output_entry) and rewrite only the affected pages."
+        if not entries:
+            return
+        with self.locked():
+            self.load()
+            changed = set()
+            for entry in sorted(entries, key=entry_key):
+                changed = self.insert(entry, changed)
+            self.save(changed)
+
+    def update_outputs(self, pairs):
+        "Add or replace the entries for the (json_fn, bin_fn) output pairs in the data directory."
+        self.update([output_entry(self.data_directory, json_fn, bin_fn) for (json_fn, bin_fn) in pairs])
+
+    def rebuild(self, limit=None):
+        """
+        Scan the data directory for output pairs and rewrite every page.  Entries whose files
+        have not changed size are reused without reading their JSON.
+        """
+        with self.locked():
+            self.load()
+            known = {}
+            for index in range(len(self.pages)):
+                for entry in self.entries(index):
+                    known[entry["prefix"]] = entry
+            files = set(os.listdir(self.data_directory))
+            entries = []
+            for bin_fn in sorted(files):
+                prefix = binary_prefix(bin_fn)
+                json_fn = prefix and prefix + ".json"
+                if prefix is None or json_fn not in files:
+                    continue
+                entry = known.get(prefix)
+                if (entry is None or entry.get("bin") != bin_fn or
+                    entry.get("bytes") != os.path.getsize(os.path.join(self.data_directory, bin_fn)) or
+                    entry.get("json_bytes") != os.path.getsize(os.path.join(self.data_directory, json_fn))):
+                    entry = output_entry(self.data_directory, json_fn, bin_fn)
+                entries.append(entry)
+                if limit and len(entries) >= limit:
+                    if self.verbose:
+                        print("Limiting config to", limit, "entries.")
+                    break
+            entries.sort(key=entry_key)
+            old_files = set(page["file"] for page in self.pages)
+            (self.pages, self.page_entries, self.next_page) = ([], {}, 0)
+            for start in range(0, len(entries), self.page_size):
+                self.new_page(len(self.pages), entries[start:start + self.page_size])
+            self.save(range(len(self.pages)))
+            # remove pages of the previous config which were not reused
+            for filename in old_files - set(page["file"] for page in self.pages):
+                path = os.path.join(self.to_directory, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+        return entries
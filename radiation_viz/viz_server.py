@@ -0,0 +1,238 @@
+"""
+Threaded static web server for visualization directories.
+
+- One thread per connection with HTTP/1.1 keep-alive.
+- Single byte Range requests (206 Partial Content) so the viewer can fetch individual blocks
+  of a binary file using the block directory in its JSON.
+- ETag and Last-Modified validators with conditional GET (304 Not Modified) and If-Range.
+- Precompressed files: a request for X is answered with X.gz and Content-Encoding: gzip when
+  the client accepts gzip, and .gz files themselves are sent with Content-Encoding: gzip.
+- File bodies are sent with socket.sendfile (zero copy where the platform supports it).
+- Each request is logged with its latency and throughput.
+
+Example usage:
+
+$ python -m radiation_viz.viz_server ~/tmp/radiation_test --port 9999
+"""
+
+import argparse
+import os
+import re
+import time
+import threading
+import functools
+import email.utils
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+GZIP_SUFFIX = ".gz"
+
+def parse_range(header, size):
+    """
+    Parse a single range "bytes=start-end", "bytes=start-" or "bytes=-suffix" against a file size.
+    Returns (start, end) inclusive, "unsatisfiable", or None if the header should be ignored.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        # multiple ranges or another unit: serve the whole file
+        return None
+    (first, last) = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # the final bytes of the file
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return (max(0, size - length), size - 1)
+    start = int(first)
+    end = size - 1 if not last else min(int(last), size - 1)
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return (start, end)
+
+def entity_tag(st):
+    "Strong validator from the modification time and size of a file."
+    return '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+
+def accepts_gzip(header):
+    if not header:
+        return False
+    for coding in header.split(","):
+        parts = coding.strip().split(";")
+        if parts[0].strip() in ("gzip", "*"):
+            quality = [p.strip() for p in parts[1:] if p.strip().startswith("q=")]
+            return not (quality and float(quality[0][2:]) == 0)
+    return False
+
+class VizServer(ThreadingHTTPServer):
+
+    "ThreadingHTTPServer which accumulates request statistics."
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, verbose=True):
+        ThreadingHTTPServer.__init__(self, server_address, handler_class)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        (self.requests, self.bytes_sent, self.seconds) = (0, 0, 0.0)
+
+    def record(self, nbytes, seconds):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+            self.seconds += seconds
+
+    def statistics(self):
+        with self.lock:
+            return {"requests": self.requests, "bytes_sent": self.bytes_sent, "seconds": self.seconds}
+
+class VizRequestHandler(SimpleHTTPRequestHandler):
+
+    "SimpleHTTPRequestHandler with keep-alive, ranges, validators, gzip negotiation and sendfile."
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.timed(SimpleHTTPRequestHandler.do_GET)
+
+    def do_HEAD(self):
+        self.timed(SimpleHTTPRequestHandler.do_HEAD)
+
+    def timed(self, method):
+        (self.byte_range, self.bytes_sent, self.status) = (None, 0, None)
+        start = time.perf_counter()
+        method(self)
+        seconds = time.perf_counter() - start
+        self.server.record(self.bytes_sent, seconds)
+        if self.server.verbose:
+            rate = self.bytes_sent / seconds / 2 ** 20 if seconds > 0 else 0.0
+            self.log_message('"%s" %s %s bytes %.1f ms %.1f MB/s',
+                self.requestline, self.status, self.bytes_sent, seconds * 1000, rate)
+
+    def log_request(self, code="-", size="-"):
+        # logged with the timing when the request completes
+        self.status = getattr(code, "value", code)
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        SimpleHTTPRequestHandler.end_headers(self)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return SimpleHTTPRequestHandler.send_head(self)
+        content_type = self.guess_type(path)
+        encoding = None
+        if path.endswith(GZIP_SUFFIX):
+            # precompressed file requested directly: let the client decode it
+            encoding = "gzip"
+            content_type = self.guess_type(path[:-len(GZIP_SUFFIX)])
+        elif accepts_gzip(self.headers.get("Accept-Encoding")) and os.path.isfile(path + GZIP_SUFFIX):
+            (path, encoding) = (path + GZIP_SUFFIX, "gzip")
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        try:
+            st = os.fstat(f.fileno())
+            etag = entity_tag(st)
+            if self.not_modified(etag, st):
+                f.close()
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return None
+            byte_range = None
+            header = self.headers.get("Range")
+            if header is not None and encoding is None and self.headers.get("If-Range", etag) == etag:
+                byte_range = parse_range(header, st.st_size)
+            if byte_range == "unsatisfiable":
+                f.close()
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%s" % st.st_size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            if byte_range is None:
+                byte_range = (0, st.st_size - 1)
+                self.send_response(200)
+            else:
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %s-%s/%s" % (byte_range[0], byte_range[1], st.st_size))
+            self.send_header("Content-type", content_type)
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Content-Length", str(byte_range[1] - byte_range[0] + 1))
+            self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.byte_range = byte_range
+            return f
+        except:
+            f.close()
+            raise
+
+    def not_modified(self, etag, st):
+        "Whether the conditional headers of the request allow a 304 response."
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(st.st_mtime) <= since.timestamp()
+        return False
+
+    def copyfile(self, source, outputfile):
+        if self.byte_range is None:
+            # directory listings
+            data = source.read()
+            outputfile.write(data)
+            self.bytes_sent += len(data)
+            return
+        (start, end) = self.byte_range
+        count = end - start + 1
+        if count <= 0:
+            return
+        outputfile.flush()
+        self.bytes_sent += self.connection.sendfile(source, start, count)
+
+def make_server(directory, server_name="0.0.0.0", port=9999, verbose=True):
+    "VizServer for directory (not yet serving)."
+    handler_class = functools.partial(VizRequestHandler, directory=directory)
+    return VizServer((server_name, port), handler_class, verbose)
+
+def start_server(directory, server_name="127.0.0.1", port=9999, verbose=True):
+    "Serve directory from a daemon thread.  Returns the server; stop it with server.shutdown()."
+    httpd = make_server(directory, server_name, port, verbose)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+def serve(directory, server_name="0.0.0.0", port=9999, verbose=True):
+    "Serve directory until interrupted."
+    httpd = make_server(directory, server_name, port, verbose)
+    print("Serving", repr(directory), "at http://%s:%s/  Use CONTROL-C to terminate." % (server_name, port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping server:", httpd.statistics())
+    finally:
+        httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Directory to serve (default current directory).", nargs="?", default=".")
+    parser.add_argument("--port", help="Port to listen on (default 9999).", type=int, default=9999)
+    parser.add_argument("--quiet", help="Don't log requests.", action="store_true")
+    args = parser.parse_args()
+    serve(os.path.abspath(os.path.expanduser(args.directory)), port=args.port, verbose=not args.quiet)
@@ -8,7 +8,7 @@ readme = open('README.md').read()
 
 setup(
     name="radiation_viz",
-    packages=["radiation_viz"],
+    packages=["radiation_viz", "radiation_viz.benchmark"],
     version=version,
     description="Visualizations for astrophysical radiation simulation data",
     long_description=readme,
@@ -0,0 +1,16 @@
+import pytest
+from radiation_viz import dump_json_and_binary
+from radiation_viz.benchmark import synthetic
+
+@pytest.fixture(scope="session")
+def athdf_path(tmp_path_factory):
+    "A small synthetic .athdf file."
+    path = str(tmp_path_factory.mktemp("source") / "synthetic.athdf")
+    synthetic.write_athdf(path, num_blocks=8, block_size=(4, 4, 4), num_variables=1)
+    return path
+
+@pytest.fixture(scope="session")
+def expanded(athdf_path):
+    "Expanded BlockDescriptions of the synthetic file."
+    blocks = dump_json_and_binary.get_values_and_geometry(athdf_path, verbose=False)
+    return blocks.expand(verbose=False)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from radiation_viz import dump_json_and_binary
+from radiation_viz.dump_json_and_binary import ENCODINGS
+from .test_encodings import dump
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_block_directory(expanded, tmp_path, encoding):
+    (json_fn, bin_fn, json_value) = dump(expanded, tmp_path, encoding)
+    directory = json_value["block_directory"]
+    block_shape = expanded.values.shape[1:]
+    with open(str(tmp_path / bin_fn), "rb") as f:
+        data = f.read()
+    assert directory["offset"][0] == json_value["values_offset"]
+    assert directory["offset"][-1] + directory["length"][-1] == len(data)
+    for b in range(json_value["num_blocks"]):
+        (offset, length) = (directory["offset"][b], directory["length"][b])
+        encoded = np.frombuffer(data[offset: offset + length], dtype=encoding)
+        (m, scale) = (None, None)
+        if "block_offsets" in json_value:
+            (m, scale) = (json_value["block_offsets"][b], json_value["block_scales"][b])
+        block = dump_json_and_binary.decode_block(encoded, m, scale).reshape(block_shape)
+        error = np.abs(block.astype(np.float64) - expanded.values[b]).max()
+        assert error <= json_value.get("encoding_error", {}).get("max", 0.0) + 1e-6
+        assert directory["value_min"][b] == float(expanded.values[b].min())
+        assert directory["value_max"][b] == float(expanded.values[b].max())
+        assert directory["r_min"][b] == float(expanded.rs[b].min())
+        assert directory["phi_max"][b] == float(expanded.phis[b].max())
+
+def test_compressed_has_no_offsets(expanded, tmp_path):
+    (json_fn, bin_fn, json_value) = dump(expanded, tmp_path, "float16", compress=True)
+    directory = json_value["block_directory"]
+    assert "offset" not in directory and "length" not in directory
+    assert len(directory["value_min"]) == json_value["num_blocks"]
+    assert json_value["compression"] == "gzip"
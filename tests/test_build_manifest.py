@@ -0,0 +1,92 @@
+import os
+import shutil
+from radiation_viz import build_manifest
+from radiation_viz.build_manifest import BuildManifest
+
+def setup_outputs(directory, source_path, options=None, hash_contents=False):
+    "Write a fake output pair for source_path and record it in a saved manifest."
+    for (filename, data) in (("out.json", b"{}"), ("out.bin", b"0123456789")):
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(data)
+    identity = build_manifest.source_identity(source_path, hash_contents)
+    manifest = BuildManifest(directory)
+    manifest.update({"out": build_manifest.make_entry(
+        directory, ["out.json", "out.bin"], source_path, identity, "rho", 2, options)})
+    manifest.save()
+    return BuildManifest(directory)
+
+def stale_reason(manifest, source_path, variable="rho", skip=2, options=None, hash_contents=False):
+    identity = build_manifest.source_identity(source_path)
+    return manifest.stale_reason("out", source_path, identity, variable, skip, options, hash_contents)
+
+def test_current(athdf_path, tmp_path):
+    manifest = setup_outputs(str(tmp_path), athdf_path, {"encoding": "uint8"})
+    assert stale_reason(manifest, athdf_path, options={"encoding": "uint8"}) is None
+    assert manifest.stale_reason("other", athdf_path, build_manifest.source_identity(athdf_path), "rho", 2) == "not in manifest"
+
+def test_outputs(athdf_path, tmp_path):
+    manifest = setup_outputs(str(tmp_path), athdf_path)
+    with open(str(tmp_path / "out.bin"), "ab") as f:
+        f.write(b"more")
+    assert stale_reason(manifest, athdf_path) == "output files changed"
+    os.remove(str(tmp_path / "out.bin"))
+    assert stale_reason(manifest, athdf_path) == "missing output"
+
+def test_parameters(athdf_path, tmp_path):
+    manifest = setup_outputs(str(tmp_path), athdf_path, {"encoding": "uint8"})
+    assert stale_reason(manifest, athdf_path, variable="press", options={"encoding": "uint8"}) == "variable or skip changed"
+    assert stale_reason(manifest, athdf_path, skip=4, options={"encoding": "uint8"}) == "variable or skip changed"
+    assert stale_reason(manifest, athdf_path, options={"encoding": "float32"}) == "output options changed"
+    manifest.entries["out"]["pipeline_version"] = build_manifest.PIPELINE_VERSION - 1
+    assert stale_reason(manifest, athdf_path, options={"encoding": "uint8"}) == "pipeline version changed"
+
+def test_source(athdf_path, tmp_path):
+    source_path = str(tmp_path / "source.athdf")
+    shutil.copy(athdf_path, source_path)
+    manifest = setup_outputs(str(tmp_path), source_path)
+    st = os.stat(source_path)
+    os.utime(source_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert stale_reason(manifest, source_path) == "source modified"
+    with open(source_path, "ab") as f:
+        f.write(b"more")
+    assert stale_reason(manifest, source_path) == "source size changed"
+
+def test_hash_contents(athdf_path, tmp_path):
+    source_path = str(tmp_path / "source.athdf")
+    shutil.copy(athdf_path, source_path)
+    manifest = setup_outputs(str(tmp_path), source_path, hash_contents=True)
+    st = os.stat(source_path)
+    # touched but unchanged
+    os.utime(source_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert stale_reason(manifest, source_path, hash_contents=True) is None
+    # same size, different contents
+    with open(source_path, "r+b") as f:
+        f.seek(st.st_size - 1)
+        last = f.read(1)
+        f.seek(st.st_size - 1)
+        f.write(bytes([last[0] ^ 1]))
+    assert stale_reason(manifest, source_path, hash_contents=True) == "source contents changed"
+
+def test_damaged_manifest(tmp_path):
+    with open(str(tmp_path / build_manifest.MANIFEST_FILENAME), "w") as f:
+        f.write("{not json")
+    assert BuildManifest(str(tmp_path)).entries == {}
+
+def test_concurrent_saves(athdf_path, tmp_path):
+    "Runs which loaded the manifest before each other's saves keep all of the entries."
+    directory = str(tmp_path)
+    identity = build_manifest.source_identity(athdf_path)
+    (first, second) = (BuildManifest(directory), BuildManifest(directory))
+    for (manifest, prefix) in ((first, "first"), (second, "second")):
+        with open(os.path.join(directory, prefix + ".bin"), "wb") as f:
+            f.write(b"data")
+        manifest.update({prefix: build_manifest.make_entry(directory, [prefix + ".bin"], athdf_path, identity, "rho", 0)})
+    first.save()
+    second.save()
+    assert sorted(second.entries) == ["first", "second"]
+    assert sorted(BuildManifest(directory).entries) == ["first", "second"]
+    # entries updated again replace the saved ones
+    first.update({"first": dict(first.entries["first"], skip=2)})
+    first.save()
+    assert BuildManifest(directory).entries["first"]["skip"] == 2
+    assert "second" in BuildManifest(directory).entries
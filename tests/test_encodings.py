@@ -0,0 +1,50 @@
+import json
+import os
+import numpy as np
+import pytest
+from radiation_viz import dump_json_and_binary
+from radiation_viz.dump_json_and_binary import BlockDescriptions, ENCODINGS
+
+def dump(expanded, to_dir, encoding, compress=False):
+    "Write the expanded blocks with dump_files.  Returns (json_fn, bin_fn, json value)."
+    blocks = BlockDescriptions(expanded.rs, expanded.thetas, expanded.phis, np.array(expanded.values))
+    (json_fn, bin_fn) = blocks.dump_files(str(to_dir), "test", verbose=False, encoding=encoding, compress=compress)
+    with open(os.path.join(str(to_dir), json_fn)) as f:
+        json_value = json.load(f)
+    return (json_fn, bin_fn, json_value)
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_round_trip(expanded, tmp_path, encoding, compress):
+    (json_fn, bin_fn, json_value) = dump(expanded, tmp_path, encoding, compress)
+    assert bin_fn.endswith(".bin.gz" if compress else ".bin")
+    assert dump_json_and_binary.binary_prefix(bin_fn) == "test"
+    loaded = dump_json_and_binary.load_files(str(tmp_path / json_fn))
+    for name in ("rs", "thetas", "phis"):
+        assert np.array_equal(getattr(loaded, name), getattr(expanded, name))
+    assert loaded.values.shape == expanded.values.shape
+    error = np.abs(loaded.values.astype(np.float64) - expanded.values).max()
+    if encoding == "float32":
+        assert error == 0
+        assert "encoding_error" not in json_value
+    else:
+        assert error <= json_value["encoding_error"]["max"] + 1e-6
+        assert json_value["encoding_error"]["rms"] <= json_value["encoding_error"]["max"]
+    assert json_value["intensity_min"] == float(expanded.values.min())
+    assert json_value["intensity_max"] == float(expanded.values.max())
+
+def test_other_suffix_removed(expanded, tmp_path):
+    dump(expanded, tmp_path, "uint8", compress=True)
+    dump(expanded, tmp_path, "uint8", compress=False)
+    assert sorted(os.listdir(str(tmp_path))) == ["test.bin", "test.json"]
+
+def test_constant_block():
+    block = np.full((2, 3, 4), 1.5, dtype=np.float32)
+    for encoding in ENCODINGS:
+        (encoded, offset, scale) = dump_json_and_binary.encode_block(block, encoding)
+        assert np.array_equal(dump_json_and_binary.decode_block(encoded, offset, scale), block)
+
+def test_shuffle_bytes():
+    array = np.arange(10, dtype=np.float32)
+    data = dump_json_and_binary.shuffle_bytes(array)
+    assert np.array_equal(dump_json_and_binary.unshuffle_bytes(data, np.float32), array)
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+from radiation_viz import dump_json_and_binary, expand_blocks
+
+def test_parallel_expand(athdf_path, expanded):
+    blocks = dump_json_and_binary.get_values_and_geometry(athdf_path, verbose=False)
+    parallel = blocks.expand(verbose=False, workers=2)
+    assert np.array_equal(parallel.values, expanded.values)
+    for name in ("rs", "thetas", "phis"):
+        assert np.array_equal(getattr(parallel, name), getattr(expanded, name))
+
+def test_staged_expand(athdf_path, expanded, tmp_path):
+    "Values expanded into the staged binary are moved into place by dump_files."
+    blocks = dump_json_and_binary.get_values_and_geometry(athdf_path, verbose=False)
+    staged = blocks.expand(verbose=False, out_path=str(tmp_path / "staged.bin.partial"))
+    assert staged.values.dtype == np.float32
+    (json_fn, bin_fn) = staged.dump_files(str(tmp_path), "staged", verbose=False)
+    assert sorted(os.listdir(str(tmp_path))) == ["staged.bin", "staged.json"]
+    loaded = dump_json_and_binary.load_files(str(tmp_path / json_fn))
+    assert np.array_equal(loaded.values, expanded.values)
+    assert np.array_equal(loaded.rs, expanded.rs)
+
+def border_index(interpolator, tolerance=None):
+    "BorderIndex of the lower borders of the blocks of an InterpolateBlocks."
+    borders = [b.lower_border() for b in interpolator.blocks]
+    (points, values) = [np.concatenate([border[i] for border in borders]) for i in range(2)]
+    return (points, values, expand_blocks.BorderIndex(points, values, tolerance=tolerance))
+
+def test_border_index_matches_exact_table(athdf_path):
+    "With exactly matching coordinates the tolerant table is the exact table, so outputs are unchanged."
+    interpolator = dump_json_and_binary.get_values_and_geometry(athdf_path, verbose=False).interpolator()
+    (points, values, exact) = border_index(interpolator)
+    tolerant = interpolator.borders
+    assert tolerant.tolerance.min() > 0
+    assert np.array_equal(tolerant.keys, exact.keys)
+    assert np.array_equal(tolerant.values, exact.values)
+    (found, hit) = tolerant.lookup(points)
+    assert hit.all()
+    assert np.array_equal(found, values)
+    assert all(tolerant.lookup_point(p) == v for (p, v) in zip(points[:50], values[:50]))
+
+def test_border_index_tolerance(athdf_path):
+    "Coordinates a few ulps away hit a tolerant table but not an exact one."
+    interpolator = dump_json_and_binary.get_values_and_geometry(athdf_path, verbose=False).interpolator()
+    (points, values, exact) = border_index(interpolator)
+    tolerant = interpolator.borders
+    nudged = np.nextafter(np.nextafter(points, np.inf), np.inf)
+    assert not exact.lookup(nudged)[1].any()
+    assert exact.lookup_point(nudged[0]) is None
+    (found, hit) = tolerant.lookup(nudged)
+    assert hit.all()
+    assert np.array_equal(found, values)
+    assert tolerant.lookup_point(nudged[0]) == values[0]
+    # a point off by more than the tolerance is still a miss
+    (found, hit) = tolerant.lookup(points + 10 * tolerant.tolerance)
+    assert not hit.any()
+
+def test_border_index_repeated_points():
+    "Later entries win for repeated points (within tolerance), like dict.update."
+    points = np.array([[1.0, 2.0, 3.0], [1.0 + 1e-12, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    index = expand_blocks.BorderIndex(points, np.array([1.0, 2.0, 3.0]), tolerance=[1e-9, 1e-9, 1e-9])
+    (found, hit) = index.lookup(points)
+    assert hit.all()
+    assert list(found) == [2.0, 2.0, 3.0]
+    exact = expand_blocks.BorderIndex(points, np.array([1.0, 2.0, 3.0]))
+    assert list(exact.lookup(points)[0]) == [1.0, 2.0, 3.0]
@@ -0,0 +1,29 @@
+import json
+import numpy as np
+from radiation_viz import isosurface
+
+def test_sphere():
+    "The isosurface of the radius over a spherical shell is a closed sphere of that radius."
+    isosurface.test_sphere()
+
+def test_write_and_load(expanded, tmp_path):
+    levels = isosurface.even_levels(expanded, 2)
+    meshes = isosurface.isosurfaces(expanded, levels)
+    (json_fn, bin_fn) = isosurface.write_meshes(expanded, str(tmp_path), "test", levels, verbose=False)
+    assert (json_fn, bin_fn) == ("test.mesh.json", "test.mesh")
+    with open(str(tmp_path / json_fn)) as f:
+        index = json.load(f)["levels"]
+    loaded = isosurface.load_meshes(str(tmp_path / json_fn))
+    assert len(loaded) == len(levels)
+    for (entry, (level, vertices, triangles), (expected_vertices, expected_triangles)) in zip(index, loaded, meshes):
+        assert len(expected_triangles) > 0
+        assert entry["positions_offset"] % 4 == 0 and entry["indices_offset"] % 4 == 0
+        assert np.array_equal(triangles, expected_triangles)
+        assert np.abs(vertices - expected_vertices).max() <= entry["max_position_error"] + 1e-6
+
+def test_parallel(expanded):
+    levels = isosurface.even_levels(expanded, 1)
+    [(vertices, triangles)] = isosurface.isosurfaces(expanded, levels)
+    [(parallel_vertices, parallel_triangles)] = isosurface.isosurfaces(expanded, levels, workers=2)
+    assert np.array_equal(vertices, parallel_vertices)
+    assert np.array_equal(triangles, parallel_triangles)
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from radiation_viz import render_frames, viz_config
+from radiation_viz.render_frames import Camera, FrameRenderer
+
+def test_render_sphere():
+    "A sphere rendered from +z fills a centered disk facing the camera."
+    size = 64
+    shell = np.broadcast_to(np.linspace(1, 2, 13)[:, None, None], (13, 13, 25))
+    (vertices, triangles) = render_frames.isosurface.block_isosurface(
+        shell, np.linspace(1, 2, 13), np.linspace(0, np.pi, 13), np.linspace(0, 2 * np.pi, 25), 1.5)
+    camera = Camera.looking_at(np.zeros(3), 1.5, size, size)
+    image = render_frames.render_mesh(vertices, triangles, camera)
+    assert image.shape == (size, size, 3)
+    covered = image.any(axis=2)
+    center = size // 2
+    assert covered[center, center]
+    assert not covered[0, 0] and not covered[-1, -1]
+    # the nearest point faces the camera: normal (0, 0, 1) is colored (128, 128, 255)
+    assert np.abs(image[center, center].astype(int) - [128, 128, 255]).max() < 20
+    # the disk covers about the projected area of the sphere
+    assert 0.1 < covered.mean() < 0.9
+
+def test_chunked_rasterizer():
+    "Rasterizing in small chunks gives the same image."
+    (vertices, triangles) = render_frames.isosurface.block_isosurface(
+        np.broadcast_to(np.linspace(1, 2, 7)[:, None, None], (7, 7, 13)),
+        np.linspace(1, 2, 7), np.linspace(0, np.pi, 7), np.linspace(0, 2 * np.pi, 13), 1.5)
+    camera = Camera.looking_at(np.zeros(3), 1.5, 32, 32)
+    image = render_frames.render_mesh(vertices, triangles, camera)
+    assert np.array_equal(render_frames.render_mesh(vertices, triangles, camera, chunk_size=100), image)
+
+def test_empty_mesh():
+    camera = Camera.looking_at(np.zeros(3), 1.0, 16, 8)
+    image = render_frames.render_mesh(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64), camera)
+    assert image.shape == (8, 16, 3)
+    assert not image.any()
+
+@pytest.fixture
+def outputs(expanded, tmp_path):
+    "A visualization directory with two frames of the synthetic data listed in its config."
+    data_directory = tmp_path / viz_config.DATA_SUBDIRECTORY
+    data_directory.mkdir()
+    pairs = []
+    for index in range(2):
+        metadata = {"variable": "rho", "time": float(index), "skip": 0}
+        pairs.append(expanded.dump_files(str(data_directory), "frame.%05d" % index, verbose=False, metadata=metadata))
+    viz_config.VizConfig(str(tmp_path), viz_config.DATA_SUBDIRECTORY).update_outputs(pairs)
+    return tmp_path
+
+@pytest.mark.parametrize("mode", render_frames.MODES)
+def test_render_frames(outputs, tmp_path, mode):
+    paths = render_frames.config_outputs(str(outputs))
+    assert [os.path.basename(path) for path in paths] == ["frame.00000.json", "frame.00001.json"]
+    frames = [(path, str(tmp_path / ("%s_%s.png" % (mode, index)))) for (index, path) in enumerate(paths)]
+    renderer = FrameRenderer(None, 48, 32, mode, volume_side=16, cache_dir=str(tmp_path / "cache"))
+    summary = render_frames.render_frames(renderer, frames, workers=2, verbose=False)
+    assert summary["frames"] == 2 and summary["workers"] == 2
+    images = [np.asarray(Image.open(png_path)) for (json_path, png_path) in frames]
+    for image in images:
+        assert image.shape == (32, 48, 3)
+        assert image.any()
+    # the frames have the same values
+    assert np.array_equal(images[0], images[1])
+    # worker processes render the same image
+    (image, statistics) = renderer.render(paths[0])
+    assert np.array_equal(image, images[0])
@@ -0,0 +1,32 @@
+import h5py
+import numpy as np
+from radiation_viz import dump_json_and_binary
+from radiation_viz.benchmark import synthetic
+
+def test_mesh_blocks():
+    root = (2, 2, 4)
+    assert len(synthetic.mesh_blocks(root)) == 16
+    # the blocks of the innermost radial layer each split into 8 children per level
+    assert len(synthetic.mesh_blocks(root, 1)) == 8 + 8 * 8
+    assert len(synthetic.mesh_blocks(root, 2)) == 8 + 32 + 32 * 8
+
+def test_blocks_cover_domain():
+    root = (2, 2, 4)
+    blocks = synthetic.mesh_blocks(root, 2)
+    faces = synthetic.block_faces(blocks, root, (4, 4, 4))
+    volume = np.prod([(f[:, -1] - f[:, 0]).astype(np.float64) for f in faces], axis=0).sum()
+    assert np.isclose(volume, 2.0 * np.pi * 2 * np.pi)
+
+def test_write_athdf(tmp_path):
+    path = str(tmp_path / "levels.athdf")
+    description = synthetic.write_athdf(path, num_blocks=8, block_size=(4, 4, 4), levels=1, num_variables=7, time=2.5)
+    assert description["num_blocks"] == 8 + 8 * 8
+    with h5py.File(path, "r") as f:
+        assert list(f.attrs["NumVariables"]) == [5, 2]
+        assert f["aux1"].shape == (2, description["num_blocks"], 4, 4, 4)
+        assert f.attrs["Time"] == 2.5
+    blocks = dump_json_and_binary.get_values_and_geometry(path, "aux1", 1, verbose=False)
+    assert blocks.values.shape == (description["num_blocks"], 4, 4, 4)
+    expanded = blocks.expand(verbose=False)
+    assert expanded.values.shape == (description["num_blocks"], 5, 5, 5)
+    assert np.isfinite(expanded.values).all()
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from radiation_viz import time_series
+from radiation_viz.dump_json_and_binary import BlockDescriptions
+
+def drifting_frames(expanded, num_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    values = np.array(expanded.values)
+    return [(values + 0.01 * i * rng.normal(size=values.shape)).astype(np.float32) for i in range(num_frames)]
+
+@pytest.mark.parametrize("delta_encoding", time_series.DELTA_ENCODINGS)
+def test_round_trip(expanded, tmp_path, delta_encoding):
+    frames = drifting_frames(expanded, 7)
+    writer = time_series.SeriesWriter(str(tmp_path), "series", 3, delta_encoding, verbose=False)
+    for (i, frame) in enumerate(frames):
+        writer.add(BlockDescriptions(expanded.rs, expanded.thetas, expanded.phis, frame), time=0.1 * i)
+    (json_fn, bin_fn) = writer.close()
+    assert bin_fn == "series.series"
+    series = time_series.TimeSeries(str(tmp_path / json_fn))
+    assert len(series) == len(frames)
+    assert np.array_equal(series.rs, expanded.rs)
+    assert [info["keyframe"] for info in series.frames] == [0, 0, 0, 3, 3, 3, 6]
+    decoded = list(series.iterate_values())
+    for (i, frame) in enumerate(frames):
+        info = series.frames[i]
+        assert info["time"] == pytest.approx(0.1 * i)
+        assert np.array_equal(series.frame_values(i), decoded[i])
+        assert np.abs(decoded[i] - frame).max() <= info["max_error"] + 1e-6
+        if info["keyframe"] == i:
+            assert info["max_error"] == 0.0
+            assert np.array_equal(decoded[i], frame)
+    # starting between keyframes decodes from the earlier keyframe
+    assert np.array_equal(list(series.iterate_values(4, 6))[0], decoded[4])
+
+def test_tolerance_forces_keyframe(expanded, tmp_path):
+    frames = drifting_frames(expanded, 2)
+    frames[1] = frames[1] + np.float32(1000.0) * (np.arange(frames[1].size) % 2).reshape(frames[1].shape).astype(np.float32)
+    writer = time_series.SeriesWriter(str(tmp_path), "series", 10, "int8", tolerance=1e-6, verbose=False)
+    for frame in frames:
+        writer.add(BlockDescriptions(expanded.rs, expanded.thetas, expanded.phis, frame))
+    (json_fn, bin_fn) = writer.close()
+    series = time_series.TimeSeries(str(tmp_path / json_fn))
+    assert series.frames[1]["keyframe"] == 1
+    assert np.array_equal(series.frame_values(1), frames[1])
+
+def test_mesh_must_match(expanded, tmp_path):
+    writer = time_series.SeriesWriter(str(tmp_path), "series", verbose=False)
+    writer.add(expanded)
+    with pytest.raises(AssertionError):
+        writer.add(BlockDescriptions(expanded.rs + 1, expanded.thetas, expanded.phis, expanded.values))
@@ -0,0 +1,115 @@
+import gzip
+import http.client
+import time
+import pytest
+from radiation_viz import viz_server
+
+DATA = bytes(range(256)) * 4
+
+@pytest.fixture
+def server(tmp_path):
+    with open(str(tmp_path / "data.bin"), "wb") as f:
+        f.write(DATA)
+    with open(str(tmp_path / "values.json"), "w") as f:
+        f.write('{"plain": true}')
+    with gzip.open(str(tmp_path / "values.json.gz"), "wb") as f:
+        f.write(b'{"compressed": true}')
+    httpd = viz_server.start_server(str(tmp_path), "127.0.0.1", 0, verbose=False)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def get(httpd, path, headers=None, method="GET"):
+    connection = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+    try:
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+        return (response, response.read())
+    finally:
+        connection.close()
+
+def test_parse_range():
+    assert viz_server.parse_range("bytes=0-9", 100) == (0, 9)
+    assert viz_server.parse_range("bytes=90-", 100) == (90, 99)
+    assert viz_server.parse_range("bytes=90-200", 100) == (90, 99)
+    assert viz_server.parse_range("bytes=-10", 100) == (90, 99)
+    assert viz_server.parse_range("bytes=-200", 100) == (0, 99)
+    assert viz_server.parse_range("bytes=100-", 100) == "unsatisfiable"
+    assert viz_server.parse_range("bytes=-0", 100) == "unsatisfiable"
+    assert viz_server.parse_range("bytes=5-2", 100) == "unsatisfiable"
+    assert viz_server.parse_range("bytes=0-1,5-6", 100) is None
+    assert viz_server.parse_range("items=0-1", 100) is None
+
+def test_whole_file(server):
+    (response, body) = get(server, "/data.bin")
+    assert response.status == 200
+    assert body == DATA
+    assert response.getheader("Accept-Ranges") == "bytes"
+    assert response.getheader("ETag")
+
+def test_range(server):
+    (response, body) = get(server, "/data.bin", {"Range": "bytes=10-19"})
+    assert response.status == 206
+    assert body == DATA[10:20]
+    assert response.getheader("Content-Range") == "bytes 10-19/%s" % len(DATA)
+    (response, body) = get(server, "/data.bin", {"Range": "bytes=-5"})
+    assert response.status == 206
+    assert body == DATA[-5:]
+
+def test_unsatisfiable(server):
+    (response, body) = get(server, "/data.bin", {"Range": "bytes=%s-" % len(DATA)})
+    assert response.status == 416
+    assert body == b""
+    assert response.getheader("Content-Range") == "bytes */%s" % len(DATA)
+
+def test_etag(server):
+    (response, body) = get(server, "/data.bin")
+    etag = response.getheader("ETag")
+    (response, body) = get(server, "/data.bin", {"If-None-Match": etag})
+    assert response.status == 304
+    assert body == b""
+    (response, body) = get(server, "/data.bin", {"If-None-Match": '"other"'})
+    assert response.status == 200
+
+def test_if_range(server):
+    (response, body) = get(server, "/data.bin", {"Range": "bytes=0-3", "If-Range": '"stale"'})
+    assert response.status == 200
+    assert body == DATA
+    etag = response.getheader("ETag")
+    (response, body) = get(server, "/data.bin", {"Range": "bytes=0-3", "If-Range": etag})
+    assert response.status == 206
+    assert body == DATA[:4]
+
+def test_head(server):
+    (response, body) = get(server, "/data.bin", method="HEAD")
+    assert response.status == 200
+    assert body == b""
+    assert response.getheader("Content-Length") == str(len(DATA))
+
+def test_gzip(server):
+    (response, body) = get(server, "/values.json")
+    assert response.getheader("Content-Encoding") is None
+    assert body == b'{"plain": true}'
+    (response, body) = get(server, "/values.json", {"Accept-Encoding": "gzip, deflate"})
+    assert response.getheader("Content-Encoding") == "gzip"
+    assert response.getheader("Vary") == "Accept-Encoding"
+    assert gzip.decompress(body) == b'{"compressed": true}'
+    (response, body) = get(server, "/values.json", {"Accept-Encoding": "gzip;q=0"})
+    assert response.getheader("Content-Encoding") is None
+    # ranges apply to the identity encoding only
+    (response, body) = get(server, "/values.json", {"Accept-Encoding": "gzip", "Range": "bytes=0-1"})
+    assert response.status == 200
+
+def test_statistics(server):
+    get(server, "/data.bin", {"Range": "bytes=0-9"})
+    # the request is recorded with its timing after the response is sent
+    deadline = time.time() + 5
+    while server.statistics()["requests"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    statistics = server.statistics()
+    assert statistics["requests"] == 1
+    assert statistics["bytes_sent"] == 10
+
+def test_missing(server):
+    (response, body) = get(server, "/missing.bin")
+    assert response.status == 404